@@ -7,6 +7,7 @@ from config import basedir
 
 from app.database.dbtools import    (
                                         dbGetDatabase,
+                                        dbReleaseDatabase,
                                         dbGetAll,
                                         dbMakeDict,
                                     )
@@ -18,11 +19,15 @@ app.config.from_object('config')
 lm = LoginManager()
 lm.init_app(app)
 
+# one pooled DB connection per request, given back at teardown
+app.teardown_appcontext(dbReleaseDatabase)
+
 # global static init lists and db
 languages=sorted(list(dbGetAll('language')))
 languagesDict=dbMakeDict(languages,'tag')
 booktypes=sorted(list(dbGetAll('booktype')))
 booktypesDict=dbMakeDict(booktypes,'tag')
+dbReleaseDatabase()
 
 # this must be AFTER the above, otherwise 'db' is circularly not found in the imports
 from app import views
@@ -0,0 +1,108 @@
+'''
+    dbpool.py : reuse of open DB connections.
+
+    Opening a connection means opening the file and having sqlite
+    parse the schema: a bounded pool of idle connections is kept
+    per worker process and connections are handed out to requests
+    (one per request, see dbtools.dbGetDatabase) and to the
+    non-request code (one per thread: scripts, background jobs).
+'''
+
+import os
+import threading
+from orm import Database
+
+class DatabasePool():
+    '''
+        A bounded pool of orm Database objects on a given DB file.
+
+        At most 'poolSize' idle connections are kept, the exceeding
+        ones are closed upon release. A forked process
+        does not reuse the connections of its parent, and idle
+        connections are dropped if the DB file gets replaced.
+    '''
+    def __init__(self, dbFile, poolSize):
+        self.dbFile=dbFile
+        self.poolSize=poolSize
+        self.lock=threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.pid=os.getpid()
+        self.fileIdentity=self._getFileIdentity()
+        self.idle=[]
+        self.counters={
+            'opened': 0,
+            'reused': 0,
+            'released': 0,
+            'closed': 0,
+        }
+
+    def _getFileIdentity(self):
+        try:
+            fileStat=os.stat(self.dbFile)
+            return (fileStat.st_dev,fileStat.st_ino)
+        except OSError:
+            return None
+
+    def _checkProcess(self):
+        '''
+            Connections inherited through a fork must not be used (nor closed)
+            by the child process: they are simply forgotten.
+            Idle connections to a file which has since been
+            deleted/replaced are closed.
+            To be called with the lock held.
+        '''
+        if os.getpid()!=self.pid:
+            self._reset()
+        else:
+            fileIdentity=self._getFileIdentity()
+            if fileIdentity!=self.fileIdentity:
+                self.fileIdentity=fileIdentity
+                for db in self.idle:
+                    db.close()
+                    self.counters['closed']+=1
+                self.idle=[]
+
+    def acquire(self):
+        '''
+            Returns an idle connection if any, otherwise a new one
+        '''
+        with self.lock:
+            self._checkProcess()
+            if self.idle:
+                self.counters['reused']+=1
+                return self.idle.pop()
+            self.counters['opened']+=1
+        # connections can end up in other threads once released,
+        # but they are used by a single holder at a time
+        return Database(self.dbFile, check_same_thread=False)
+
+    def release(self, db):
+        '''
+            Gives back a connection to the pool.
+            Uncommitted changes are rolled back, as would happen
+            when closing the connection.
+        '''
+        if db.connected:
+            db.connection.rollback()
+        with self.lock:
+            if os.getpid()!=self.pid:
+                # not ours
+                return
+            if len(self.idle)<self.poolSize:
+                self.idle.append(db)
+                self.counters['released']+=1
+                return
+            self.counters['closed']+=1
+        db.close()
+
+    def stats(self):
+        '''
+            Returns the usage counters and the number of idle connections
+        '''
+        with self.lock:
+            self._checkProcess()
+            poolStats=dict(self.counters)
+            poolStats['idle']=len(self.idle)
+            return poolStats
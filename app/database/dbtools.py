@@ -1,17 +1,28 @@
 # dbtools.py : library to interface with the database
 
 from functools import reduce
+from contextlib import contextmanager
+import copy
+import heapq
 from operator import mul
-from orm import Database
+from flask import g, has_app_context
 import os
+import threading
 from werkzeug.datastructures import ImmutableMultiDict
 from pytz import timezone
+from orm import attrs, DATA_TYPES
 from datetime import datetime
 import time
 
 from config import (
     DB_DIRECTORY,
     DB_NAME,
+    DB_POOL_SIZE,
+    DB_BULK_CACHE_SIZE,
+    QUERY_CACHE_ENTRIES,
+    QUERY_CACHE_BYTES,
+    JOB_WORKERS,
+    JOBS_DB_NAME,
     DATETIME_STR_FORMAT,
     ALLOW_DUPLICATE_BOOKS,
     USERS_TIMEZONE,
@@ -22,7 +33,6 @@ from config import (
 from app.utils.stringlists import   (
                                         rollStringList,
                                         unrollStringList,
-                                        addToStringList,
                                         expungeFromStringList,
                                     )
 from app.utils.string_vectorizer import (
@@ -39,7 +49,53 @@ from app.database.models import (
                                     Statistic,
                                     House,
                                 )
-from app.statistics.statistics import statFromBook, statFromAuthor
+from app.database.dbpool import DatabasePool
+from app.database.refcache import ReferenceCache
+from app.database.jobs import JobRunner
+from app.database.querycache import QueryResultCache, normalizedQueryArgs
+from app.database.titleindex import dbIndexBookTitle, dbUnindexBookTitle, dbIndexNewBookTitles
+from app.database.vectorstore import (
+                                        bookVectors,
+                                        authorVectors,
+                                        dbStoreVectors,
+                                        dbStoreNewVectors,
+                                        dbDeleteVectors,
+                                        dbLoadVectors,
+                                    )
+from app.database.lshindex import dbIndexLsh, dbIndexNewLsh, dbUnindexLsh, dbLshCandidates
+from app.database.querycompiler import (
+                                            compileQuery,
+                                            compileBookFilter,
+                                            compileBookSorter,
+                                            compileAuthorFilter,
+                                            compileAuthorSorter,
+                                            orderByClause,
+                                            keysetCondition,
+                                            encodeCursor,
+                                        )
+from app.statistics.statistics import statFromBook, statFromAuthor, sortStatistics
+
+# per-process pool of connections and per-thread connection outside of requests
+dbPool=DatabasePool(os.path.join(DB_DIRECTORY,DB_NAME),DB_POOL_SIZE)
+_threadDatabase=threading.local()
+
+# statistic deltas being accumulated, per connection (see dbStatisticsBatch)
+_statisticBatches={}
+
+def _dbApplyStatisticDeltas(db,statDeltas):
+    '''
+        Adds the deltas (name,subtype) -> delta to the Statistic table,
+        one keyed UPSERT per statistic (unique index on name, subtype)
+    '''
+    db.connection.executemany(
+        'INSERT INTO Statistic (name, subtype, value) VALUES (?,?,?) '
+        'ON CONFLICT (name, subtype) DO UPDATE SET value=value+excluded.value',
+        [
+            (statName,statSubtype,delta)
+            for (statName,statSubtype),delta in statDeltas.items()
+            if delta!=0
+        ],
+    )
 
 def dbIncrementStatistic(db,statDeltasMinus,statDeltasPlus):
     '''
@@ -49,7 +105,8 @@ def dbIncrementStatistic(db,statDeltasMinus,statDeltasPlus):
         hence it does not invoke any commit()
 
         statDeltas' are maps of: (name,subtype) -> delta
-        and are going to be algebraically summed
+        and are going to be algebraically summed.
+        Within a dbStatisticsBatch the changes are only accumulated.
     '''
     # prepare a map of the plus-minus pruning zeroes
     statDeltas={
@@ -61,26 +118,108 @@ def dbIncrementStatistic(db,statDeltasMinus,statDeltasPlus):
         if w!=0
     }
     #
-    Statistic.db=db
-    keysDone=set()
-    # all items already present -> updates
-    for stat in Statistic.manager(db).all():
-        thisKey=(stat.name,stat.subtype)
-        if thisKey in statDeltas:
-            stat.value+=statDeltas[thisKey]
-            keysDone.add(thisKey)
-            stat.update()
-    # new items -> create
-    for newKey in set(statDeltas.keys())-keysDone:
-        nStat=Statistic(name=newKey[0],subtype=newKey[1],value=statDeltas[newKey])
-        nStat.save()
+    statBatch=_statisticBatches.get(id(db))
+    if statBatch is not None:
+        for statKey,delta in statDeltas.items():
+            statBatch[statKey]=statBatch.get(statKey,0)+delta
+    else:
+        _dbApplyStatisticDeltas(db,statDeltas)
+
+@contextmanager
+def dbStatisticsBatch(db):
+    '''
+        Context manager for bulk operations (imports, mass deletions):
+        the statistic changes made on db within the block are summed
+        and written once at its end. As dbIncrementStatistic,
+        it does not commit. Nested batches join the outer one.
+        If the block raises, the changes are dropped (the caller
+        is to roll back the rest of the transaction).
+    '''
+    if id(db) in _statisticBatches:
+        yield
+    else:
+        _statisticBatches[id(db)]={}
+        try:
+            yield
+        except:
+            _statisticBatches.pop(id(db))
+            raise
+        _dbApplyStatisticDeltas(db,_statisticBatches.pop(id(db)))
 
 def dbGetDatabase():
     '''
-        Opens a DB connection and returns a cursor on it
+        Returns a DB connection taken from the pool:
+        within a request, the same connection is returned
+        for the whole request (it is stored on flask.g
+        and given back by the teardown hook dbReleaseDatabase);
+        outside of requests (scripts, background jobs),
+        each thread keeps its own connection until it calls
+        dbReleaseDatabase.
+    '''
+    if has_app_context():
+        if 'database' not in g:
+            g.database=dbPool.acquire()
+        return g.database
+    else:
+        if getattr(_threadDatabase,'pid',None)!=os.getpid():
+            # nothing acquired yet (or acquired by the parent before a fork)
+            _threadDatabase.pid=os.getpid()
+            _threadDatabase.database=dbPool.acquire()
+        return _threadDatabase.database
+
+def dbReleaseDatabase(exception=None):
     '''
-    dbFile=os.path.join(DB_DIRECTORY,DB_NAME)    
-    return Database(dbFile)
+        Gives back to the pool the connection held by the current
+        request (or thread). Any uncommitted change is discarded.
+        Registered as app-context teardown hook.
+    '''
+    if has_app_context():
+        db=g.pop('database',None)
+    else:
+        if getattr(_threadDatabase,'pid',None)==os.getpid():
+            db=_threadDatabase.database
+        else:
+            db=None
+        _threadDatabase.pid=None
+        _threadDatabase.database=None
+    if db is not None:
+        dbPool.release(db)
+
+# background jobs: each worker thread gives back its connection after a job
+jobRunner=JobRunner(
+    os.path.join(DB_DIRECTORY,JOBS_DB_NAME),
+    JOB_WORKERS,
+    threadTeardown=dbReleaseDatabase,
+)
+
+def dbSubmitJob(kind,userId,function,*args):
+    '''
+        Enqueues a background job, see jobs.JobRunner.
+        Returns the job id.
+    '''
+    return jobRunner.submit(kind,userId,function,*args)
+
+def dbGetJob(jobId):
+    '''
+        Returns the status of a background job (a dict), None if not found
+    '''
+    return jobRunner.get(jobId)
+
+def _paginationResult(ntotal,startfrom,nresults):
+    '''
+        Prepares the result dict of a query (see dbTableFilterQuery)
+        given the total number of matches and the slicing arguments
+    '''
+    result={'ntotal': ntotal}
+    result['firstitem']=startfrom
+    result['lastitem']=min(ntotal,startfrom+nresults)-1
+    if startfrom>0:
+        result['prevstartfrom']=max(0,startfrom-nresults)
+    if ntotal>startfrom+nresults:
+        result['nextstartfrom']=startfrom+nresults
+    if result['lastitem']<startfrom:
+        result['firstitem']=-1
+    return result
 
 def dbTableFilterQuery( tableName, startfrom=0,
                         nresults=100, filterList=[],
@@ -110,24 +249,244 @@ def dbTableFilterQuery( tableName, startfrom=0,
         reslist=sorted(qlist)
     else:
         reslist=list(sorted(qlist,key= lambda bk: sorter(bk,wholeFilters)))
-    # determine numbers
-    result={'ntotal': len(reslist)}
-    result['firstitem']=startfrom
-    result['lastitem']=min(len(reslist),startfrom+nresults)-1
-    if startfrom>0:
-        result['prevstartfrom']=max(0,startfrom-nresults)
-    if len(reslist)>startfrom+nresults:
-        result['nextstartfrom']=startfrom+nresults
-    # trim section of interest from list
+    # determine numbers and trim section of interest from list
+    result=_paginationResult(len(reslist),startfrom,nresults)
     trimmedlist=reslist[startfrom:startfrom+nresults]
-    if len(trimmedlist)==0:
+    return (result,trimmedlist)
+
+def _selectClause(columns):
+    '''
+        the SELECT list reading only the given columns (and the id),
+        or all of them if columns is None
+    '''
+    if columns is None:
+        return '*'
+    else:
+        return ', '.join(['id']+[column for column in columns if column!='id'])
+
+def _dbKeysetPage(db,qModel,compiledQuery,whereClause,params,ntotal,nresults,columns=None):
+    '''
+        The page following (or preceding) the cursor of a compiled query
+        with no python filters, in the same format as dbCompiledFilterQuery.
+        Only the rows of the page (plus one, to know if there are more)
+        are read, seeking the sorting index to the cursor position.
+        If going back reaches the beginning, the first page is returned.
+    '''
+    cursor=compiledQuery['cursor']
+    sortKeys=compiledQuery['sortkeys']
+    reverse=cursor['direction']=='prev'
+    keysetWhere,keysetParams=keysetCondition(sortKeys,cursor['keys'],reverse=reverse)
+    rows=db.execute(
+        'SELECT %s FROM %s WHERE %s AND %s ORDER BY %s LIMIT ?' % (
+            _selectClause(columns),
+            qModel.__name__,
+            whereClause,
+            keysetWhere,
+            orderByClause(sortKeys,reverse=reverse),
+        ),
+        *(params+keysetParams+[nresults+1])
+    ).fetchall()
+    if reverse:
+        if len(rows)<=nresults:
+            return None
+        pageRows=rows[nresults-1::-1]
+        hasNext=True
+    else:
+        pageRows=rows[:nresults]
+        hasNext=len(rows)>nresults
+    # in both directions there are items before the page
+    position=max(1,cursor['position'])
+    mgr=qModel.manager(db)
+    result={
+        'ntotal': ntotal,
+        'firstitem': position,
+        'lastitem': position+len(pageRows)-1,
+        'prevstartfrom': max(0,position-nresults),
+    }
+    if hasNext and len(pageRows)>0:
+        result['nextstartfrom']=position+len(pageRows)
+    if len(pageRows)==0:
         result['firstitem']=-1
+    return (result,[mgr.create(**row) for row in pageRows])
+
+def _cursorStart(db,qModel,compiledQuery,whereClause,params,resIds,nresults):
+    '''
+        Index, in the in-memory results (ids) of a query with python filters,
+        of the first item of the page requested with a cursor
+    '''
+    cursor=compiledQuery['cursor']
+    reverse=cursor['direction']=='prev'
+    keysetWhere,keysetParams=keysetCondition(compiledQuery['sortkeys'],cursor['keys'],reverse=reverse)
+    matchingIds={
+        row[0]
+        for row in db.execute(
+            'SELECT id FROM %s WHERE %s AND %s' % (qModel.__name__,whereClause,keysetWhere),
+            *(params+keysetParams)
+        ).fetchall()
+    }
+    if reverse:
+        # the items before the cursor are the leading ones
+        pageEnd=next((index for index,objId in enumerate(resIds) if objId not in matchingIds),len(resIds))
+        return max(0,pageEnd-nresults)
+    else:
+        return next((index for index,objId in enumerate(resIds) if objId in matchingIds),len(resIds))
+
+def _dbAddCursors(db,qModel,compiledQuery,result,trimmedlist):
+    '''
+        Replaces the prev/next offsets of a result by cursors
+        made from the keys of the first/last item of the page
+    '''
+    sortKeys=compiledQuery['sortkeys']
+    boundaryIds=[obj.id for obj in trimmedlist[:1]+trimmedlist[-1:]]
+    if len(boundaryIds)==0:
+        return result
+    keyMap={
+        row[0]: list(row[1:])
+        for row in db.execute(
+            'SELECT id, %s FROM %s WHERE id IN (?,?)' % (
+                ', '.join(expression for expression,_ in sortKeys),
+                qModel.__name__,
+            ),
+            boundaryIds[0],
+            boundaryIds[-1],
+        ).fetchall()
+    }
+    if 'prevstartfrom' in result:
+        result['prevcursor']=encodeCursor(
+            compiledQuery['sortby'],
+            'prev',
+            result.pop('prevstartfrom'),
+            keyMap[boundaryIds[0]],
+        )
+    if 'nextstartfrom' in result:
+        result['nextcursor']=encodeCursor(
+            compiledQuery['sortby'],
+            'next',
+            result.pop('nextstartfrom'),
+            keyMap[boundaryIds[-1]],
+        )
+    return result
+
+def dbCompiledFilterQuery(tableName, compiledQuery, nresults=100, cacheKey=None, columns=None):
+    '''
+        Same as dbTableFilterQuery, but for a query compiled
+        by querycompiler.compileQuery: the SQL part
+        (conditions, ordering, slicing) is executed by the DB,
+        with a separate COUNT(*) for the total.
+
+        If python filters are present, they are evaluated on the rows
+        satisfying the SQL conditions, in which case the counting
+        and slicing are done in-memory (as is the sorting
+        if the compiled query has no 'orderby').
+
+        For keyed sortings, the result has 'nextcursor'/'prevcursor'
+        in place of 'nextstartfrom'/'prevstartfrom' (keyset pagination).
+
+        If a cacheKey is given (see dbQueryCacheKey), the ordered ids
+        of the in-memory results are kept in queryCache: as long as
+        they are there, only the rows of the requested page are read.
+
+        If a list of columns is given, the returned objects have
+        only those (and the id) wherever the rows are read for the page
+        alone, i.e. unless python filters need the whole rows anyway.
+    '''
+    db=dbGetDatabase()
+    qModel=tableToModel[tableName]
+    mgr=qModel.manager(db)
+    startfrom=compiledQuery['startfrom']
+    whereClause=' AND '.join(compiledQuery['where']) if compiledQuery['where'] else '1'
+    params=compiledQuery['params']
+    filterList=compiledQuery['pythonfilters']
+    useCursor=compiledQuery['cursor'] is not None
+    if len(filterList)==0 and compiledQuery['orderby'] is not None:
+        ntotal=db.execute(
+            'SELECT COUNT(*) FROM %s WHERE %s' % (qModel.__name__,whereClause),
+            *params
+        ).fetchone()[0]
+        keysetPage=None
+        if useCursor:
+            keysetPage=_dbKeysetPage(db,qModel,compiledQuery,whereClause,params,ntotal,nresults,columns)
+            if keysetPage is None:
+                # back to the beginning
+                startfrom=0
+        if keysetPage is not None:
+            result,trimmedlist=keysetPage
+        else:
+            result=_paginationResult(ntotal,startfrom,nresults)
+            if result['firstitem']>=0:
+                rows=db.execute(
+                    'SELECT %s FROM %s WHERE %s ORDER BY %s LIMIT ? OFFSET ?' % (
+                        _selectClause(columns),
+                        qModel.__name__,
+                        whereClause,
+                        compiledQuery['orderby'],
+                    ),
+                    *(params+compiledQuery['orderparams']+[nresults,startfrom])
+                ).fetchall()
+                trimmedlist=[mgr.create(**row) for row in rows]
+            else:
+                trimmedlist=[]
+    else:
+        resIds=queryCache.get(cacheKey) if cacheKey is not None else None
+        if resIds is None:
+            # python filters are evaluated on the SQL-filtered rows
+            wholeFilters = lambda obj: reduce(mul,(ffunc(obj) for ffunc in filterList),1.0)
+            rows=db.execute(
+                'SELECT * FROM %s WHERE %s ORDER BY %s' % (
+                    qModel.__name__,
+                    whereClause,
+                    compiledQuery['orderby'] if compiledQuery['orderby'] is not None else 'id',
+                ),
+                *(params+compiledQuery['orderparams'])
+            ).fetchall()
+            # each score is computed once and kept along with its object
+            scoredList=[
+                (obj,score)
+                for obj,score in ((obj,wholeFilters(obj)) for obj in (mgr.create(**row) for row in rows))
+                if score>0
+            ]
+            if cacheKey is not None and not queryCache.accepts(cacheKey,len(scoredList)):
+                # too large to be cached: the results are not kept
+                cacheKey=None
+            sorter=compiledQuery['pythonsorter']
+            if compiledQuery['orderby'] is None and sorter is not None:
+                sortKey=lambda scored: sorter(scored[0],lambda obj,score=scored[1]: score)
+                if cacheKey is None:
+                    # sorting requiring python (e.g. relevance): only the
+                    # items up to the requested page are selected, with a heap
+                    # (nsmallest is stable, as is sorted)
+                    reslist=[
+                        obj
+                        for obj,_ in heapq.nsmallest(startfrom+nresults,scoredList,key=sortKey)
+                    ]
+                else:
+                    # the whole ordering is needed for the cache
+                    reslist=[obj for obj,_ in sorted(scoredList,key=sortKey)]
+            elif compiledQuery['orderby'] is None:
+                reslist=sorted(obj for obj,_ in scoredList)
+            else:
+                reslist=[obj for obj,_ in scoredList]
+            ntotal=len(scoredList)
+            resIds=[obj.id for obj in reslist]
+            if cacheKey is not None:
+                queryCache.put(cacheKey,resIds)
+            pageItems=lambda first: reslist[first:first+nresults]
+        else:
+            ntotal=len(resIds)
+            pageItems=lambda first: dbGetByIds(db,tableName,resIds[first:first+nresults],columns)
+        if useCursor:
+            startfrom=_cursorStart(db,qModel,compiledQuery,whereClause,params,resIds,nresults)
+        result=_paginationResult(ntotal,startfrom,nresults)
+        trimmedlist=pageItems(startfrom)
+    if compiledQuery['sortkeys'] is not None:
+        result=_dbAddCursors(db,qModel,compiledQuery,result,trimmedlist)
     return (result,trimmedlist)
 
 def makeBookFilter(fName,fValue,useSimilarity=False):
     '''
         Interprets an argument name/vale in the query string
         and produces a corresponding boolean filter
+        (ValueError for an unknown argument name)
     '''
     if fName=='author':
         def aufinder(bo,v=fValue):
@@ -138,16 +497,19 @@ def makeBookFilter(fName,fValue,useSimilarity=False):
             # prepare and store vector
             vVector=makeIntoVector(fValue.lower())
             if sum(vVector.values()):
+                # precomputed title vectors: only the query is vectorized
+                bookVectorMap=dbGetVectors('book')
                 def tifinder(bo,vec=vVector):
                     matchSum=0.0
-                    boTitleVector=makeIntoVector(bo.title.lower())
-                    boTitleTokens=[t.lower() for t in bo.title.lower().split(' ')]
-                    if scalProd(vec,boTitleVector)>=SIMILAR_BOOK_THRESHOLD:
-                        matchSum += (1.0+scalProd(vec,boTitleVector))*(1+len(boTitleTokens))
-                    for tok in boTitleTokens:
-                        if scalProd(vec,makeIntoVector(tok))>=SIMILAR_BOOK_THRESHOLD and \
-                        len(tok)>=MINIMUM_SIMILAR_BOOK_TOKEN_SIZE:
-                            matchSum+=(1.0+scalProd(vec,makeIntoVector(tok)))
+                    boVectors=bookVectorMap.get(bo.id) or bookVectors(bo.title)
+                    titleProd=scalProd(vec,boVectors['title'])
+                    if titleProd>=SIMILAR_BOOK_THRESHOLD:
+                        matchSum += (1.0+titleProd)*(1+len(boVectors['tokens']))
+                    for tokLen,tokVector in boVectors['tokens']:
+                        tokProd=scalProd(vec,tokVector)
+                        if tokProd>=SIMILAR_BOOK_THRESHOLD and \
+                        tokLen>=MINIMUM_SIMILAR_BOOK_TOKEN_SIZE:
+                            matchSum+=(1.0+tokProd)
                     #
                     return matchSum
                 return tifinder
@@ -189,7 +551,7 @@ def makeBookFilter(fName,fValue,useSimilarity=False):
                 return 1.0
         return hofinder
     else:
-        return lambda: 1.0
+        raise ValueError('Unknown book query argument "%s"' % fName)
 
 def makeAuthorFilter(fName, fValue, useSimilarity=False):
     '''
@@ -200,8 +562,10 @@ def makeAuthorFilter(fName, fValue, useSimilarity=False):
             # prepare and store vector
             vVector=makeIntoVector(fValue)
             if sum(vVector.values()):
+                authorVectorMap=dbGetVectors('author')
                 def fnfinder(au,vec=vVector):
-                    return scalProd(vec,makeIntoVector(au.firstname))>=SIMILAR_AUTHOR_THRESHOLD
+                    auVectors=authorVectorMap.get(au.id) or authorVectors(au.firstname,au.lastname)
+                    return scalProd(vec,auVectors['firstname'])>=SIMILAR_AUTHOR_THRESHOLD
                 return fnfinder
             else:
                 return makeAuthorFilter(fName,fValue,useSimilarity=False)
@@ -214,8 +578,10 @@ def makeAuthorFilter(fName, fValue, useSimilarity=False):
             # prepare and store vector
             vVector=makeIntoVector(fValue)
             if sum(vVector.values()):
+                authorVectorMap=dbGetVectors('author')
                 def lnfinder(au,vec=vVector):
-                    return scalProd(vec,makeIntoVector(au.lastname))>=SIMILAR_AUTHOR_THRESHOLD
+                    auVectors=authorVectorMap.get(au.id) or authorVectors(au.firstname,au.lastname)
+                    return scalProd(vec,auVectors['lastname'])>=SIMILAR_AUTHOR_THRESHOLD
                 return lnfinder
             else:
                 return makeAuthorFilter(fName,fValue,useSimilarity=False)
@@ -229,7 +595,7 @@ def makeAuthorFilter(fName, fValue, useSimilarity=False):
                     (v.lower() in au.lastname.lower())
         return nafinder
     else:
-        return lambda: True
+        raise ValueError('Unknown author query argument "%s"' % fName)
 
 def makeBookSorter(sName):
     '''
@@ -274,80 +640,86 @@ def makeAuthorSorter(sName):
     else:
         return None
 
+def compileBookQuery(queryArgs):
+    '''
+        The compiled query (see querycompiler.compileQuery) of book
+        query arguments. Invalid arguments raise a ValueError.
+    '''
+    return compileQuery(
+        queryArgs,
+        compileBookFilter,
+        makeBookFilter,
+        compileBookSorter,
+        makeBookSorter,
+    )
+
+def compileAuthorQuery(queryArgs):
+    '''
+        Same as above for author query arguments
+    '''
+    return compileQuery(
+        queryArgs,
+        compileAuthorFilter,
+        makeAuthorFilter,
+        compileAuthorSorter,
+        makeAuthorSorter,
+    )
+
 def dbQueryBooks(   queryArgs=ImmutableMultiDict(), resultsperpage=100,
-                    resolve=False, resolveParams={}):
+                    resolve=False, resolveParams={}, columns=None):
     '''
         A query is interpreted from arguments and executed
         on books. The results, trimmed and polished, are then returned
         in a standard format: result, list_of_books.
         All query-specific terms are stored in 'queryArgs'
         'result' is a dict with various settings, depending on the query.
+
+        Filters and sorting are compiled to SQL where possible
+        (see querycompiler.py), title searches are scored in python.
+
+        'columns', if given, restricts the fields read (see dbCompiledFilterQuery):
+        it cannot be used along with 'resolve'.
     '''
-    #
-    filters=[]
-    startfrom=0
-    sorter=None
-    # queryArgs is in principle a multidict:
-    # first determine if searches are by-similarity
-    useSimilarity=False
-    if 'similarity' in queryArgs:
-        for v in queryArgs.getlist('similarity'):
-            try:
-                useSimilarity=bool(int(v))
-            except:
-                pass
-    for k in queryArgs.keys():
-        for v in queryArgs.getlist(k):
-            # first deal with the non-filtering arguments
-            if k=='startfrom':
-                startfrom=int(v)
-            elif k=='sortby':
-                sorter=makeBookSorter(v)
-            elif k=='similarity':
-                pass # already dealt with
-            else:
-                filters.append(makeBookFilter(k,v,useSimilarity=useSimilarity))
-    #
-    result,booklist=dbTableFilterQuery('book',startfrom,resultsperpage,filters,sorter)
+    compiledQuery=compileBookQuery(queryArgs)
+    result,booklist=dbCompiledFilterQuery(
+        'book',
+        compiledQuery,
+        resultsperpage,
+        cacheKey=dbQueryCacheKey('book',queryArgs),
+        columns=columns,
+    )
     if resolve:
         return result,[obj.resolveReferences(**resolveParams) for obj in booklist]
     else:
         return result,booklist
 
-def dbQueryAuthors( queryArgs=ImmutableMultiDict(), resultsperpage=100):
+def dbQueryAuthors( queryArgs=ImmutableMultiDict(), resultsperpage=100, columns=None):
     '''
         A query is interpreted from arguments and executed
         on authors. The results, trimmed and polished, are then returned
         in a standard format:  result, list_of_authors.
         All query-specific terms are stored in 'queryArgs'.
         'result' is a dict with various settings, depending on the query.
+
+        'columns', if given, restricts the fields read (see dbCompiledFilterQuery):
+        booklist/bookcount, not being in the table, are filled only if among them.
     '''
-    filters=[]
-    startfrom=0
-    sorter=None
-    # queryArgs is in principle a multidict:
-    # first determine if searches are by-similarity
-    useSimilarity=False
-    if 'similarity' in queryArgs:
-        for v in queryArgs.getlist('similarity'):
-            try:
-                useSimilarity=bool(int(v))
-            except:
-                pass
-    for k in queryArgs.keys():
-        for v in queryArgs.getlist(k):
-            # first deal with the non-filtering arguments
-            if k=='startfrom':
-                startfrom=int(v)
-            elif k=='sortby':
-                sorter=makeAuthorSorter(v)
-            elif k=='similarity':
-                pass # already dealt with
-            else:
-                filters.append(makeAuthorFilter(k,v,useSimilarity=useSimilarity))
-    #
-    result,authorlist=dbTableFilterQuery('author',startfrom,resultsperpage,filters,sorter)
-    return result,authorlist
+    compiledQuery=compileAuthorQuery(queryArgs)
+    result,authorlist=dbCompiledFilterQuery(
+        'author',
+        compiledQuery,
+        resultsperpage,
+        cacheKey=dbQueryCacheKey('author',queryArgs),
+        columns=None if columns is None else [
+            column
+            for column in columns
+            if column not in authorBookFields
+        ],
+    )
+    if columns is None or any(column in authorBookFields for column in columns):
+        return result,dbAttachAuthorBooks(dbGetDatabase(),authorlist)
+    else:
+        return result,authorlist
 
 def dbGetAll(tableName, resolve=False, resolveParams=None):
     '''
@@ -361,10 +733,147 @@ def dbGetAll(tableName, resolve=False, resolveParams=None):
     qModel=tableToModel[tableName]
     mgr=qModel.manager(db)
     if resolve:
-        return [obj.resolveReferences(**resolveParams) for obj in mgr.all()]
+        objList=list(mgr.all())
+        if tableName=='author':
+            dbAttachAuthorBooks(db,objList)
+        return [obj.resolveReferences(**resolveParams) for obj in objList]
     else:
         return mgr.all()
 
+def dbSelectWhere(db, tableName, whereClause, params=[]):
+    '''
+        returns the list of items from the required table
+        satisfying an SQL condition (with its parameters), in id order
+    '''
+    qModel=tableToModel[tableName]
+    mgr=qModel.manager(db)
+    return [
+        mgr.create(**row)
+        for row in db.execute(
+            'SELECT * FROM %s WHERE %s ORDER BY id' % (qModel.__name__,whereClause),
+            *params
+        ).fetchall()
+    ]
+
+def dbGetByIds(db, tableName, ids, columns=None):
+    '''
+        returns the items from the required table with the given ids,
+        in the same order (ids not found are skipped).
+        If a list of columns is given, only those (and the id) are read.
+    '''
+    qModel=tableToModel[tableName]
+    mgr=qModel.manager(db)
+    objMap={}
+    for chunk in _chunked(ids):
+        for row in db.execute(
+                    'SELECT %s FROM %s WHERE id IN (%s)' % (
+                        _selectClause(columns),
+                        qModel.__name__,
+                        ','.join('?' for _ in chunk),
+                    ),
+                    *chunk
+                ).fetchall():
+            objMap[row['id']]=mgr.create(**row)
+    return [objMap[objId] for objId in ids if objId in objMap]
+
+def dbIterBooksSorted(house=None,progress=None):
+    '''
+        generates the books (of a house, if given) in their default
+        order, i.e. as sorted(dbGetAll('book')): only the titles are
+        sorted in memory, the books being read in chunks
+        as the iteration proceeds. Title case folding is done in python
+        as in Book.__lt__ (SQLite lower() only folds ASCII).
+        If given, progress(done,total) is called after each book.
+    '''
+    db=dbGetDatabase()
+    if house is None:
+        titleRows=db.execute('SELECT id, title FROM Book').fetchall()
+    else:
+        titleRows=db.execute('SELECT id, title FROM Book WHERE house=?',house).fetchall()
+    sortedIds=[
+        bookId
+        for _,bookId in sorted((title.lower(),bookId) for bookId,title in titleRows)
+    ]
+    del titleRows
+    nDone=0
+    for chunk in _chunked(sortedIds):
+        bookMap=dbMakeDict(dbSelectWhere(db,'book','id IN (%s)' % ','.join('?' for _ in chunk),chunk))
+        for bookId in chunk:
+            if bookId in bookMap:
+                yield bookMap[bookId]
+            nDone+=1
+            if progress is not None:
+                progress(nDone,len(sortedIds))
+
+def _chunked(values, size=500):
+    '''
+        splits a list of values in chunks short enough
+        to be bound as parameters of an IN (...) clause
+    '''
+    values=list(values)
+    for i in range(0,len(values),size):
+        yield values[i:i+size]
+
+def _dbExistingAuthorIds(db, authorIds):
+    '''
+        returns the subset of the given author ids
+        that correspond to authors in the DB
+    '''
+    foundIds=set()
+    for chunk in _chunked(authorIds):
+        foundIds|={
+            row[0]
+            for row in db.execute(
+                'SELECT id FROM Author WHERE id IN (%s)' % ','.join('?'*len(chunk)),
+                *chunk
+            ).fetchall()
+        }
+    return foundIds
+
+def dbGetAuthorBookIds(authorId, db=None):
+    '''
+        returns the sorted list of ids of the books by an author
+    '''
+    if db is None:
+        db=dbGetDatabase()
+    return [
+        row[0]
+        for row in db.execute('SELECT book FROM book_author WHERE author=? ORDER BY book',authorId).fetchall()
+    ]
+
+# Author fields filled by dbAttachAuthorBooks
+authorBookFields=['booklist','bookcount']
+
+def dbAttachAuthorBooks(db, authors):
+    '''
+        fills the booklist/bookcount attributes of a list of authors
+        from the book_author table. Returns the list itself.
+    '''
+    bookMap={au.id: [] for au in authors}
+    for chunk in _chunked(bookMap.keys()):
+        for authorId,bookId in db.execute(
+                    'SELECT author, book FROM book_author WHERE author IN (%s) ORDER BY author, book' % ','.join('?'*len(chunk)),
+                    *chunk
+                ).fetchall():
+            bookMap[authorId].append(bookId)
+    for au in authors:
+        au.booklist=rollStringList(bookMap[au.id])
+        au.bookcount=len(bookMap[au.id])
+    return authors
+
+def dbGetSimilarityCandidates(tableName, vectors):
+    '''
+        returns, in id order, the items of a table ('book'/'author')
+        which may be similar to the given vectors (a dict field -> vector),
+        according to the LSH index. Similarity is to be checked exactly.
+    '''
+    db=dbGetDatabase()
+    candidateIds=sorted(dbLshCandidates(db,tableName,vectors))
+    candidates=[]
+    for chunk in _chunked(candidateIds):
+        candidates+=dbSelectWhere(db,tableName,'id IN (%s)' % ','.join('?'*len(chunk)),chunk)
+    return candidates
+
 def dbMakeDict(objList, fieldname='id'):
     '''
         assuming rows have a unique 'id', makes a generator
@@ -372,6 +881,125 @@ def dbMakeDict(objList, fieldname='id'):
     '''
     return {getattr(obj,fieldname): obj for obj in objList}
 
+def _referenceLoader(qModel, fieldname='id'):
+    return lambda db: dbMakeDict(qModel.manager(db).all(),fieldname)
+
+# tables whose contents the pages show, see dbGetDataStamp
+dataStampTables=['Author','Book','Booktype','House','Language','User']
+
+def _dataStampLoader(db):
+    return tuple(
+        tuple(row)
+        for row in db.execute(
+            'SELECT tablename, generation FROM reference_generation WHERE tablename IN (%s) ORDER BY tablename' %
+                ','.join('?' for _ in dataStampTables),
+            *dataStampTables
+        ).fetchall()
+    )
+
+# per-process cache of the reference data, reloaded only upon changes
+referenceCache=ReferenceCache(
+    os.path.join(DB_DIRECTORY,DB_NAME),
+    {
+        'authors': ('Author',_referenceLoader(Author)),
+        'houses': ('House',_referenceLoader(House,'name')),
+        'users': ('User',_referenceLoader(User)),
+        'languages': ('Language',_referenceLoader(Language,'tag')),
+        'booktypes': ('Booktype',_referenceLoader(Booktype,'tag')),
+        'datastamp': (dataStampTables,_dataStampLoader),
+    },
+)
+
+def dbGetReferenceData():
+    '''
+        returns a dict with the (shared, not to be modified)
+        dicts of all authors, houses, users, languages and booktypes
+    '''
+    return referenceCache.getAll()
+
+def dbGetDataStamp():
+    '''
+        returns a (hashable) value changing upon any write to the books,
+        authors, houses, users, languages or booktypes, by any process
+    '''
+    return referenceCache.get('datastamp')
+
+# per-process LRU of the ordered ids of the in-memory query results
+queryCache=QueryResultCache(QUERY_CACHE_ENTRIES,QUERY_CACHE_BYTES)
+
+def dbQueryCacheKey(tableName, queryArgs):
+    '''
+        key of a query in queryCache: the paging arguments are
+        not part of it, while the data stamp is.
+        None if the cache is disabled
+    '''
+    if queryCache.enabled:
+        return (tableName,dbGetDataStamp(),normalizedQueryArgs(queryArgs))
+    else:
+        return None
+
+# per-process cache of the similarity vectors, reloaded only upon changes
+vectorCache=ReferenceCache(
+    os.path.join(DB_DIRECTORY,DB_NAME),
+    {
+        'book': ('entity_vector_book',lambda db: dbLoadVectors(db,'book')),
+        'author': ('entity_vector_author',lambda db: dbLoadVectors(db,'author')),
+    },
+)
+
+def dbGetVectors(entity):
+    '''
+        returns the (shared, not to be modified) map id -> {field: vector}
+        of the precomputed similarity vectors of 'book'/'author' items
+    '''
+    return vectorCache.get(entity)
+
+# statistic subtypes to resolve: statname -> (resolveParams key, tableName, field)
+_statisticSubtypeTables={
+    'G_house': ('houses','house','name'),
+    'G_language': ('languages','language','tag'),
+    'G_booktype': ('booktypes','booktype','tag'),
+}
+
+def _dbStatisticsPanel(db):
+    '''
+        The formatted statistics (see sortStatistics), resolving
+        only the houses/languages/booktypes their subtypes refer to
+    '''
+    rawStats=list(Statistic.manager(db).all())
+    statParams={}
+    for statName,(paramName,tableName,fieldName) in _statisticSubtypeTables.items():
+        subtypes={qStat.subtype for qStat in rawStats if qStat.name==statName}
+        statParams[paramName]=dbMakeDict(
+            (
+                obj
+                for chunk in _chunked(subtypes)
+                for obj in dbSelectWhere(
+                    db,
+                    tableName,
+                    '%s IN (%s)' % (fieldName,','.join('?' for _ in chunk)),
+                    chunk,
+                )
+            ),
+            fieldName,
+        )
+    return sortStatistics(rawStats,statParams)
+
+# per-process cache of the home page statistics, reloaded only upon changes
+statisticsCache=ReferenceCache(
+    os.path.join(DB_DIRECTORY,DB_NAME),
+    {
+        'panel': (['Statistic','House','Language','Booktype'],_dbStatisticsPanel),
+    },
+)
+
+def dbGetStatisticsPanel():
+    '''
+        returns the (shared, not to be modified) formatted statistics
+        for the home page
+    '''
+    return statisticsCache.get('panel')
+
 # table-specific tools
 def dbGetHouse(name):
     '''
@@ -379,9 +1007,8 @@ def dbGetHouse(name):
         None if not found
     '''
     db=dbGetDatabase()
-    for qHouse in House.manager(db).all():
-        if qHouse.name==name:
-            return qHouse
+    for qHouse in dbSelectWhere(db,'house','name=?',[name]):
+        return qHouse
 
 def dbGetUser(name):
     '''
@@ -389,16 +1016,19 @@ def dbGetUser(name):
         None if not found
     '''
     db=dbGetDatabase()
-    for qUser in User.manager(db).all():
-        if qUser.name==name:
-            return qUser
+    for qUser in dbSelectWhere(db,'user','name=?',[name]):
+        return qUser
 
 def dbGetUserById(id):
     '''
-        Returns a user object from its id.
+        Returns a user object from its id, off the reference cache
+        (a copy: it can be modified). Writes to the users,
+        e.g. dbReplaceUser and registerLogin, invalidate the cache.
     '''
-    db=dbGetDatabase()
-    return User.manager(db).get(id)
+    qUser=referenceCache.get('users').get(int(id))
+    if qUser is None:
+        raise ValueError('User with id does not exist: %s' % id)
+    return copy.copy(qUser)
 
 def dbReplaceUser(newUser):
     '''
@@ -407,13 +1037,12 @@ def dbReplaceUser(newUser):
         Returns a 2-tuple (success=0/1, new_User_object)
     '''
     db=dbGetDatabase()
-    User.db=db
     nUser=User.manager(db).get(newUser.id)
     if nUser:
         for k,q in newUser.__dict__.items():
             if k != 'id':
                 setattr(nUser,k,q)
-        nUser.update()
+        User.manager(db).update(nUser)
         db.commit()
         return (1,newUser)
     else:
@@ -428,7 +1057,7 @@ def dbAddReplaceBook(newBook,resolve=False, resolveParams=None, db=None, userHou
         else:
             overwrites the fields of the book with the specified id
 
-        Takes care of authors' bookcounters
+        Takes care of the book-author links
 
         Always returns a 2-uple (status,object), where:
             status = 0,1 for failure,success
@@ -448,7 +1077,6 @@ def dbAddReplaceBook(newBook,resolve=False, resolveParams=None, db=None, userHou
     newBook.lasteditdate=datetime.now().strftime(DATETIME_STR_FORMAT)
     oldBookStats={}
     newBookStats=statFromBook(newBook)
-    Book.db=db
     if newBook.id is None:
         if not ALLOW_DUPLICATE_BOOKS:
             # if new-insertion, check for duplicates then proceed
@@ -457,10 +1085,12 @@ def dbAddReplaceBook(newBook,resolve=False, resolveParams=None, db=None, userHou
                     return (0,'Duplicate detected.')
         if userHouse is None or userHouse==newBook.house:
             newBook.forceAscii()
+            _auIdList=unrollStringList(newBook.authors)
+            newBook.authors=rollStringList(set(_auIdList) & _dbExistingAuthorIds(db,_auIdList))
             prevAuthorList=''
             oldHouse=None
             newHouse=newBook.house
-            newBook.save()
+            Book.manager(db).save(newBook)
             nBook=newBook
         else:
             return (0,'Houses mismatch')
@@ -482,18 +1112,18 @@ def dbAddReplaceBook(newBook,resolve=False, resolveParams=None, db=None, userHou
                 for k,q in newBook.__dict__.items():
                     if k == 'authors':
                         prevAuthorList=getattr(nBook,k)
-                        _auIdSet={au.id for au in dbGetAll('author')}
-                        _bookAuList=rollStringList(set(unrollStringList(q)) & _auIdSet)
+                        _auIdList=unrollStringList(q)
+                        _bookAuList=rollStringList(set(_auIdList) & _dbExistingAuthorIds(db,_auIdList))
                         setattr(nBook,k,_bookAuList)
                     else:
                         setattr(nBook,k,q)
                 nBook.forceAscii()
-                nBook.update()
+                Book.manager(db).update(nBook)
             else:
                 return (0,'Houses mismatch')
         else:
             return (0,'Not found.')
-    # reflect authorlist changes to the authors table. Current book's id is nBook.id
+    # reflect authorlist changes to the book_author table. Current book's id is nBook.id
     oldAuthorSet=set(unrollStringList(prevAuthorList))
     newAuthorSet=set(unrollStringList(nBook.authors))
     wonAuthors=newAuthorSet-oldAuthorSet
@@ -501,7 +1131,11 @@ def dbAddReplaceBook(newBook,resolve=False, resolveParams=None, db=None, userHou
     # apply stats update
     dbIncrementStatistic(db,oldBookStats,newBookStats)
     #
-    updateBookCounters(db,nBook.id,lost=lostAuthors,won=wonAuthors)
+    updateBookAuthors(db,nBook.id,lost=lostAuthors,won=wonAuthors)
+    dbIndexBookTitle(db,nBook.id,nBook.title)
+    nBookVectors=bookVectors(nBook.title)
+    dbStoreVectors(db,'book',nBook.id,nBookVectors)
+    dbIndexLsh(db,'book',nBook.id,nBookVectors)
     if oldHouse:
         dbIncrementHouseBookCount(db,oldHouse,-1)
     dbIncrementHouseBookCount(db,newHouse,1)
@@ -519,36 +1153,26 @@ def dbIncrementHouseBookCount(dbSession,houseName,delta):
         Updates the nbooks house attribute for the given
         house by applying the provided delta to the counter
     '''
-    House.db=dbSession
-    for qHouse in House.manager(dbSession).all():
-        if qHouse.name==houseName:
-            qHouse.nbooks+=delta
-            qHouse.update()
-
-def updateBookCounters(dbSession,bookId,lost,won):
-    '''
-        updates some author objects to reflect a pending change
-        in a book's author list. Takes care of counters and comma-separated id list
-    '''
-    Author.db=dbSession
-    for lostAu in lost:
-        qAuthor=Author.manager(dbSession).get(lostAu)
-        if qAuthor:
-            newList,listCount=expungeFromStringList(qAuthor.booklist, bookId)
-            qAuthor.booklist=newList
-            qAuthor.bookcount=listCount
-            qAuthor.update()
-        else:
-            raise ValueError
-    for wonAu in won:
-        qAuthor=Author.manager(dbSession).get(wonAu)
-        if qAuthor:
-            newList,listCount=addToStringList(qAuthor.booklist, bookId)
-            qAuthor.booklist=newList
-            qAuthor.bookcount=listCount
-            qAuthor.update()
-        else:
-            raise ValueError
+    houseManager=House.manager(dbSession)
+    for qHouse in dbSelectWhere(dbSession,'house','name=?',[houseName]):
+        qHouse.nbooks+=delta
+        houseManager.update(qHouse)
+
+def updateBookAuthors(dbSession,bookId,lost,won):
+    '''
+        updates the book_author links to reflect a pending change
+        in a book's author list
+    '''
+    if set(won)-_dbExistingAuthorIds(dbSession,won):
+        raise ValueError
+    dbSession.connection.executemany(
+        'DELETE FROM book_author WHERE book=? AND author=?',
+        [(bookId,lostAu) for lostAu in lost],
+    )
+    dbSession.connection.executemany(
+        'INSERT OR IGNORE INTO book_author (book, author) VALUES (?,?)',
+        [(bookId,wonAu) for wonAu in won],
+    )
 
 def dbDeleteBook(id,db=None,userHouse=None):
     '''
@@ -564,15 +1188,16 @@ def dbDeleteBook(id,db=None,userHouse=None):
         db=dbGetDatabase()
     else:
         doCommit=False
-    Book.db=db
     try:
         dBook=Book.manager(db).get(id)
         if userHouse is None or dBook.house==userHouse:
-            oldAuthorSet=set(unrollStringList(dBook.authors))
             oldHouse=dBook.house
             dbIncrementStatistic(db,statFromBook(dBook),{})
-            updateBookCounters(db,dBook.id,lost=oldAuthorSet,won=set())
-            dBook.delete()
+            db.execute('DELETE FROM book_author WHERE book=?',dBook.id)
+            dbUnindexBookTitle(db,dBook.id)
+            dbDeleteVectors(db,'book',dBook.id)
+            dbUnindexLsh(db,'book',dBook.id)
+            Book.manager(db).delete(dBook)
             dbIncrementHouseBookCount(db,oldHouse,-1)
             if doCommit:
                 db.commit()
@@ -588,12 +1213,11 @@ def registerLogin(userId):
         expressing the current date. Empty string if errors occur.
     '''
     db=dbGetDatabase()
-    User.db=db
     localTimezone=timezone(USERS_TIMEZONE)
     try:
         qUser=User.manager(db).get(userId)
         qUser.lastlogindate=datetime.now(localTimezone).strftime(DATETIME_STR_FORMAT)
-        qUser.update()
+        User.manager(db).update(qUser)
         db.commit()
         return qUser.lastlogindate
     except:
@@ -616,48 +1240,65 @@ def dbDeleteAuthor(id,db=None,userHouse=None):
         db=dbGetDatabase()
     else:
         doCommit=False
-    Author.db=db
     try:
         dAuthor=Author.manager(db).get(id)
+        authorBooks=dbSelectWhere(db,'book','id IN (SELECT book FROM book_author WHERE author=?)',[dAuthor.id])
         # if a userHouse is provided, check the my-books-only constraint
-        Book.db=db
         if userHouse is not None:
-            for bookId in unrollStringList(dAuthor.booklist):
-                qBook=Book.manager(db).get(bookId)
+            for qBook in authorBooks:
                 if qBook.house!=userHouse:
                     return (0,'Author has books in other houses')
         # browse through all books authored by this author
-        for bookId in unrollStringList(dAuthor.booklist):
-            qBook=Book.manager(db).get(bookId)
-            qBook.authors,_=expungeFromStringList(qBook.authors,id)
-            qBook.update()
+        for qBook in authorBooks:
+            qBook.authors,_=expungeFromStringList(qBook.authors,dAuthor.id)
+            Book.manager(db).update(qBook)
+        db.execute('DELETE FROM book_author WHERE author=?',dAuthor.id)
+        dbDeleteVectors(db,'author',dAuthor.id)
+        dbUnindexLsh(db,'author',dAuthor.id)
         #
         dbIncrementStatistic(db,statFromAuthor(dAuthor),{})
-        dAuthor.delete()
+        Author.manager(db).delete(dAuthor)
         if doCommit:
             db.commit()
         return (1,id)
     except:
         return (0,'Cannot delete')
 
-def dbGetByIdFactory(className):
+def dbGetByIdFactory(className, completer=None):
     '''
         factory function to generate getters-by-id
         for various object types.
         The getters return None if the id is not found
+
+        If given, completer(db,[object]) is applied
+        to the retrieved object
     '''
     def _byIdGetter(id):
         db=dbGetDatabase()
         try:
             qObject=className.manager(db).get(id)
-            return qObject
         except:
             return None
+        if completer is not None:
+            completer(db,[qObject])
+        return qObject
     return _byIdGetter
 
-dbGetAuthor=dbGetByIdFactory(Author)
+dbGetAuthor=dbGetByIdFactory(Author,completer=dbAttachAuthorBooks)
 dbGetBook=dbGetByIdFactory(Book)
 
+def _dbFindAuthorsByName(db, qAuthor):
+    '''
+        returns the authors with the same (case-insensitive)
+        first and last names as the given one
+    '''
+    return dbSelectWhere(
+        db,
+        'author',
+        'lower(lastname)=? AND lower(firstname)=?',
+        [qAuthor.lastname.lower(),qAuthor.firstname.lower()],
+    )
+
 def dbAddReplaceAuthor(newAuthor, db=None):
     '''
         Add/Replace an author to DB
@@ -679,24 +1320,20 @@ def dbAddReplaceAuthor(newAuthor, db=None):
         db=dbGetDatabase()
     else:
         doCommit=False
-    Author.db=db
     if newAuthor.id is None:
         # new insertion: check for duplicates then proceed
-        for qAuthor in Author.manager(db).all():
-            if qAuthor.firstname.lower()==newAuthor.firstname.lower() and qAuthor.lastname.lower()==newAuthor.lastname.lower():
-                return (0,'Duplicate detected')
+        if _dbFindAuthorsByName(db,newAuthor):
+            return (0,'Duplicate detected')
         # no duplicates: add author through the orm
         newAuthor.bookcount=0
         newAuthor.booklist=''
         newAuthor.forceAscii()
-        newAuthor.save()
+        Author.manager(db).save(newAuthor)
         nAuthor=newAuthor
     else:
         # if replacement, find the replacee and proceed
-        for qAuthor in Author.manager(db).all():
-            if qAuthor.id != newAuthor.id and \
-                    (qAuthor.firstname.lower()==newAuthor.firstname.lower() and qAuthor.lastname.lower()==newAuthor.lastname.lower()):
-                return (0,'Duplicate detected')
+        if any(qAuthor.id != newAuthor.id for qAuthor in _dbFindAuthorsByName(db,newAuthor)):
+            return (0,'Duplicate detected')
         nAuthor=Author.manager(db).get(newAuthor.id)
         if nAuthor is not None:
 
@@ -708,9 +1345,12 @@ def dbAddReplaceAuthor(newAuthor, db=None):
                 else:
                     setattr(nAuthor,k,q)
             nAuthor.forceAscii()
-            nAuthor.update()
+            Author.manager(db).update(nAuthor)
         else:
             return (0,'Not found')
+    nAuthorVectors=authorVectors(nAuthor.firstname,nAuthor.lastname)
+    dbStoreVectors(db,'author',nAuthor.id,nAuthorVectors)
+    dbIndexLsh(db,'author',nAuthor.id,nAuthorVectors)
     # apply stat changes
     dbIncrementStatistic(db,oldAuthorStats,newAuthorStats)
     #
@@ -718,6 +1358,179 @@ def dbAddReplaceAuthor(newAuthor, db=None):
         db.commit()
     return (1,nAuthor)
 
+@contextmanager
+def _dbBulkCache(db):
+    '''
+        Enlarges the page cache of the connection
+        for the duration of a bulk insertion
+    '''
+    previousSize=db.execute('PRAGMA cache_size').fetchone()[0]
+    db.execute('PRAGMA cache_size=%i' % -DB_BULK_CACHE_SIZE)
+    try:
+        yield
+    finally:
+        db.execute('PRAGMA cache_size=%i' % previousSize)
+
+def _dbReserveIds(db,qModel,count):
+    '''
+        Returns 'count' new consecutive ids for a table, for bulk
+        insertions with explicit ids (as with AUTOINCREMENT,
+        ids of deleted rows are not reused). A write transaction
+        is started if none is open, so that no other connection
+        can take the same ids before commit.
+    '''
+    if not db.connection.in_transaction:
+        db.execute('BEGIN IMMEDIATE')
+    maxId=db.execute('SELECT MAX(id) FROM %s' % qModel.__name__).fetchone()[0] or 0
+    seqRow=db.execute('SELECT seq FROM sqlite_sequence WHERE name=?',qModel.__name__).fetchone()
+    firstId=max(maxId,seqRow[0] if seqRow is not None else 0)+1
+    return list(range(firstId,firstId+count))
+
+def _modelFieldTypes(qModel):
+    '''
+        The declared fields of a model with their types,
+        i.e. the table columns but the id (attrs() on a model
+        also returns its methods, depending on the python version)
+    '''
+    return {
+        fieldName: fieldType
+        for fieldName,fieldType in vars(qModel).items()
+        if fieldName[0]!='_' and fieldType in DATA_TYPES
+    }
+
+def _dbBulkInsert(db,qModel,objects):
+    '''
+        Inserts with a single statement a list of new objects, giving
+        them their ids. As the orm does upon save, the attribute types
+        are checked against the model, with exact type match
+        (TypeError if they do not match, e.g. a bool for an int).
+    '''
+    if len(objects)==0:
+        return
+    fieldTypes=_modelFieldTypes(qModel)
+    fieldNames=sorted(fieldTypes.keys())
+    for obj in objects:
+        for fieldName,value in attrs(obj).items():
+            if fieldName in fieldTypes and value.__class__ is not fieldTypes[fieldName]:
+                raise TypeError('%s value should be type %s not %s' % (fieldName,fieldTypes[fieldName],value.__class__))
+    for obj,newId in zip(objects,_dbReserveIds(db,qModel,len(objects))):
+        obj.id=newId
+    db.connection.executemany(
+        'INSERT INTO %s (id, %s) VALUES (?, %s)' % (
+            qModel.__name__,
+            ', '.join(fieldNames),
+            ', '.join('?' for _ in fieldNames),
+        ),
+        [
+            [obj.id]+[getattr(obj,fieldName,None) for fieldName in fieldNames]
+            for obj in objects
+        ],
+    )
+
+def dbBulkAddAuthors(newAuthors,db):
+    '''
+        Adds many new authors at once, with the same checks and effects
+        as dbAddReplaceAuthor on each (in the given order), but
+        reading the existing names once and writing each table
+        with a single statement.
+
+        Returns a list, aligned with newAuthors, of the 2-uples
+        (status,object) dbAddReplaceAuthor would return.
+
+        Does not commit.
+    '''
+    # names, lowercased as in _dbFindAuthorsByName
+    knownNames={
+        (row[0],row[1])
+        for row in db.execute('SELECT lower(lastname), lower(firstname) FROM Author')
+    }
+    results=[]
+    insertedAuthors=[]
+    authorStats={}
+    for newAuthor in newAuthors:
+        if (newAuthor.lastname.lower(),newAuthor.firstname.lower()) in knownNames:
+            results.append((0,'Duplicate detected'))
+        else:
+            for statKey,value in statFromAuthor(newAuthor).items():
+                authorStats[statKey]=authorStats.get(statKey,0)+value
+            newAuthor.bookcount=0
+            newAuthor.booklist=''
+            newAuthor.forceAscii()
+            knownNames.add((newAuthor.lastname.lower(),newAuthor.firstname.lower()))
+            insertedAuthors.append(newAuthor)
+            results.append((1,newAuthor))
+    with _dbBulkCache(db):
+        _dbBulkInsert(db,Author,insertedAuthors)
+        insertedVectors={
+            nAuthor.id: authorVectors(nAuthor.firstname,nAuthor.lastname)
+            for nAuthor in insertedAuthors
+        }
+        dbStoreNewVectors(db,'author',insertedVectors)
+        dbIndexNewLsh(db,'author',insertedVectors)
+    dbIncrementStatistic(db,{},authorStats)
+    return results
+
+def dbBulkAddBooks(newBooks,db):
+    '''
+        Adds many new books at once, with the same checks and effects
+        as dbAddReplaceBook on each (in the given order), but reading
+        the existing authors (and books, if duplicates are not allowed)
+        once and writing each table with a single statement; the
+        statistics and the house counters are updated once at the end.
+
+        Returns a list, aligned with newBooks, of the 2-uples
+        (status,object) dbAddReplaceBook would return.
+
+        Does not commit.
+    '''
+    editDate=datetime.now().strftime(DATETIME_STR_FORMAT)
+    existingAuthorIds={row[0] for row in db.execute('SELECT id FROM Author')}
+    if not ALLOW_DUPLICATE_BOOKS:
+        knownBooks={
+            (row[0].lower(),row[1].lower())
+            for row in db.execute('SELECT title, authors FROM Book')
+        }
+    results=[]
+    insertedBooks=[]
+    bookStats={}
+    houseDeltas={}
+    for newBook in newBooks:
+        newBook.lasteditdate=editDate
+        if not ALLOW_DUPLICATE_BOOKS:
+            if (newBook.title.lower(),newBook.authors.lower()) in knownBooks:
+                results.append((0,'Duplicate detected.'))
+                continue
+        for statKey,value in statFromBook(newBook).items():
+            bookStats[statKey]=bookStats.get(statKey,0)+value
+        newBook.forceAscii()
+        newBook.authors=rollStringList(set(unrollStringList(newBook.authors)) & existingAuthorIds)
+        houseDeltas[newBook.house]=houseDeltas.get(newBook.house,0)+1
+        if not ALLOW_DUPLICATE_BOOKS:
+            knownBooks.add((newBook.title.lower(),newBook.authors.lower()))
+        insertedBooks.append(newBook)
+        results.append((1,newBook))
+    with _dbBulkCache(db):
+        _dbBulkInsert(db,Book,insertedBooks)
+        db.connection.executemany(
+            'INSERT OR IGNORE INTO book_author (book, author) VALUES (?,?)',
+            [
+                (nBook.id,auId)
+                for nBook in insertedBooks
+                for auId in unrollStringList(nBook.authors)
+            ],
+        )
+        dbIndexNewBookTitles(db,((nBook.id,nBook.title) for nBook in insertedBooks))
+        insertedVectors={
+            nBook.id: bookVectors(nBook.title)
+            for nBook in insertedBooks
+        }
+        dbStoreNewVectors(db,'book',insertedVectors)
+        dbIndexNewLsh(db,'book',insertedVectors)
+    dbIncrementStatistic(db,{},bookStats)
+    for houseName,delta in houseDeltas.items():
+        dbIncrementHouseBookCount(db,houseName,delta)
+    return results
+
 def erase_db_table(db,tableName):
     '''
         Deletes *all* records from a (book,author) table of the given DB
@@ -729,17 +1542,17 @@ def erase_db_table(db,tableName):
         doCommit=False
 
     tObject=tableToModel[tableName]
-    tObject.db=db
     idList=[obj.id for obj in tObject.manager(db).all()]
     deleteds=[]
-    for oId in idList:
-        if tableName=='book':
-            dbDeleteBook(oId,db=db)
-        elif tableName=='author':
-            dbDeleteAuthor(oId,db=db)
-        else:
-            raise NotImplementedError
-        deleteds.append(oId)
+    with dbStatisticsBatch(db):
+        for oId in idList:
+            if tableName=='book':
+                dbDeleteBook(oId,db=db)
+            elif tableName=='author':
+                dbDeleteAuthor(oId,db=db)
+            else:
+                raise NotImplementedError
+            deleteds.append(oId)
     if doCommit:
         db.commit()
     return {'deleted_%s' % tableName: deleteds}
@@ -0,0 +1,175 @@
+'''
+    jobs.py : background jobs (imports, exports, mass deletions)
+    run by a pool of worker threads of the process handling the request.
+
+    The status of the jobs lives in a separate, small DB file:
+    a job doing a long write transaction on the main DB holds its
+    write lock, and the progress updates must not wait for it.
+    Any process can thus report on any job; a job whose process
+    has gone away before finishing is reported as 'interrupted'.
+'''
+
+import errno
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from orm import Database
+
+# minimum interval between two progress writes of a job, in seconds
+PROGRESS_INTERVAL=0.5
+
+def _isProcessAlive(pid):
+    try:
+        os.kill(pid,0)
+        return True
+    except OSError as e:
+        # EPERM: it exists, but is not ours to signal
+        return e.errno==errno.EPERM
+
+class JobRunner():
+    '''
+        Runs jobs in a pool of 'numWorkers' threads, recording
+        their status in the 'job' table of the DB file 'jobFile'.
+
+        A job is a function progress, *args -> result, result being
+        JSON-serializable. The function can report how far it got
+        by calling progress(done,total), 'done' and 'total' being
+        counts of items of any kind.
+
+        'threadTeardown', if given, is called in the worker
+        thread after each job (e.g. to release its DB connection).
+        A forked process starts its own pool of threads.
+    '''
+    def __init__(self, jobFile, numWorkers, threadTeardown=None):
+        self.jobFile=jobFile
+        self.numWorkers=numWorkers
+        self.threadTeardown=threadTeardown
+        self.lock=threading.Lock()
+        self.pid=None
+        self.executor=None
+        self.tableReady=False
+
+    def _connect(self):
+        db=Database(self.jobFile, timeout=30)
+        if not self.tableReady:
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS job ('
+                'id TEXT PRIMARY KEY, '
+                'kind TEXT NOT NULL, '
+                'userid INTEGER, '
+                'status TEXT NOT NULL, '
+                'pid INTEGER, '
+                'created REAL, '
+                'started REAL, '
+                'finished REAL, '
+                'done INTEGER NOT NULL DEFAULT 0, '
+                'total INTEGER, '
+                'result TEXT, '
+                'error TEXT)'
+            )
+            db.commit()
+            self.tableReady=True
+        return db
+
+    def _update(self, jobId, **fields):
+        db=self._connect()
+        try:
+            db.execute(
+                'UPDATE job SET %s WHERE id=?' % ', '.join('%s=?' % fld for fld in sorted(fields.keys())),
+                *([fields[fld] for fld in sorted(fields.keys())]+[jobId])
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    def _getExecutor(self):
+        with self.lock:
+            if self.pid!=os.getpid():
+                # the threads of a parent process do not survive a fork
+                self.pid=os.getpid()
+                self.executor=ThreadPoolExecutor(max_workers=self.numWorkers)
+            return self.executor
+
+    def submit(self, kind, userId, function, *args):
+        '''
+            Enqueues a job, returns its id
+        '''
+        jobId=uuid.uuid4().hex
+        db=self._connect()
+        try:
+            db.execute(
+                'INSERT INTO job (id, kind, userid, status, pid, created) VALUES (?,?,?,?,?,?)',
+                jobId,
+                kind,
+                userId,
+                'queued',
+                os.getpid(),
+                time.time(),
+            )
+            db.commit()
+        finally:
+            db.close()
+        self._getExecutor().submit(self._run,jobId,function,args)
+        return jobId
+
+    def _run(self, jobId, function, args):
+        self._update(jobId,status='running',started=time.time())
+        lastWrite=[0.0]
+        def progress(done,total=None):
+            now=time.time()
+            if now-lastWrite[0]>=PROGRESS_INTERVAL or done==total:
+                lastWrite[0]=now
+                self._update(jobId,done=done,total=total)
+        try:
+            result=function(progress,*args)
+            self._update(
+                jobId,
+                status='done',
+                finished=time.time(),
+                result=json.dumps(result),
+            )
+        except Exception as e:
+            self._update(
+                jobId,
+                status='failed',
+                finished=time.time(),
+                error=str(e),
+            )
+        finally:
+            if self.threadTeardown is not None:
+                self.threadTeardown()
+
+    def get(self, jobId):
+        '''
+            Returns the status of a job as a dict (None if not found),
+            with the percent done and the throughput (items per second)
+            when known.
+        '''
+        db=self._connect()
+        try:
+            row=db.execute('SELECT * FROM job WHERE id=?',jobId).fetchone()
+        finally:
+            db.close()
+        if row is None:
+            return None
+        job=dict(row)
+        if job['status'] in ['queued','running'] and not _isProcessAlive(job['pid']):
+            job['status']='interrupted'
+        job['result']=json.loads(job['result']) if job['result'] is not None else None
+        if job['started'] is not None:
+            elapsed=(job['finished'] if job['finished'] is not None else time.time())-job['started']
+            job['elapsed']=elapsed
+            job['rate']=job['done']/elapsed if elapsed>0 else None
+        else:
+            job['elapsed']=None
+            job['rate']=None
+        if job['status']=='done':
+            job['percent']=100.0
+        elif job['total']:
+            job['percent']=100.0*job['done']/job['total']
+        else:
+            job['percent']=None
+        return job
@@ -0,0 +1,229 @@
+'''
+    lshindex.py : MinHash/LSH candidate index for the near-duplicate checks.
+
+    The features of an item are the letters/digrams of its similarity
+    vector (see string_vectorizer). The MinHash signature of the feature
+    set is cut into 'bands' of 'rows' values each, every band giving a
+    bucket stored in the lsh_band table: two items sharing at least
+    one bucket are candidates, to be then checked exactly with scalProd.
+
+    The layout (rows, bands) is derived from the number of hashes and
+    the target recall, i.e. the expected fraction of the similar pairs
+    (those passing the threshold) becoming candidates. This depends on
+    the Jaccard similarity of their feature sets, which is not bounded
+    by the threshold: e.g. a short title contained in a longer one
+    has a high cosine similarity, but shares few of its features.
+    The expected recall is then averaged over the distribution of the
+    Jaccard similarity of the similar pairs, given as quantiles measured
+    on a reference catalogue by tests_utils/evaluate_lsh.py (which also
+    measures the actual recall on the current DB).
+    The layout in use is recorded in the lsh_layout table,
+    so that the index gets rebuilt if the configuration changes.
+'''
+
+import random
+
+from config import (
+                        SIMILARITY_LSH_HASHES,
+                        SIMILARITY_LSH_RECALL,
+                        SIMILAR_AUTHOR_THRESHOLD,
+                        SIMILAR_BOOK_THRESHOLD,
+                    )
+from app.utils.string_vectorizer import vectorBase
+from app.database.vectorstore import dbLoadVectors
+
+# vector fields indexed for each entity, and the threshold they are checked against
+lshFields={
+    'book': ['title'],
+    'author': ['lastname','firstlast'],
+}
+lshThresholds={
+    'book': SIMILAR_BOOK_THRESHOLD,
+    'author': SIMILAR_AUTHOR_THRESHOLD,
+}
+
+# Jaccard similarity of the feature sets of the similar pairs:
+# 20 quantiles (at 2.5%, 7.5%, ..., 97.5%), see evaluate_lsh.py
+lshPairJaccards={
+    'book': [
+        0.13, 0.2, 0.23, 0.25, 0.29, 0.32, 0.33, 0.37, 0.4, 0.42,
+        0.45, 0.5, 0.5, 0.5, 0.52, 0.57, 0.6, 0.67, 1.0, 1.0,
+    ],
+    'author': [
+        0.29, 0.38, 0.38, 0.4, 0.43, 0.43, 0.44, 0.5, 0.5, 0.5,
+        0.56, 0.57, 0.57, 0.57, 0.6, 0.6, 0.67, 0.67, 0.71, 1.0,
+    ],
+}
+
+_baseColumns={base: column for column,base in enumerate(vectorBase)}
+# fixed seed: signatures must be the same across processes and runs
+_HASH_SEED=20191107
+_BUCKET_MODULUS=2**61-1
+
+def makeHashTables(numHashes):
+    '''
+        One random value per feature, per hash function.
+        The values are grouped by feature (a tuple of numHashes
+        values for each feature), so that signatures are computed
+        with a column-wise min over the features of an item.
+    '''
+    rnd=random.Random(_HASH_SEED)
+    hashMajor=[
+        [rnd.getrandbits(32) for _ in vectorBase]
+        for _ in range(numHashes)
+    ]
+    return list(zip(*hashMajor))
+
+_hashTables=makeHashTables(SIMILARITY_LSH_HASHES)
+
+def expectedRecall(layout,pairJaccards):
+    '''
+        The mean probability, for pairs with the given Jaccard
+        similarities, of sharing at least a bucket with this layout
+    '''
+    rows,bands=layout
+    return sum(
+        1.0-(1.0-jaccard**rows)**bands
+        for jaccard in pairJaccards
+    )/len(pairJaccards)
+
+def lshLayout(numHashes,pairJaccards,recall):
+    '''
+        Returns the (rows, bands) layout with the largest rows per band
+        (i.e. the fewest candidates) such that the expected recall
+        on pairs with the given Jaccard similarities is >= recall
+    '''
+    for rows in range(numHashes,0,-1):
+        layout=(rows,numHashes//rows)
+        if expectedRecall(layout,pairJaccards)>=recall:
+            return layout
+    return (1,numHashes)
+
+def layoutDescription(layout):
+    return '%i:%ix%i:%i' % (SIMILARITY_LSH_HASHES,layout[0],layout[1],_HASH_SEED)
+
+lshLayouts={
+    entity: lshLayout(SIMILARITY_LSH_HASHES,pairJaccards,SIMILARITY_LSH_RECALL)
+    for entity,pairJaccards in lshPairJaccards.items()
+}
+
+def bandBuckets(vector,layout,hashTables=_hashTables):
+    '''
+        Returns the list of (band, bucket) of a vector.
+        Empty vectors (no features) have no buckets.
+    '''
+    columns=[_baseColumns[base] for base in vector.keys()]
+    if len(columns)==0:
+        return []
+    signature=list(map(min,zip(*[hashTables[column] for column in columns])))
+    rows,bands=layout
+    buckets=[]
+    for band in range(bands):
+        bucket=0
+        for value in signature[band*rows:(band+1)*rows]:
+            bucket=(bucket*1000003+value) % _BUCKET_MODULUS
+        buckets.append((band,bucket))
+    return buckets
+
+def dbIndexLsh(db,entity,entityId,vectors):
+    '''
+        (Re)indexes an item given its vectors (a dict field -> vector
+        as in vectorstore). Does not commit.
+    '''
+    dbUnindexLsh(db,entity,entityId)
+    db.connection.executemany(
+        'INSERT OR IGNORE INTO lsh_band (entity, field, band, bucket, id) VALUES (?,?,?,?,?)',
+        [
+            (entity,field,band,bucket,entityId)
+            for field in lshFields[entity]
+            for band,bucket in bandBuckets(vectors[field],lshLayouts[entity])
+        ],
+    )
+
+def dbIndexNewLsh(db,entity,vectorMap):
+    '''
+        Indexes in one go items not indexed yet, given
+        a map id -> {field: vector}. Does not commit.
+    '''
+    db.connection.executemany(
+        'INSERT OR IGNORE INTO lsh_band (entity, field, band, bucket, id) VALUES (?,?,?,?,?)',
+        (
+            (entity,field,band,bucket,entityId)
+            for entityId,vectors in vectorMap.items()
+            for field in lshFields[entity]
+            for band,bucket in bandBuckets(vectors[field],lshLayouts[entity])
+        ),
+    )
+
+def dbUnindexLsh(db,entity,entityId):
+    '''
+        Removes an item from the index. Does not commit.
+    '''
+    db.execute('DELETE FROM lsh_band WHERE entity=? AND id=?',entity,entityId)
+
+def dbLshCandidates(db,entity,vectors):
+    '''
+        Returns the set of ids of the items sharing at least a bucket
+        with any of the given vectors (a dict field -> vector)
+    '''
+    candidateIds=set()
+    for field,vector in vectors.items():
+        for band,bucket in bandBuckets(vector,lshLayouts[entity]):
+            candidateIds|={
+                row[0]
+                for row in db.execute(
+                    'SELECT id FROM lsh_band WHERE entity=? AND field=? AND band=? AND bucket=?',
+                    entity,
+                    field,
+                    band,
+                    bucket,
+                ).fetchall()
+            }
+    return candidateIds
+
+def dbBuildLshIndex(db,entities=None):
+    '''
+        (Re)builds the index of some (default: all) entities
+        from the stored vectors, recording the layout. Does not commit.
+    '''
+    for entity in (entities if entities is not None else lshFields.keys()):
+        db.execute('DELETE FROM lsh_band WHERE entity=?',entity)
+        dbIndexNewLsh(db,entity,dbLoadVectors(db,entity))
+        db.execute(
+            'INSERT OR REPLACE INTO lsh_layout (entity, layout) VALUES (?,?)',
+            entity,
+            layoutDescription(lshLayouts[entity]),
+        )
+
+def staleLshEntities(db):
+    '''
+        Returns the entities whose recorded layout
+        differs from the configured one
+    '''
+    storedLayouts={
+        row[0]: row[1]
+        for row in db.execute('SELECT entity, layout FROM lsh_layout').fetchall()
+    }
+    return [
+        entity
+        for entity,layout in lshLayouts.items()
+        if storedLayouts.get(entity)!=layoutDescription(layout)
+    ]
+
+def dbEnsureLshIndex(db):
+    '''
+        Rebuilds the index of the entities whose recorded layout
+        differs from the configured one. Returns the rebuilt entities.
+    '''
+    if len(staleLshEntities(db))==0:
+        return []
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        # checked again, another process may have done it meanwhile
+        staleEntities=staleLshEntities(db)
+        dbBuildLshIndex(db,staleEntities)
+        db.commit()
+        return staleEntities
+    except:
+        db.connection.rollback()
+        raise
@@ -0,0 +1,330 @@
+'''
+    migrations.py : versioned changes to the DB schema
+    on top of the tables generated by the orm (indexes and so on).
+
+    The schema version of a DB file is stored in its 'user_version'
+    pragma: a migration is applied, in its own transaction,
+    only if its version is higher than that.
+
+    Each migration comes with a list of 'probe' queries, used
+    to report the query plans before and after applying it.
+'''
+
+import time
+
+from app.database.models import tableToModel
+from app.utils.stringlists import unrollStringList
+from app.database.titleindex import dbBuildTitleIndex
+from app.database.vectorstore import dbBuildVectorStore
+from app.database.lshindex import dbBuildLshIndex, staleLshEntities
+from app.database.querycompiler import lasteditSortKey
+
+def _populateBookAuthors(db):
+    '''
+        One-shot conversion of the comma-separated author lists
+        of books into book_author rows (dangling ids are dropped).
+        The author-side lists, now derived from book_author,
+        are cleared.
+    '''
+    authorIds={row[0] for row in db.execute('SELECT id FROM Author').fetchall()}
+    links=[
+        (bookId,authorId)
+        for bookId,authors in db.execute('SELECT id, authors FROM Book').fetchall()
+        for authorId in unrollStringList(authors or '')
+        if authorId in authorIds
+    ]
+    db.connection.executemany('INSERT OR IGNORE INTO book_author (book, author) VALUES (?,?)',links)
+    db.execute("UPDATE Author SET booklist='', bookcount=0")
+
+# tables whose contents are cached in-process as reference data (see refcache.py)
+referenceTables=['Author','House','User','Language','Booktype']
+
+def _generationTriggers(tableName):
+    '''
+        Triggers bumping the reference_generation counter
+        of a table upon any change to its rows
+    '''
+    return [
+        (
+            'CREATE TRIGGER IF NOT EXISTS %s_generation_%s AFTER %s ON %s BEGIN '
+            "UPDATE reference_generation SET generation=generation+1 WHERE tablename='%s'; END"
+        ) % (tableName.lower(),event.lower(),event,tableName,tableName)
+        for event in ['INSERT','UPDATE','DELETE']
+    ]
+
+def _entityGenerationTriggers(tableName,entity):
+    '''
+        Triggers bumping the reference_generation counter
+        '<tableName>_<entity>' upon changes to the rows
+        of a table having the given value in their 'entity' column
+    '''
+    counterName='%s_%s' % (tableName,entity)
+    conditions={
+        'INSERT': "NEW.entity='%s'" % entity,
+        'UPDATE': "OLD.entity='%s' OR NEW.entity='%s'" % (entity,entity),
+        'DELETE': "OLD.entity='%s'" % entity,
+    }
+    return [
+        (
+            'CREATE TRIGGER IF NOT EXISTS %s_generation_%s AFTER %s ON %s WHEN %s BEGIN '
+            "UPDATE reference_generation SET generation=generation+1 WHERE tablename='%s'; END"
+        ) % (counterName.lower(),event.lower(),event,tableName,conditions[event],counterName)
+        for event in ['INSERT','UPDATE','DELETE']
+    ]
+
+migrationList=[
+    {
+        'version': 1,
+        'description': 'Secondary indexes for name lookups, author duplicate checks and book filters',
+        'statements': [
+            'CREATE INDEX IF NOT EXISTS user_name ON User (name)',
+            'CREATE INDEX IF NOT EXISTS house_name ON House (name)',
+            'CREATE INDEX IF NOT EXISTS author_lower_names ON Author (lower(lastname), lower(firstname))',
+            'CREATE INDEX IF NOT EXISTS book_house ON Book (house)',
+            'CREATE INDEX IF NOT EXISTS book_upper_booktype ON Book (upper(booktype))',
+            'CREATE INDEX IF NOT EXISTS book_inhouse ON Book ((ifnull(inhouse,0)<>0))',
+        ],
+        'probes': [
+            ('SELECT * FROM User WHERE name=?', ['']),
+            ('SELECT * FROM House WHERE name=?', ['']),
+            ('SELECT id FROM Author WHERE lower(lastname)=? AND lower(firstname)=?', ['','']),
+            ('SELECT COUNT(*) FROM Book WHERE house=?', ['']),
+            ('SELECT COUNT(*) FROM Book WHERE upper(booktype)=?', ['']),
+            ('SELECT COUNT(*) FROM Book WHERE (ifnull(inhouse,0)<>0)=?', [0]),
+        ],
+    },
+    {
+        'version': 2,
+        'description': 'book_author link table replacing the comma-separated author/book id lists',
+        'statements': [
+            'CREATE TABLE IF NOT EXISTS book_author (book INTEGER NOT NULL, author INTEGER NOT NULL, PRIMARY KEY (book, author)) WITHOUT ROWID',
+            'CREATE INDEX IF NOT EXISTS book_author_author ON book_author (author, book)',
+            _populateBookAuthors,
+        ],
+        'probes': [
+            ("SELECT id FROM Book WHERE instr(',' || authors || ',', ',' || ? || ',')>0", ['1']),
+            ('SELECT id FROM Book WHERE id IN (SELECT book FROM book_author WHERE author=?)', [1]),
+        ],
+    },
+    {
+        'version': 3,
+        'description': 'Per-table generation counters of the reference data, kept by triggers',
+        'statements': [
+            'CREATE TABLE IF NOT EXISTS reference_generation (tablename TEXT PRIMARY KEY, generation INTEGER NOT NULL) WITHOUT ROWID',
+        ] + [
+            "INSERT OR IGNORE INTO reference_generation (tablename, generation) VALUES ('%s', 0)" % tableName
+            for tableName in referenceTables
+        ] + [
+            trigger
+            for tableName in referenceTables
+            for trigger in _generationTriggers(tableName)
+        ],
+        'probes': [
+            ('SELECT tablename, generation FROM reference_generation', []),
+        ],
+    },
+    {
+        'version': 4,
+        'description': 'Inverted index of the book title tokens (as suffixes)',
+        'statements': [
+            'CREATE TABLE IF NOT EXISTS title_suffix (book INTEGER NOT NULL, suffix TEXT NOT NULL, toklen INTEGER NOT NULL, PRIMARY KEY (book, suffix)) WITHOUT ROWID',
+            'CREATE INDEX IF NOT EXISTS title_suffix_suffix ON title_suffix (suffix, toklen)',
+            dbBuildTitleIndex,
+        ],
+        'probes': [
+            ("SELECT id FROM Book WHERE lower(title) LIKE ?", ['%ma%']),
+            ('SELECT id FROM Book WHERE id IN (SELECT book FROM title_suffix WHERE suffix>=? AND suffix<?)', ['ma','mb']),
+        ],
+    },
+    {
+        'version': 5,
+        'description': 'Precomputed similarity vectors of books and authors',
+        'statements': [
+            'CREATE TABLE IF NOT EXISTS entity_vector (entity TEXT NOT NULL, id INTEGER NOT NULL, field TEXT NOT NULL, vector TEXT NOT NULL, PRIMARY KEY (entity, id, field)) WITHOUT ROWID',
+            "INSERT OR IGNORE INTO reference_generation (tablename, generation) VALUES ('entity_vector', 0)",
+        ] + _generationTriggers('entity_vector') + [
+            dbBuildVectorStore,
+        ],
+        'probes': [
+            ('SELECT id, field, vector FROM entity_vector WHERE entity=?', ['book']),
+        ],
+    },
+    {
+        'version': 6,
+        'description': 'MinHash/LSH candidate index for the near-duplicate checks',
+        'statements': [
+            'CREATE TABLE IF NOT EXISTS lsh_band (entity TEXT NOT NULL, field TEXT NOT NULL, band INTEGER NOT NULL, bucket INTEGER NOT NULL, id INTEGER NOT NULL, PRIMARY KEY (entity, field, band, bucket, id)) WITHOUT ROWID',
+            'CREATE INDEX IF NOT EXISTS lsh_band_id ON lsh_band (entity, id)',
+            'CREATE TABLE IF NOT EXISTS lsh_layout (entity TEXT PRIMARY KEY, layout TEXT NOT NULL)',
+            dbBuildLshIndex,
+        ],
+        'probes': [
+            ('SELECT id FROM lsh_band WHERE entity=? AND field=? AND band=? AND bucket=?', ['book','title',0,0]),
+        ],
+    },
+    {
+        'version': 7,
+        'description': 'Indexes on the sort keys, for keyset pagination of books and authors',
+        'statements': [
+            'CREATE INDEX IF NOT EXISTS book_title ON Book (title)',
+            'CREATE INDEX IF NOT EXISTS book_lower_title ON Book (lower(title))',
+            'CREATE INDEX IF NOT EXISTS book_booktype ON Book (booktype)',
+            'CREATE INDEX IF NOT EXISTS book_lastedit ON Book (%s DESC)' % lasteditSortKey,
+            'CREATE INDEX IF NOT EXISTS author_firstname ON Author (firstname)',
+            'CREATE INDEX IF NOT EXISTS author_lastname ON Author (lastname)',
+        ],
+        'probes': [
+            ('SELECT * FROM Book WHERE title>=? AND (title>? OR (title=? AND id>?)) ORDER BY title, id LIMIT 10', ['m','m','m',0]),
+            ('SELECT * FROM Book ORDER BY lower(title), id LIMIT 10', []),
+            ('SELECT * FROM Book ORDER BY booktype, id LIMIT 10', []),
+            ('SELECT * FROM Book ORDER BY %s DESC, id LIMIT 10' % lasteditSortKey, []),
+            ('SELECT * FROM Author ORDER BY lastname, id LIMIT 10', []),
+        ],
+    },
+    {
+        'version': 8,
+        'description': 'Unique (name, subtype) index on statistics, for keyed UPSERT updates',
+        'statements': [
+            # duplicate keys (if any) are dropped, the oldest row is kept
+            'DELETE FROM Statistic WHERE id NOT IN (SELECT MIN(id) FROM Statistic GROUP BY name, subtype)',
+            'CREATE UNIQUE INDEX IF NOT EXISTS statistic_name_subtype ON Statistic (name, subtype)',
+        ],
+        'probes': [
+            ('SELECT value FROM Statistic WHERE name=? AND subtype=?', ['nbooks','']),
+        ],
+    },
+    {
+        'version': 9,
+        'description': 'Generation counter of the statistics, for the cached home page panel',
+        'statements': [
+            "INSERT OR IGNORE INTO reference_generation (tablename, generation) VALUES ('Statistic', 0)",
+        ] + _generationTriggers('Statistic'),
+        'probes': [
+            ('SELECT tablename, generation FROM reference_generation', []),
+        ],
+    },
+    {
+        'version': 10,
+        'description': 'Generation counter of the books, for the data stamp of the page ETags',
+        'statements': [
+            "INSERT OR IGNORE INTO reference_generation (tablename, generation) VALUES ('Book', 0)",
+        ] + _generationTriggers('Book'),
+        'probes': [
+            ('SELECT tablename, generation FROM reference_generation', []),
+        ],
+    },
+    {
+        'version': 11,
+        'description': 'Separate generation counters of the book and author similarity vectors',
+        'statements': [
+            'DROP TRIGGER IF EXISTS entity_vector_generation_%s' % event
+            for event in ['insert','update','delete']
+        ] + [
+            "DELETE FROM reference_generation WHERE tablename='entity_vector'",
+        ] + [
+            "INSERT OR IGNORE INTO reference_generation (tablename, generation) VALUES ('entity_vector_%s', 0)" % entity
+            for entity in ['book','author']
+        ] + [
+            trigger
+            for entity in ['book','author']
+            for trigger in _entityGenerationTriggers('entity_vector',entity)
+        ],
+        'probes': [
+            ('SELECT tablename, generation FROM reference_generation', []),
+        ],
+    },
+]
+
+def getSchemaVersion(db):
+    '''
+        Returns the schema version of a DB
+    '''
+    return db.execute('PRAGMA user_version').fetchone()[0]
+
+def pendingMigrations(db):
+    '''
+        Returns the list of migrations yet to apply to a DB, in order
+    '''
+    curVersion=getSchemaVersion(db)
+    return [
+        mig
+        for mig in sorted(migrationList,key=lambda m: m['version'])
+        if mig['version']>curVersion
+    ]
+
+def ensureTables(db):
+    '''
+        Makes sure all orm tables exist (the orm creates them lazily)
+        so that migrations can refer to them
+    '''
+    for qModel in tableToModel.values():
+        qModel.manager(db)
+
+def applyMigration(db,migration):
+    '''
+        Applies a migration, and sets the new schema version,
+        in a single transaction.
+        Returns False if the migration had already been applied
+        (e.g. by another process in the meantime)
+    '''
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        if getSchemaVersion(db)>=migration['version']:
+            db.connection.rollback()
+            return False
+        for statement in migration['statements']:
+            if callable(statement):
+                statement(db)
+            else:
+                db.execute(statement)
+        # pragma arguments cannot be bound parameters
+        db.execute('PRAGMA user_version=%i' % migration['version'])
+        db.commit()
+        return True
+    except:
+        db.connection.rollback()
+        raise
+
+def dbMigrate(db):
+    '''
+        Brings a DB to the latest schema version.
+        Returns the list of versions applied.
+    '''
+    ensureTables(db)
+    applied=[]
+    for migration in pendingMigrations(db):
+        if applyMigration(db,migration):
+            applied.append(migration['version'])
+    return applied
+
+def dbCheckSchema(db):
+    '''
+        Raises a RuntimeError if a DB is not up to date, i.e. has pending
+        migrations or an LSH index with another layout than configured:
+        scripts/db_migrate.py is to be run, the app does not do it by itself.
+    '''
+    latestVersion=max(mig['version'] for mig in migrationList)
+    curVersion=getSchemaVersion(db)
+    if curVersion<latestVersion:
+        raise RuntimeError(
+            'DB schema version is %i, the app requires %i: run scripts/db_migrate.py' % (
+                curVersion,
+                latestVersion,
+            )
+        )
+    staleEntities=staleLshEntities(db)
+    if len(staleEntities)>0:
+        raise RuntimeError(
+            'LSH index layout of %s differs from the configuration: run scripts/db_migrate.py' %
+                ', '.join(staleEntities)
+        )
+
+def explainQuery(db,sql,params):
+    '''
+        Returns the query plan of a query, as a list of strings,
+        and the time (in seconds) taken to actually run it
+    '''
+    plan=[row[-1] for row in db.execute('EXPLAIN QUERY PLAN %s' % sql,*params).fetchall()]
+    startTime=time.time()
+    db.execute(sql,*params).fetchall()
+    return plan,time.time()-startTime
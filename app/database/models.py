@@ -142,6 +142,8 @@ class Author(AutoModel):
     firstname=str
     lastname=str
     notes=str
+    # not maintained in the table (see book_author):
+    # filled upon reading by dbtools.dbAttachAuthorBooks
     bookcount=int
     booklist=str
 
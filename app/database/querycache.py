@@ -0,0 +1,122 @@
+'''
+    querycache.py : in-process LRU cache of the results of the queries
+    on books/authors that must be evaluated in memory (python filters
+    or python sorting, e.g. similarity searches).
+
+    What is kept is the whole ordered list of the matching ids, so that
+    another page of the same query, or going back to it (after an edit,
+    a deletion, a cancel), only needs to read the rows of that page.
+
+    Keys contain the data stamp (see dbtools.dbGetDataStamp), hence
+    any write to the tables makes the older entries unreachable:
+    these are not purged, they simply age out of the LRU.
+    The cache is bounded both in number of entries and in (estimated) bytes.
+'''
+
+from array import array
+from collections import OrderedDict
+import threading
+
+# query arguments only selecting the page, not the results
+_pagingArgs={'startfrom','cursor'}
+
+def normalizedQueryArgs(queryArgs):
+    '''
+        Returns a hashable form of a query multidict, ignoring
+        the paging arguments and the order of the keys
+        (but not that of the values of a key)
+    '''
+    return tuple(sorted(
+        (
+            (k,v)
+            for k,v in queryArgs.items(multi=True)
+            if k not in _pagingArgs
+        ),
+        key=lambda kv: kv[0],
+    ))
+
+class QueryResultCache():
+    '''
+        A process-level LRU map key -> ordered list of ids.
+        The ids are stored as a compact array, and the size
+        of an entry is estimated as that of its array plus its key.
+        A non-positive maxEntries disables the cache.
+    '''
+    def __init__(self, maxEntries, maxBytes):
+        self.maxEntries=maxEntries
+        self.maxBytes=maxBytes
+        self.lock=threading.Lock()
+        self.entries=OrderedDict()
+        self.nbytes=0
+        self.counters={
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0,
+        }
+
+    _itemSize=array('q').itemsize
+
+    @classmethod
+    def _entrySize(cls,key,numIds):
+        return numIds*cls._itemSize+len(repr(key))
+
+    @property
+    def enabled(self):
+        return self.maxEntries>0
+
+    def accepts(self, key, numIds):
+        '''
+            Whether a result of numIds ids would be stored by put,
+            so that callers can avoid preparing it otherwise
+        '''
+        return self.enabled and self._entrySize(key,numIds)<=self.maxBytes
+
+    def get(self, key):
+        '''
+            Returns the (shared, not to be modified) array of ids
+            for a key, None if not cached
+        '''
+        with self.lock:
+            ids=self.entries.get(key)
+            if ids is None:
+                self.counters['misses']+=1
+            else:
+                self.counters['hits']+=1
+                self.entries.move_to_end(key)
+            return ids
+
+    def put(self, key, idList):
+        '''
+            Stores the ordered ids of a query, evicting
+            the least recently used entries if over budget.
+            Returns the stored array (None if too large to be cached).
+        '''
+        ids=array('q',idList)
+        entrySize=self._entrySize(key,len(ids))
+        if not self.enabled or entrySize>self.maxBytes:
+            return None
+        with self.lock:
+            if key in self.entries:
+                self.nbytes-=self._entrySize(key,len(self.entries.pop(key)))
+            self.entries[key]=ids
+            self.nbytes+=entrySize
+            while len(self.entries)>self.maxEntries or self.nbytes>self.maxBytes:
+                oldKey,oldIds=self.entries.popitem(last=False)
+                self.nbytes-=self._entrySize(oldKey,len(oldIds))
+                self.counters['evictions']+=1
+            return ids
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes=0
+
+    def stats(self):
+        '''
+            Returns the usage counters and the current size
+        '''
+        with self.lock:
+            cacheStats=dict(self.counters)
+            cacheStats['entries']=len(self.entries)
+            cacheStats['bytes']=self.nbytes
+            return cacheStats
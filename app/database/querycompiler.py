@@ -0,0 +1,315 @@
+'''
+    querycompiler.py : translation of the search arguments of a query
+    into parameterized SQL fragments (WHERE/ORDER BY), so that filtering,
+    sorting and slicing are left to SQLite whenever possible.
+
+    Filters that cannot be expressed in SQL (e.g. those computing
+    a similarity score on the title) are kept as python functions
+    and evaluated in-memory on the rows surviving the SQL part.
+    The plain title search is done through the title index
+    (see titleindex.py), its relevance score being computed in SQL.
+
+    Sortings on plain keys come with their list of sort keys,
+    which allows keyset pagination: a page is requested with
+    an opaque 'cursor' carrying the keys of the item it starts after
+    (or, going back, before), instead of an offset.
+'''
+
+import base64
+import json
+
+from app.database.titleindex import prefixRange
+
+# a lasteditdate is considered valid (i.e. sortable) only if in DATETIME_STR_FORMAT
+_validDateGlob='[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9] [0-9][0-9]:[0-9][0-9]:[0-9][0-9]'
+# sort key for 'lastedit' (descending): unparseable dates come last, all tied
+lasteditSortKey="(CASE WHEN lasteditdate GLOB '%s' THEN lasteditdate ELSE '' END)" % _validDateGlob
+
+def _listContainsClause(columnName):
+    '''
+        SQL condition equivalent to "value in column.split(',')"
+        for a comma-separated-list column
+    '''
+    return "instr(',' || %s || ',', ',' || ? || ',')>0" % columnName
+
+def _titleFilter(fValue):
+    '''
+        SQL counterpart of the non-similarity title filter:
+        a book matches if any query term is a substring of a title token,
+        and each matching term scores
+            len(term) + (1+len(term))/len(shortest matching token)
+    '''
+    terms=fValue.lower().split(' ')
+    if any(len(term)==0 for term in terms):
+        # empty terms match everything: left to python
+        return None
+    termRanges=[prefixRange(term) for term in terms]
+    whereClause='id IN (SELECT book FROM title_suffix WHERE %s)' % ' OR '.join(
+        '(suffix>=? AND suffix<?)'
+        for _ in terms
+    )
+    whereParams=[bound for termRange in termRanges for bound in termRange]
+    scoreExpression='(%s)' % ' + '.join(
+        'ifnull(? + (1.0+?)/(SELECT MIN(toklen) FROM title_suffix WHERE book=Book.id AND suffix>=? AND suffix<?), 0.0)'
+        for _ in terms
+    )
+    scoreParams=[
+        param
+        for term,termRange in zip(terms,termRanges)
+        for param in [len(term),len(term)]+list(termRange)
+    ]
+    return (whereClause,whereParams,(scoreExpression,scoreParams))
+
+def compileBookFilter(fName,fValue,useSimilarity=False):
+    '''
+        Translates a query argument into a (whereClause, paramList)
+        pair equivalent to the corresponding makeBookFilter function.
+        Filters with a non-trivial score come as a triple instead,
+        the third item being a (scoreExpression, paramList) pair.
+
+        Returns None if the filter has no SQL counterpart
+        and must be evaluated in python.
+    '''
+    if fName=='title':
+        if useSimilarity:
+            return None
+        else:
+            return _titleFilter(fValue)
+    elif fName=='author':
+        return ('id IN (SELECT book FROM book_author WHERE author=?)',[int(fValue)])
+    elif fName=='booktype':
+        return ('upper(booktype)=?',[fValue.upper()])
+    elif fName=='language':
+        if ',' in fValue:
+            # no single item of the comma-separated list can match
+            return ('0',[])
+        else:
+            return (_listContainsClause('languages'),[fValue.upper()])
+    elif fName=='inhouse':
+        return ('(ifnull(inhouse,0)<>0)=?',[int(bool(int(fValue)))])
+    elif fName=='house':
+        if fValue!='-2':
+            return ('house=?',[fValue])
+        else:
+            # special all-house filter
+            return ('1',[])
+    else:
+        return None
+
+def compileAuthorFilter(fName,fValue,useSimilarity=False):
+    '''
+        Counterpart of compileBookFilter for authors. The name filters
+        are case-insensitive and SQLite lower() only folds ASCII:
+        they are all left to python (see makeAuthorFilter).
+    '''
+    return None
+
+def orderByClause(sortKeys,reverse=False):
+    '''
+        ORDER BY clause for a list of (expression, descending) sort keys,
+        possibly in the reverse direction
+    '''
+    return ', '.join(
+        '%s DESC' % expression if descending!=reverse else expression
+        for expression,descending in sortKeys
+    )
+
+def _keyedSorter(sortKeys):
+    '''
+        (orderByClause, paramList, sortKeys) triple for a sorting on
+        parameter-free keys, ties resolved by id
+    '''
+    fullKeys=sortKeys+[('id',False)]
+    return (orderByClause(fullKeys),[],fullKeys)
+
+def keysetCondition(sortKeys,keyValues,reverse=False):
+    '''
+        Returns a (whereClause, paramList) pair selecting the items
+        strictly after (before, if reverse) the given key values
+        in the order of sortKeys. The redundant bound on the first key
+        lets SQLite seek the index directly to the cursor position.
+    '''
+    def comparison(descending):
+        return '<' if descending!=reverse else '>'
+    firstKey,firstDescending=sortKeys[0]
+    alternatives=[]
+    params=[keyValues[0]]
+    for keyIndex,(expression,descending) in enumerate(sortKeys):
+        alternatives.append(' AND '.join(
+            ['%s=?' % prevExpression for prevExpression,_ in sortKeys[:keyIndex]]+
+            ['%s%s?' % (expression,comparison(descending))]
+        ))
+        params+=keyValues[:keyIndex+1]
+    whereClause='%s%s=? AND (%s)' % (
+        firstKey,
+        comparison(firstDescending),
+        ' OR '.join('(%s)' % alternative for alternative in alternatives),
+    )
+    return (whereClause,params)
+
+def encodeCursor(sortBy,direction,position,keyValues):
+    '''
+        Makes an opaque (url-safe) cursor out of the sort name, the direction
+        ('next': items after the keys, 'prev': items before the keys),
+        the index of the first item of the page it leads to
+        and the key values of the boundary item
+    '''
+    return base64.urlsafe_b64encode(
+        json.dumps([sortBy,direction,position,keyValues]).encode()
+    ).decode()
+
+def decodeCursor(cursor):
+    '''
+        Inverse of encodeCursor, returns a dict
+        (sortby, direction, position, keys) or None if invalid
+    '''
+    try:
+        sortBy,direction,position,keyValues=json.loads(
+            base64.urlsafe_b64decode(cursor.encode()).decode()
+        )
+        if direction not in {'next','prev'} or not isinstance(keyValues,list):
+            return None
+        return {
+            'sortby': sortBy,
+            'direction': direction,
+            'position': max(0,int(position)),
+            'keys': keyValues,
+        }
+    except:
+        return None
+
+def compileBookSorter(sName,pythonFiltering=False,relevance=None):
+    '''
+        Returns the (orderByClause, paramList) pair equivalent to the
+        makeBookSorter sorting (ties are resolved by id, as the stable
+        python sort does). 'relevance' is the (expression, paramList)
+        pair of the product of the filter scores, None if all score 1.0.
+        Sortings on plain keys come as a triple instead,
+        the third item being the list of (expression, descending) keys.
+
+        Returns None if the sorting must be done in python,
+        i.e. for relevance-sorting with python-evaluated filters.
+    '''
+    if sName=='title':
+        return _keyedSorter([('title',False)])
+    elif sName=='booktype':
+        return _keyedSorter([('booktype',False)])
+    elif sName=='lastedit':
+        # most recent first, unparseable dates last
+        return _keyedSorter([(lasteditSortKey,True)])
+    elif sName=='relevance':
+        if pythonFiltering:
+            return None
+        elif relevance is not None:
+            return ('%s DESC, id' % relevance[0],relevance[1])
+        else:
+            # all SQL filters score 1.0: relevance does not discriminate
+            return ('id',[])
+    else:
+        # default ordering of Book objects
+        return _keyedSorter([('lower(title)',False)])
+
+def compileAuthorSorter(sName,pythonFiltering=False,relevance=None):
+    '''
+        Counterpart of compileBookSorter for authors. The default
+        ordering (Author.__lt__) is left to python.
+    '''
+    if sName=='firstname':
+        return _keyedSorter([('firstname',False)])
+    elif sName=='lastname':
+        return _keyedSorter([('lastname',False)])
+    else:
+        return None
+
+def compileQuery(queryArgs,filterCompiler,pythonFilterMaker,sorterCompiler,pythonSorterMaker):
+    '''
+        Parses a query multidict into a compiled query, i.e. a dict with:
+            where           = list of SQL conditions (to be AND-ed)
+            params          = parameters for the conditions, in order
+            pythonfilters   = list of Object->score filters for in-memory evaluation
+            orderby         = ORDER BY clause, None if sorting must be done in python
+            orderparams     = parameters for the ORDER BY clause
+            sortkeys        = (expression, descending) sort keys, None if not keyed
+            pythonsorter    = python sorter (None: default ordering) if orderby is None
+            sortby          = the requested sorting name (None if not given)
+            startfrom       = index of the first item to return
+            cursor          = the decoded cursor (see decodeCursor), None if not given.
+                              It takes precedence over startfrom
+
+        'filterCompiler' and 'sorterCompiler' are e.g. compileBookFilter/compileBookSorter,
+        'pythonFilterMaker' is a function (name,value,useSimilarity) -> python filter
+        used for the arguments the filterCompiler cannot translate,
+        'pythonSorterMaker' (e.g. makeBookSorter) likewise for the sorting.
+    '''
+    compiled={
+        'where': [],
+        'params': [],
+        'pythonfilters': [],
+        'orderby': None,
+        'orderparams': [],
+        'sortkeys': None,
+        'pythonsorter': None,
+        'sortby': None,
+        'startfrom': 0,
+        'cursor': None,
+    }
+    # first determine if searches are by-similarity
+    useSimilarity=False
+    if 'similarity' in queryArgs:
+        for v in queryArgs.getlist('similarity'):
+            try:
+                useSimilarity=bool(int(v))
+            except:
+                pass
+    scoredFilters=[]
+    for k in queryArgs.keys():
+        for v in queryArgs.getlist(k):
+            # first deal with the non-filtering arguments
+            if k=='startfrom':
+                compiled['startfrom']=int(v)
+            elif k=='cursor':
+                compiled['cursor']=decodeCursor(v)
+            elif k=='sortby':
+                compiled['sortby']=v
+            elif k=='similarity':
+                pass # already dealt with
+            else:
+                sqlFilter=filterCompiler(k,v,useSimilarity=useSimilarity)
+                if sqlFilter is not None:
+                    compiled['where'].append(sqlFilter[0])
+                    compiled['params']+=sqlFilter[1]
+                    if len(sqlFilter)>2:
+                        scoredFilters.append((k,v,sqlFilter[2]))
+                else:
+                    compiled['pythonfilters'].append(pythonFilterMaker(k,v,useSimilarity=useSimilarity))
+    if compiled['pythonfilters']:
+        # scores are then all multiplied in python
+        # (the SQL conditions still narrow down the rows)
+        for k,v,_ in scoredFilters:
+            compiled['pythonfilters'].append(pythonFilterMaker(k,v,useSimilarity=useSimilarity))
+        relevance=None
+    elif scoredFilters:
+        relevance=(
+            ' * '.join(score[0] for _,_,score in scoredFilters),
+            [param for _,_,score in scoredFilters for param in score[1]],
+        )
+    else:
+        relevance=None
+    compiledSorter=sorterCompiler(
+        compiled['sortby'],
+        pythonFiltering=len(compiled['pythonfilters'])>0,
+        relevance=relevance,
+    )
+    if compiledSorter is not None:
+        compiled['orderby'],compiled['orderparams']=compiledSorter[:2]
+        if len(compiledSorter)>2:
+            compiled['sortkeys']=compiledSorter[2]
+    else:
+        compiled['pythonsorter']=pythonSorterMaker(compiled['sortby'])
+    # a cursor is valid only for the sorting it was made for
+    cursor=compiled['cursor']
+    if cursor is not None:
+        if (compiled['sortkeys'] is None or cursor['sortby']!=compiled['sortby']
+                or len(cursor['keys'])!=len(compiled['sortkeys'])):
+            compiled['cursor']=None
+    return compiled
@@ -0,0 +1,106 @@
+'''
+    refcache.py : in-process cache of the reference data
+    (authors, houses, users, languages, booktypes) used to resolve
+    the references of the objects being displayed, and of other
+    data derived from the DB (e.g. the similarity vectors).
+
+    Each cached table has a generation counter in the DB
+    (table reference_generation), bumped by triggers by any write
+    to the table, whichever the process doing it.
+
+    A dedicated connection watches 'PRAGMA data_version', which changes
+    only when some other connection commits: as long as it is unchanged
+    the cache is valid without further queries, otherwise the counters
+    are read and only the tables whose generation changed are reloaded.
+'''
+
+import os
+import threading
+from orm import Database
+
+class ReferenceCache():
+    '''
+        A process-level cache of per-table reference data.
+
+        'sectionLoaders' maps each section name to a pair
+        (tableName, loader), loader being a function db -> value.
+        A section depending on several tables has a list
+        of table names instead, and is reloaded if any changes.
+        A forked process does not reuse the watching connection
+        of its parent.
+    '''
+    def __init__(self, dbFile, sectionLoaders):
+        self.dbFile=dbFile
+        self.sectionLoaders=sectionLoaders
+        self.lock=threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.pid=os.getpid()
+        self.watchDb=None
+        self.dataVersion=None
+        self.generations={}
+        self.values={}
+        # bumped at each reload of any section
+        self.generation=0
+        self.counters={
+            'hits': 0,
+            'checks': 0,
+            'reloads': 0,
+        }
+
+    def _refresh(self):
+        '''
+            Reloads the sections whose table changed since last time.
+            To be called with the lock held.
+        '''
+        if os.getpid()!=self.pid:
+            self._reset()
+        if self.watchDb is None:
+            self.watchDb=Database(self.dbFile, check_same_thread=False)
+        dataVersion=self.watchDb.execute('PRAGMA data_version').fetchone()[0]
+        if dataVersion==self.dataVersion and len(self.values)==len(self.sectionLoaders):
+            self.counters['hits']+=1
+            return
+        self.counters['checks']+=1
+        tableGenerations={
+            row[0]: row[1]
+            for row in self.watchDb.execute('SELECT tablename, generation FROM reference_generation').fetchall()
+        }
+        for section,(tableNames,loader) in self.sectionLoaders.items():
+            if isinstance(tableNames,str):
+                tableGeneration=tableGenerations.get(tableNames)
+            else:
+                tableGeneration=tuple(tableGenerations.get(tableName) for tableName in tableNames)
+            if section not in self.values or self.generations.get(section)!=tableGeneration:
+                self.values[section]=loader(self.watchDb)
+                self.generations[section]=tableGeneration
+                self.generation+=1
+                self.counters['reloads']+=1
+        self.dataVersion=dataVersion
+
+    def get(self, section):
+        '''
+            Returns the up-to-date value of a section.
+            The returned values are shared: they must not be modified.
+        '''
+        with self.lock:
+            self._refresh()
+            return self.values[section]
+
+    def getAll(self):
+        '''
+            Returns a (new) dict with the up-to-date values of all sections
+        '''
+        with self.lock:
+            self._refresh()
+            return dict(self.values)
+
+    def stats(self):
+        '''
+            Returns the usage counters and the current generation
+        '''
+        with self.lock:
+            cacheStats=dict(self.counters)
+            cacheStats['generation']=self.generation
+            return cacheStats
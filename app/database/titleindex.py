@@ -0,0 +1,77 @@
+'''
+    titleindex.py : inverted index of the book title tokens,
+    stored in the title_suffix table.
+
+    A query term matches a title token if it is a substring of it,
+    i.e. if it is a prefix of one of the token suffixes: storing all
+    suffixes of all tokens of a title, a term is looked up with a range
+    scan on the (sorted) suffix index.
+    For each (book, suffix) the length of the shortest token having
+    that suffix is kept, as the title relevance score is based on it.
+'''
+
+def titleTokens(title):
+    '''
+        The tokens of a title, as used by the title search
+        (empty tokens, not matching any term, excluded)
+    '''
+    return [tok for tok in title.lower().split(' ') if len(tok)>0]
+
+def titleSuffixes(title):
+    '''
+        Returns a map suffix -> shortest length of a token
+        having that suffix, for all tokens of a title
+    '''
+    suffixes={}
+    for tok in titleTokens(title):
+        for i in range(len(tok)):
+            suffix=tok[i:]
+            if suffix not in suffixes or suffixes[suffix]>len(tok):
+                suffixes[suffix]=len(tok)
+    return suffixes
+
+def prefixRange(term):
+    '''
+        Returns the (lower, upper) bounds such that
+        lower <= s < upper if and only if s starts with term
+    '''
+    return (term,term[:-1]+chr(ord(term[-1])+1))
+
+def dbIndexBookTitle(db,bookId,title):
+    '''
+        (Re)indexes the title of a book.
+        Does not commit.
+    '''
+    dbUnindexBookTitle(db,bookId)
+    db.connection.executemany(
+        'INSERT INTO title_suffix (book, suffix, toklen) VALUES (?,?,?)',
+        [(bookId,suffix,tokLen) for suffix,tokLen in titleSuffixes(title).items()],
+    )
+
+def dbUnindexBookTitle(db,bookId):
+    '''
+        Removes a book from the index. Does not commit.
+    '''
+    db.execute('DELETE FROM title_suffix WHERE book=?',bookId)
+
+def dbIndexNewBookTitles(db,bookTitles):
+    '''
+        Indexes in one go the titles of books not indexed yet,
+        given an iterable of (bookId, title). Does not commit.
+    '''
+    db.connection.executemany(
+        'INSERT OR REPLACE INTO title_suffix (book, suffix, toklen) VALUES (?,?,?)',
+        (
+            (bookId,suffix,tokLen)
+            for bookId,title in bookTitles
+            for suffix,tokLen in titleSuffixes(title or '').items()
+        ),
+    )
+
+def dbBuildTitleIndex(db):
+    '''
+        (Re)builds the whole index from the Book table.
+        Does not commit.
+    '''
+    db.execute('DELETE FROM title_suffix')
+    dbIndexNewBookTitles(db,db.execute('SELECT id, title FROM Book').fetchall())
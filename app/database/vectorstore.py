@@ -0,0 +1,108 @@
+'''
+    vectorstore.py : precomputed similarity vectors of books and authors,
+    stored (as JSON) in the entity_vector table, one row per
+    (entity, id, field).
+
+    Fields are:
+        book    :   'title'     = vector of the title
+                    'tokens'    = list of [length, vector] for each title token
+        author  :   'firstname', 'lastname'
+                    'firstlast' = vector of firstname+lastname
+                    'lastfirst' = vector of 'lastname firstname'
+'''
+
+import json
+
+from app.utils.string_vectorizer import makeIntoVector
+
+def bookVectors(title):
+    '''
+        Computes the vectors of a book, given its title
+    '''
+    return {
+        'title': makeIntoVector(title.lower()),
+        'tokens': [
+            [len(tok),makeIntoVector(tok)]
+            for tok in title.lower().split(' ')
+        ],
+    }
+
+def authorVectors(firstname,lastname):
+    '''
+        Computes the vectors of an author, given the names
+    '''
+    return {
+        'firstname': makeIntoVector(firstname),
+        'lastname': makeIntoVector(lastname),
+        'firstlast': makeIntoVector(firstname+lastname),
+        'lastfirst': makeIntoVector('%s %s' % (lastname,firstname)),
+    }
+
+def dbStoreVectors(db,entity,entityId,vectors):
+    '''
+        Stores the vectors of an entity, writing only
+        the fields that changed. Does not commit.
+    '''
+    storedVectors={
+        row[0]: row[1]
+        for row in db.execute(
+            'SELECT field, vector FROM entity_vector WHERE entity=? AND id=?',
+            entity,
+            entityId,
+        ).fetchall()
+    }
+    for field,vector in vectors.items():
+        serialized=json.dumps(vector)
+        if storedVectors.get(field)!=serialized:
+            db.execute(
+                'INSERT OR REPLACE INTO entity_vector (entity, id, field, vector) VALUES (?,?,?,?)',
+                entity,
+                entityId,
+                field,
+                serialized,
+            )
+    for field in set(storedVectors.keys())-set(vectors.keys()):
+        db.execute('DELETE FROM entity_vector WHERE entity=? AND id=? AND field=?',entity,entityId,field)
+
+def dbStoreNewVectors(db,entity,vectorMap):
+    '''
+        Stores in one go the vectors of items not stored yet,
+        given a map id -> {field: vector}. Does not commit.
+    '''
+    db.connection.executemany(
+        'INSERT OR REPLACE INTO entity_vector (entity, id, field, vector) VALUES (?,?,?,?)',
+        (
+            (entity,entityId,field,json.dumps(vector))
+            for entityId,vectors in vectorMap.items()
+            for field,vector in vectors.items()
+        ),
+    )
+
+def dbDeleteVectors(db,entity,entityId):
+    '''
+        Removes the vectors of an entity. Does not commit.
+    '''
+    db.execute('DELETE FROM entity_vector WHERE entity=? AND id=?',entity,entityId)
+
+def dbLoadVectors(db,entity):
+    '''
+        Returns a map id -> {field: vector} for all items of an entity
+    '''
+    vectorMap={}
+    for entityId,field,vector in db.execute(
+                'SELECT id, field, vector FROM entity_vector WHERE entity=?',
+                entity,
+            ).fetchall():
+        vectorMap.setdefault(entityId,{})[field]=json.loads(vector)
+    return vectorMap
+
+def dbBuildVectorStore(db):
+    '''
+        (Re)builds the vectors of all books and authors.
+        Does not commit.
+    '''
+    db.execute('DELETE FROM entity_vector')
+    for bookId,title in db.execute('SELECT id, title FROM Book').fetchall():
+        dbStoreVectors(db,'book',bookId,bookVectors(title or ''))
+    for authorId,firstname,lastname in db.execute('SELECT id, firstname, lastname FROM Author').fetchall():
+        dbStoreVectors(db,'author',authorId,authorVectors(firstname or '',lastname or ''))
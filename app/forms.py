@@ -29,6 +29,16 @@ class ExportDataForm(FlaskForm):
     includeauthors = BooleanField('includeauthors', default = True)
     includemetadata=BooleanField('includemetadata', default=True)
     house=SelectField('house')
+    exportformat=SelectField(
+        'exportformat',
+        choices=[
+            ('json','JSON'),
+            ('ndjson','NDJSON (one item per line)'),
+            ('csv','CSV (books only)'),
+        ],
+        default='json',
+    )
+    compress=BooleanField('compress', default=False)
     submit = SubmitField('Export')
 
     def setHouses(self,hoPairList):
@@ -22,17 +22,38 @@ translatedCharacters={
     u'à': 'a',
 }
 
+_validCharacterSet=set(validCharacters)
+# the translation as a str.translate table (all replacements are ascii,
+# so applying them at once is the same as applying them in turn)
+_translationTable=str.maketrans(translatedCharacters)
+
+class _ForcedTranslationTable(dict):
+    '''
+        str.translate table mapping the translated characters as
+        _translationTable, keeping the valid ones and dropping all others.
+        Entries for the other characters are made as they are met.
+    '''
+    def __missing__(self, code):
+        self[code]=code if chr(code) in _validCharacterSet else None
+        return self[code]
+
+_forcedTranslationTable=_ForcedTranslationTable(_translationTable)
+
 def nonAsciiCharacters(inString):
     '''
         returns all non-pure-ascii chars found in the string, taken once
     '''
-    return set(list(inString))-set(list(validCharacters))
+    if isAscii(inString):
+        return set()
+    else:
+        return set(inString)-_validCharacterSet
 
 def isAscii(inString):
     '''
         returns True only if all chars in the input are basic ascii
     '''
-    return len(nonAsciiCharacters(inString))==0
+    # the printable ascii characters are exactly validCharacters
+    return inString.isascii() and inString.isprintable()
 
 def ascifiiString(inString, forceAsciification=False):
     '''
@@ -41,6 +62,31 @@ def ascifiiString(inString, forceAsciification=False):
         if forceAsciification is True, the string is forcefully converted to a pure ascii,
             even at the cost of losing characters (non-ascii which do not fall into the translation table)
     '''
+    if isAscii(inString):
+        return inString
+    elif forceAsciification:
+        return inString.translate(_forcedTranslationTable)
+    else:
+        return inString.translate(_translationTable)
+
+def referenceNonAsciiCharacters(inString):
+    '''
+        Same as nonAsciiCharacters.
+        Reference implementation, with a set of the valid characters made at each call.
+    '''
+    return set(list(inString))-set(list(validCharacters))
+
+def referenceIsAscii(inString):
+    '''
+        Same as isAscii. Reference implementation.
+    '''
+    return len(referenceNonAsciiCharacters(inString))==0
+
+def referenceAscifiiString(inString, forceAsciification=False):
+    '''
+        Same as ascifiiString.
+        Reference implementation, one replacement at a time.
+    '''
     resString=inString
     for k,v in translatedCharacters.items():
         resString=resString.replace(k,v)
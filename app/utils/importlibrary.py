@@ -1,24 +1,41 @@
 '''
     importlibrary.py : functions and utilities to deal with all steps of the import process
+
+    The three steps can run as a pipeline over a stream of books, processed
+    a chunk (IMPORT_CHUNK_SIZE books) at a time, with their output written
+    as NDJSON (see iter_csv_books, process_book_stream, import_from_bilist_ndjson):
+    apart from the similarity vectors of the known books/authors,
+    memory does not grow with the input.
+    The functions working on whole json structures are built on the same steps.
 '''
 
 import csv, re
 from operator import itemgetter
 from datetime import datetime
 from collections import Counter
+from itertools import count, islice
 import json
+import shutil
+import tempfile
 
 from app import languagesDict, booktypesDict
-from config import DATETIME_STR_FORMAT, SIMILAR_AUTHOR_THRESHOLD, SIMILAR_BOOK_THRESHOLD
+from config import (
+                        DATETIME_STR_FORMAT,
+                        SIMILAR_AUTHOR_THRESHOLD,
+                        SIMILAR_BOOK_THRESHOLD,
+                        IMPORT_CHUNK_SIZE,
+                    )
 from app.database.models import (
                                     tableToModel,
                                     Book,
                                     Author,
                                 )
 from app.database.dbtools import    (
-                                        dbAddReplaceAuthor,
-                                        dbAddReplaceBook,
+                                        dbBulkAddAuthors,
+                                        dbBulkAddBooks,
                                         dbGetAll,
+                                        dbGetVectors,
+                                        dbStatisticsBatch,
                                     )
 from app.utils.ascii_checks import  (
                                         validCharacters,
@@ -27,8 +44,10 @@ from app.utils.ascii_checks import  (
                                     )
 from app.utils.string_vectorizer import (
                                             makeIntoVector,
-                                            scalProd
+                                            scalProd,
+                                            similarPairs,
                                         )
+from app.utils.streamexport import iterNdjsonExport
 
 # tools
 def reverseDict(qdict):
@@ -43,207 +62,535 @@ abbreviationFinder=re.compile('[A-Za-z]{1,3}\.')
 # these are for finding authors in book notes of the form "(xxxyyyzzz, with James Ararra)"
 conIntroducers=['mit ', 'con ','with ','avec '] # these must be LOWERCASE
 
-def import_from_bilist_json(inFileHandle,importingUser,db):
+def chunked(items,chunkSize=IMPORT_CHUNK_SIZE):
+    '''
+        Generates the lists of (at most) chunkSize
+        consecutive elements of an iterable
+    '''
+    itemIterator=iter(items)
+    chunk=list(islice(itemIterator,chunkSize))
+    while chunk:
+        yield chunk
+        chunk=list(islice(itemIterator,chunkSize))
+
+def writeChunks(outFileHandle,chunks):
+    '''
+        Writes the (byte) chunks to a binary file
+    '''
+    for chunk in chunks:
+        outFileHandle.write(chunk)
+
+def import_from_bilist_json(inFileHandle,importingUser,db,progress=None):
     '''
         main driver of the edited-json to DB import, last act (actual DB import/insert)
 
-        Handles insertion of the author list and the book list, adjusting similarities in case
-        it is needed. Gets the text to de-jsonize and the db on which to act.
+        Gets the text to de-jsonize and the db on which to act,
+        see import_from_bilist.
+
+        DOES NOT DO DB-COMMIT BY ITSELF
+
+    '''
+    inputContents='\n'.join(inFileHandle)
+    return import_from_bilist(json.loads(inputContents),importingUser,db,progress=progress)
+
+def iter_ndjson_items(inFileHandle):
+    '''
+        Generates the (kind, item) of an NDJSON export (one author/book
+        object per line, its kind in the '_type' field, removed from the item).
+        Lines are parsed one at a time, blank lines are skipped.
+    '''
+    for lineNumber,line in enumerate(inFileHandle):
+        if line.strip()!='':
+            item=json.loads(line)
+            itemType=item.pop('_type',None)
+            if itemType in ['author','book']:
+                yield itemType,item
+            else:
+                raise ValueError('Line %i: unknown item type "%s"' % (lineNumber+1,itemType))
+
+def iter_ndjson_books(inFileHandle):
+    '''
+        Generates the books of an NDJSON file (e.g. the output
+        of the first import step), ignoring the authors
+    '''
+    return (item for itemType,item in iter_ndjson_items(inFileHandle) if itemType=='book')
+
+def read_ndjson_bilist(inFileHandle):
+    '''
+        Reads an NDJSON export (one author/book object per line,
+        its kind in the '_type' field) into a books/authors bilist.
+    '''
+    bilist={'authors': [], 'books': []}
+    for itemType,item in iter_ndjson_items(inFileHandle):
+        bilist['%ss' % itemType].append(item)
+    return bilist
+
+def import_from_bilist_ndjson(inFileHandle,importingUser,db,progress=None):
+    '''
+        Same as import_from_bilist_json, for an NDJSON export,
+        read as a stream: the authors must all come before the books,
+        which are inserted a chunk at a time (progress, if given,
+        is called with an unknown total).
 
         DOES NOT DO DB-COMMIT BY ITSELF
+    '''
+    ndjsonItems=iter_ndjson_items(inFileHandle)
+    authorList=[]
+    firstBooks=[]
+    for itemType,item in ndjsonItems:
+        if itemType=='author':
+            authorList.append(item)
+        else:
+            firstBooks.append(item)
+            break
+    def _books():
+        for book in firstBooks:
+            yield book
+        for itemType,item in ndjsonItems:
+            if itemType=='author':
+                raise ValueError('Authors must precede all books in the NDJSON input')
+            yield item
+    return import_from_bilist_stream(authorList,chunked(_books()),importingUser,db,progress=progress)
+
+def import_from_bilist(inputBilist,importingUser,db,progress=None):
+    '''
+        Handles insertion of the author list and the book list
+        of a bilist structure, adjusting similarities in case it is needed.
+        If given, progress(done,total) is called after each
+        inserted item (authors first, then books).
+
+        DOES NOT DO DB-COMMIT BY ITSELF
+
+    '''
+    return import_from_bilist_stream(
+        inputBilist['authors'],
+        [inputBilist['books']],
+        importingUser,
+        db,
+        progress=progress,
+        nItems=len(inputBilist['authors'])+len(inputBilist['books']),
+    )
+
+def import_from_bilist_stream(authorList,bookChunks,importingUser,db,progress=None,nItems=None):
+    '''
+        Inserts the author list, then the books given as an iterable
+        of lists (each inserted at once). The whole import is a
+        single transaction. If given, progress(done,nItems) is called
+        after each inserted item (authors first, then books).
 
+        DOES NOT DO DB-COMMIT BY ITSELF
     '''
     if importingUser.canedit:
         #
         editdate=datetime.now().strftime(DATETIME_STR_FORMAT)
-        #
-        inputContents='\n'.join(inFileHandle)
-        inputBilist=json.loads(inputContents)
-        # add some default for missing items in books
-        for tBook in inputBilist['books']:
-            if 'inhouse' not in tBook:
-                tBook['inhouse']=True
-            if 'inhousenotes' not in tBook:
-                tBook['inhousenotes']=''
-            if 'notes' not in tBook:
-                tBook['notes']=''
-        #  
-        authorInsertionReport=insert_authors_from_structure(inputBilist['authors'],db)
-        newAuthorMap={
-            (au.lastname,au.firstname): au.id
-            for au in dbGetAll('author')
-        }
-        newAuthorMap.update(authorInsertionReport['authoridmap'])
-        del authorInsertionReport['authoridmap']
-        bookInsertionReport=insert_books_from_structure(inputBilist['books'],newAuthorMap,importingUser,db,editdate)
+        if progress is not None:
+            itemCounter=count(1)
+            onItem=lambda: progress(next(itemCounter),nItems)
+        else:
+            onItem=None
+        # statistics are updated once at the end
+        with dbStatisticsBatch(db):
+            authorInsertionReport=insert_authors_from_structure(authorList,db,onItem=onItem)
+            newAuthorMap={
+                (au.lastname,au.firstname): au.id
+                for au in dbGetAll('author')
+            }
+            newAuthorMap.update(authorInsertionReport['authoridmap'])
+            del authorInsertionReport['authoridmap']
+            bookInsertionReport={'success': {}, 'errors': {}}
+            for bookChunk in bookChunks:
+                # add some default for missing items in books
+                for tBook in bookChunk:
+                    if 'inhouse' not in tBook:
+                        tBook['inhouse']=True
+                    if 'inhousenotes' not in tBook:
+                        tBook['inhousenotes']=''
+                    if 'notes' not in tBook:
+                        tBook['notes']=''
+                mergeReports(
+                    bookInsertionReport,
+                    insert_books_from_structure(bookChunk,newAuthorMap,importingUser,db,editdate,onItem=onItem),
+                )
         return {'authors_insertion': authorInsertionReport, 'books_insertion': bookInsertionReport}
     else:
         return {'errors': 'user_cannot_write_to_DB'}
 
-def process_book_list(inFileHandle):
+def _dbSimilarityLists():
     '''
-        main driver of the booklist-to-structuredlists conversion.
-
-        Handles the author extraction from books,
-        the validation of authors with warnings,
-        the generation of the annotated book list
+        db-listings of authors and books with their
+        precomputed vectors, as needed by BookListProcessor
     '''
-    # db-listings of authors and books are needed at this point
+    authorVectorMap=dbGetVectors('author')
+    bookVectorMap=dbGetVectors('book')
     def _auObjCopy(auO):
-        return {
+        auS={
             'firstname': auO.firstname,
             'lastname': auO.lastname,
             'notes': auO.notes,
         }
+        if auO.id in authorVectorMap:
+            auS['_normLast']=authorVectorMap[auO.id]['lastname']
+            auS['_normFull']=authorVectorMap[auO.id]['lastfirst']
+        return auS
     def _boObjCopy(boO):
-        return {
+        boS={
             'title': boO.title,
         }
-    authorsFromDB=[_auObjCopy(au) for au in list(dbGetAll('author'))]
-    booksFromDB=[_boObjCopy(bo) for bo in list(dbGetAll('book'))]
-    # cache the input stream
-    inputContents='\n'.join(inFileHandle)
-    # prepare author list with annotations
-    auList=extract_author_list(inputContents,authorsFromDB)
-    # prepare book list with annotations
-    boList=check_books_list(inputContents,booksFromDB,authorsFromDB,auList)
-    # merge the two
-    fullList=auList
-    fullList.update(boList)
-    # return the full structure
-    return fullList
-
-def check_books_list(inputContents,dbBooks,dbAuthors,newAuthors):
-    '''
-        This reads book-objects from inputContents
-        and makes them into a validated book list.
-        Warnings added here involve similarity checks:
-            * book with similar/equal title are marked with warnings
-            * authors for each book, if the author is new and
-              has similar authors in turn, are equipped
-              with a warning as well.
-    '''
-    def _copyBo(bo):
-        boS = {    
-            'title': bo['title'],
-        }
-        if '_linenumber' in bo:
-            boS['_linenumber'] = bo['_linenumber']
+        if boO.id in bookVectorMap:
+            boS['_normTitle']=bookVectorMap[boO.id]['title']
         return boS
-    def _copyFullBo(bo):
-        boS = _copyBo(bo)
-        if '_normTitle' in bo:
-            boS['_normTitle'] = bo['_normTitle']
-        return boS
-    # prepare a helper authorname-to-similarAuthors dict for later lookup
-    similarAuthorMap={}
-    for au in newAuthors['authors']:
-        auKey=(au['lastname'],au['firstname'])
-        similarAuthorMap[auKey]=[
-            '%s, %s (%s)' % (sAu['lastname'],sAu['firstname'],sAu['_origin'])
-            for sAu in au.get('_warnings',{}).get('similarity',[])
-        ]
-    # parse the pre-existing books into a standard structure
-    preexistingBookList=[
-        _copyFullBo(bo)
-        for bo in dbBooks
-    ]
-    for bo in preexistingBookList:
-        bo.update(makeBookIntoVector(bo['title']))
-    #
+    authorsFromDB=[_auObjCopy(au) for au in dbGetAll('author')]
+    booksFromDB=[_boObjCopy(bo) for bo in dbGetAll('book')]
+    return authorsFromDB,booksFromDB
+
+def process_book_list(inFileHandle):
+    '''
+        main driver of the booklist-to-structuredlists conversion.
+
+        Handles the author extraction from books,
+        the validation of authors with warnings,
+        the generation of the annotated book list
+        (see BookListProcessor)
+    '''
+    inputContents='\n'.join(inFileHandle)
+    return process_books(json.loads(inputContents)['books'])
+
+def process_books(books):
+    '''
+        Same as process_book_list, given the list of books
+    '''
+    processor=BookListProcessor(*_dbSimilarityLists())
     bookList=[]
-    sourceList=json.loads(inputContents)
-    for bStr in sourceList['books']:
-        bStr.update(makeBookIntoVector(bStr['title']))
-        scalsT=[]
-
-        # similarity checks:
-        for origin,srcList in zip(['present','new'],[preexistingBookList,bookList]):
-            for pBo in srcList:
-                scalsT.append((
-                    scalProd(pBo['_normTitle'],bStr['_normTitle']),
-                    _copyBo(pBo),
-                    origin,
-                ))
-        simScalsT=list(filter(
-            lambda t: t[0]>=SIMILAR_BOOK_THRESHOLD,
-            sorted(
-                scalsT,
-                key=itemgetter(0),
-                reverse=True
-            )
-        ))
-        if len(simScalsT) > 0:
-            finalSimWarnings=[]
-            finalCopyWarnings=[]
-            for normVal,wBo,origin in simScalsT:
-                if normVal<1.0:
-                    # just similar
-                    boToInsert=_copyBo(wBo)
-                    boToInsert['_similarity']=normVal
-                    boToInsert['_origin']=origin
-                    finalSimWarnings.append(boToInsert)
-                else:
-                    # identical
-                    boToInsert=_copyBo(wBo)
-                    boToInsert['_origin']=origin
-                    finalCopyWarnings.append(boToInsert)
-            for wbo in finalSimWarnings:
-                addWarningToStruct(bStr,'similarity',wbo)
-            for wbo in finalCopyWarnings:
-                addWarningToStruct(bStr,'possible_duplicate',wbo)
-        # add warnings *within* the author list of the book, if necessary
-        for bAu in bStr['authors']:
-            if len(similarAuthorMap.get((bAu['lastname'],bAu['firstname']),[]))>0:
-                bAu['_warnings']={
-                    '_similarAuthors': similarAuthorMap[(bAu['lastname'],bAu['firstname'])]
-                }
-        bookList.append(bStr)
-    # cleanups
-    for bo in bookList:
-        if '_normTitle' in bo:
-            del bo['_normTitle']
-    return {'books' : bookList}
+    for bookChunk in chunked(books):
+        bookList+=processor.processChunk(bookChunk)
+    return {
+        'authors': processor.authorList,
+        'books': bookList,
+    }
 
-def read_and_parse_csv(inFileHandle,skipHeader=False):
+def process_book_stream(books,outFileHandle,progress=None):
+    '''
+        Streaming version of process_books: books is any iterable,
+        the output is written as NDJSON to a binary file (all authors
+        first, the books being spooled meanwhile to a temporary file).
+        If given, progress(done,None) is called after each chunk.
+        Returns the warning report, i.e. the titles of the books
+        and the names of the authors having warnings.
+    '''
+    processor=BookListProcessor(*_dbSimilarityLists())
+    warningReport={'books': [], 'authors': []}
+    def _annotatedBooks():
+        nDone=0
+        for bookChunk in chunked(books):
+            for bStr in processor.processChunk(bookChunk):
+                if '_warnings' in bStr:
+                    warningReport['books'].append(bStr['title'])
+                yield bStr
+            nDone+=len(bookChunk)
+            if progress is not None:
+                progress(nDone,None)
+    with tempfile.TemporaryFile() as bookSpool:
+        writeChunks(bookSpool,iterNdjsonExport([('book',_annotatedBooks())]))
+        writeChunks(outFileHandle,iterNdjsonExport([('author',processor.authorList)]))
+        bookSpool.seek(0)
+        shutil.copyfileobj(bookSpool,outFileHandle)
+    warningReport['authors']=[
+        '%s, %s' % (au['lastname'],au['firstname'])
+        for au in processor.authorList
+        if '_warnings' in au
+    ]
+    return warningReport
+
+class BookListProcessor():
     '''
-        main driver of the csv-to-json conversion.
+        Second import step, done a chunk of books at a time.
 
-        Handles the top-level operations and returns a dict {'books': [list of book object]}
+        Authors are extracted from the books, with warnings for those
+        suspiciously similar (but not identical) to already-found
+        or pre-existing authors and for abbreviated first names.
+        Books get warnings for titles similar/equal to pre-existing
+        or previous new books, and so do (within the book) their
+        new authors having similar authors in turn.
 
+        Kept in memory are the pre-existing books/authors
+        ('dbBooks', 'dbAuthors' as given by _dbSimilarityLists),
+        the vectors of the books seen so far and the new authors.
     '''
-    # 1. make valid lines into base structures
-    _parsedLines=list(
-        map(
-            parseBookLine,
-            [
-                li for li in enumerate(csv.reader(inFileHandle))
-            ][(1 if skipHeader else 0):]
+    def __init__(self, dbAuthors, dbBooks):
+        # parse the pre-existing authors/books into a standard structure
+        self.preexistingAuthors=[_copyFullAu(au) for au in dbAuthors]
+        for au in self.preexistingAuthors:
+            if '_normLast' not in au:
+                au.update(makeAuthorIntoVector(au['lastname'],au['firstname']))
+        self.preexistingAuthorKeys={
+            (au['firstname'].lower(),au['lastname'].lower())
+            for au in self.preexistingAuthors
+        }
+        self.preexistingBooks=[_copyFullBo(bo) for bo in dbBooks]
+        for bo in self.preexistingBooks:
+            if '_normTitle' not in bo:
+                bo.update(makeBookIntoVector(bo['title']))
+        self.preexistingBookVectors=[bo['_normTitle'] for bo in self.preexistingBooks]
+        # new authors, their vectors and a map from the lowercase name
+        self.authorList=[]
+        self.authorVectors=[]
+        self.authorIndex={}
+        # new author name -> its similar authors, for the book warnings
+        self.similarAuthorMap={}
+        # new books so far and their title vectors
+        self.bookList=[]
+        self.bookVectors=[]
+
+    def processChunk(self, books):
+        '''
+            Processes a list of books, adding the new authors to
+            authorList. Returns the books, annotated in place.
+        '''
+        self._extractAuthors(books)
+        return self._checkBooks(books)
+
+    def _findAuthor(self, au, linenumber):
+        '''
+            As insert_author_to_list on the new and pre-existing authors
+        '''
+        auKey=(au['firstname'].lower(),au['lastname'].lower())
+        pAu=self.authorIndex.get(auKey)
+        if pAu is not None:
+            if linenumber:
+                pAu['_books'].append(linenumber)
+            return True
+        return auKey in self.preexistingAuthorKeys
+
+    def _extractAuthors(self, books):
+        # the authors of the books are left untouched
+        occurrences=[
+            (dict(au),bStr)
+            for bStr in books
+            for au in bStr['authors']
+        ]
+        # all similarities above threshold, computed in batch
+        occurrenceVectors=[
+            makeAuthorIntoVector(au['lastname'],au['firstname'])
+            for au,_ in occurrences
+        ]
+        similarPresent=_authorSimilarPairs(
+            occurrenceVectors,
+            self.preexistingAuthors,
+            SIMILAR_AUTHOR_THRESHOLD,
         )
-    )
-    parsedLines=[pl for pl in _parsedLines if pl is not None]
-    # 1b. must check for non-ascii chars here already and if necessary treat the various warnings
+        similarPrevious=_authorSimilarPairs(
+            occurrenceVectors,
+            self.authorVectors,
+            SIMILAR_AUTHOR_THRESHOLD,
+        )
+        similarNew=_authorSimilarPairs(
+            occurrenceVectors,
+            occurrenceVectors,
+            SIMILAR_AUTHOR_THRESHOLD,
+            onlyPrevious=True,
+        )
+        # (authorList index, occurrence) of the authors found in this chunk
+        chunkOccurrences=[]
+        for occurrence,(au,bStr) in enumerate(occurrences):
+            au['notes']=au.get('notes','')
+            # handle insertion of author 'au' to the full list
+            if not self._findAuthor(au,bStr.get('_linenumber')):
+                if '_linenumber' in bStr:
+                    au['_books']=[bStr['_linenumber']]
+                # check if the new author is too similar to any existing one
+                scalsA=[]
+                for origin,aulist,auPairs in zip(
+                            ['new','present'],
+                            [self.authorList,self.preexistingAuthors],
+                            [
+                                sorted(similarPrevious[occurrence].items())+[
+                                    (aIndex,similarNew[occurrence][aOccurrence])
+                                    for aIndex,aOccurrence in chunkOccurrences
+                                    if aOccurrence in similarNew[occurrence]
+                                ],
+                                sorted(similarPresent[occurrence].items()),
+                            ],
+                        ):
+                    for pIndex,pProd in auPairs:
+                        scalsA.append((
+                            pProd,
+                            _copyAu(aulist[pIndex]),
+                            origin,
+                        ))
+                simScalsA=list(filter(lambda t: t[0]>=SIMILAR_AUTHOR_THRESHOLD,sorted(scalsA,key=itemgetter(0),reverse=True)))
+                if len(simScalsA) > 0:
+                    finalWarnings=[]
+                    for normVal,wAu,wOrigin in simScalsA:
+                        if not insert_author_to_list(wAu,finalWarnings,[]):
+                            auToInsert=_copyAu(wAu)
+                            auToInsert['_similarity']=normVal
+                            auToInsert['_origin']=wOrigin
+                            finalWarnings.append(auToInsert)
+                    for wau in finalWarnings:
+                        addWarningToStruct(au,'similarity',wau)
+                # check if the first name is only punctuated abbreviations
+                if isOnlyAbbreviations(au['firstname']):
+                    addWarningToStruct(au,'abbreviations',au['firstname'])
+                    au['notes']='First name abbreviated'
+                #
+                self.similarAuthorMap[(au['lastname'],au['firstname'])]=[
+                    '%s, %s (%s)' % (sAu['lastname'],sAu['firstname'],sAu['_origin'])
+                    for sAu in au.get('_warnings',{}).get('similarity',[])
+                ]
+                chunkOccurrences.append((len(self.authorList),occurrence))
+                self.authorIndex[(au['firstname'].lower(),au['lastname'].lower())]=au
+                self.authorList.append(au)
+                self.authorVectors.append(occurrenceVectors[occurrence])
+
+    def _checkBooks(self, books):
+        # all similarities above threshold, computed in batch
+        titleVectors=[makeBookIntoVector(bStr['title'])['_normTitle'] for bStr in books]
+        similarPresent=similarPairs(titleVectors,self.preexistingBookVectors,SIMILAR_BOOK_THRESHOLD)
+        similarPrevious=similarPairs(titleVectors,self.bookVectors,SIMILAR_BOOK_THRESHOLD)
+        similarNew=similarPairs(titleVectors,titleVectors,SIMILAR_BOOK_THRESHOLD,onlyPrevious=True)
+        nPrevious=len(self.bookList)
+        for bIndex,bStr in enumerate(books):
+            scalsT=[]
+            # similarity checks (the new books before this one are in bookList):
+            for origin,srcList,srcPairs in zip(
+                        ['present','new'],
+                        [self.preexistingBooks,self.bookList],
+                        [
+                            similarPresent[bIndex],
+                            similarPrevious[bIndex]+[
+                                (nPrevious+pIndex,pProd)
+                                for pIndex,pProd in similarNew[bIndex]
+                            ],
+                        ],
+                    ):
+                for pIndex,pProd in srcPairs:
+                    scalsT.append((
+                        pProd,
+                        srcList[pIndex],
+                        origin,
+                    ))
+            simScalsT=list(filter(
+                lambda t: t[0]>=SIMILAR_BOOK_THRESHOLD,
+                sorted(
+                    scalsT,
+                    key=itemgetter(0),
+                    reverse=True
+                )
+            ))
+            if len(simScalsT) > 0:
+                finalSimWarnings=[]
+                finalCopyWarnings=[]
+                for normVal,wBo,origin in simScalsT:
+                    if normVal<1.0:
+                        # just similar
+                        boToInsert=_copyBo(wBo)
+                        boToInsert['_similarity']=normVal
+                        boToInsert['_origin']=origin
+                        finalSimWarnings.append(boToInsert)
+                    else:
+                        # identical
+                        boToInsert=_copyBo(wBo)
+                        boToInsert['_origin']=origin
+                        finalCopyWarnings.append(boToInsert)
+                for wbo in finalSimWarnings:
+                    addWarningToStruct(bStr,'similarity',wbo)
+                for wbo in finalCopyWarnings:
+                    addWarningToStruct(bStr,'possible_duplicate',wbo)
+            # add warnings *within* the author list of the book, if necessary
+            for bAu in bStr['authors']:
+                if len(self.similarAuthorMap.get((bAu['lastname'],bAu['firstname']),[]))>0:
+                    bAu['_warnings']={
+                        '_similarAuthors': self.similarAuthorMap[(bAu['lastname'],bAu['firstname'])]
+                    }
+            self.bookList.append(_copyBo(bStr))
+            self.bookVectors.append(titleVectors[bIndex])
+        return books
+
+def _copyAu(au):
+    return {
+        'firstname': au['firstname'],
+        'lastname': au['lastname'],
+        'notes': au['notes'],
+    }
+
+def _copyFullAu(au):
+    auS = _copyAu(au)
+    for vKey in ['_normLast','_normFull']:
+        if vKey in au:
+            auS[vKey] = au[vKey]
+    return auS
+
+def _copyBo(bo):
+    boS = {
+        'title': bo['title'],
+    }
+    if '_linenumber' in bo:
+        boS['_linenumber'] = bo['_linenumber']
+    return boS
+
+def _copyFullBo(bo):
+    boS = _copyBo(bo)
+    if '_normTitle' in bo:
+        boS['_normTitle'] = bo['_normTitle']
+    return boS
+
+def iter_csv_books(inFileHandle,skipHeader=False):
+    '''
+        Generates the book structures of the csv-to-json conversion,
+        parsing and normalizing a line at a time.
+
+        Input with untreated special characters is refused: as this
+        is known only at the end, the ValueError comes after the last
+        book (no book is generated once one is found).
+    '''
     passingCharacters=set(list(validCharacters)) | set(translatedCharacters.keys())
-    untreatedCharSet=list(filter(lambda c: c not in passingCharacters, collectCharacters(parsedLines)))
+    untreatedCharSet=set()
+    for lineIndex,csvLine in enumerate(csv.reader(inFileHandle)):
+        if skipHeader and lineIndex==0:
+            continue
+        parsedLine=parseBookLine((lineIndex,csvLine))
+        if parsedLine is not None:
+            untreatedCharSet|={
+                char
+                for v in parsedLine.values()
+                for char in v
+                if char not in passingCharacters
+            }
+            if len(untreatedCharSet)==0:
+                yield normalizeParsedBookLine(parsedLine)
     if len(untreatedCharSet)>0:
         raise ValueError('Some untreated special chars to check: "%s"' % ''.join(sorted(list(untreatedCharSet))))
-    # 2. apply a normalisation function to each line
-    importDate=datetime.now().strftime(DATETIME_STR_FORMAT)
-    normalizer=lambda pL,listSoFar: normalizeParsedBookLine(pL,listSoFar)
-    # the book list is built incrementally so that similarities are detectable
-    bookList=[]
-    for pLi in parsedLines:
-        bookList.append(normalizer(pLi,bookList))
-    # clean out similarity-vector fields
-    for qBo in bookList:
-        if '_normTitle' in qBo:
-            del qBo['_normTitle']
-
-    # 3. encapsulate the result and return it
+
+def read_and_parse_csv(inFileHandle,skipHeader=False):
+    '''
+        main driver of the csv-to-json conversion.
+
+        Handles the top-level operations and returns a dict {'books': [list of book object]}
+
+    '''
     return {
-        'books': bookList,
+        'books': list(iter_csv_books(inFileHandle,skipHeader=skipHeader)),
     }
 
+def csv_to_ndjson(inFileHandle,outFileHandle,skipHeader=False,progress=None):
+    '''
+        Streaming version of read_and_parse_csv, writing the books
+        as NDJSON to a binary file (to be discarded if a ValueError is raised).
+        If given, progress(done,None) is called after each book.
+        Returns the number of books with warnings.
+    '''
+    counters={'books': 0, 'warnings': 0}
+    def _books():
+        for bStr in iter_csv_books(inFileHandle,skipHeader=skipHeader):
+            counters['books']+=1
+            if '_warnings' in bStr:
+                counters['warnings']+=1
+            yield bStr
+            if progress is not None:
+                progress(counters['books'],None)
+    writeChunks(outFileHandle,iterNdjsonExport([('book',_books())]))
+    return counters['warnings']
+
 def parseBookLine(csvLine):
     '''
         csvLine[0] is the line number, csvLine[1] the actual list of entries
@@ -283,6 +630,15 @@ def addNoteToReport(reportDict,key,msg):
         reportDict[key]=[]
     reportDict[key].append(msg)
 
+def mergeReports(reportDict,otherReport):
+    '''
+        adds the notes of a success/errors report to another
+    '''
+    for section,sectionNotes in otherReport.items():
+        for key,msgs in sectionNotes.items():
+            for msg in msgs:
+                addNoteToReport(reportDict[section],key,msg)
+
 def parseAuthor(auString,comma=True):
     '''
         Author strings are usually in the form 'Lastname, first_name_and_other'.
@@ -329,12 +685,10 @@ def guessKVFromDict(kvDict):
 guessLanguage=guessKVFromDict(languagesDict)
 guessBooktype=guessKVFromDict(booktypesDict)
 
-def normalizeParsedBookLine(pLine,bListSoFar):
+def normalizeParsedBookLine(pLine):
     '''
         converts a base structure into a proper structure, modulo references among tables.
         Returns a structure encoding errors/warnings as well as the result.
-
-        Requires the already-done-lines list to check for similarities
     '''
     bookStructure={
         'title':         None,
@@ -418,17 +772,6 @@ def normalizeParsedBookLine(pLine,bListSoFar):
     # done.
     return bookStructure
 
-def collectCharacters(pLines):
-    '''
-        scans the standard fields of parsed-line list and collects
-        all characters appearing at least once in some text field,
-        this is for the purpose of cleaning input strings
-    '''
-    return set([char
-                    for pLine in pLines
-                    for v in pLine.values()
-                    for char in list(v) if isinstance(v,str) or isinstance(v,unicode)])
-
 def isOnlyAbbreviations(aName):
     '''
         Raises an error if names with only abbreviations are found.
@@ -477,91 +820,50 @@ def insert_author_to_list(newA,aList,preexistingList,linenumber=None):
             return True
     return False
 
-def extract_author_list(inputContents, preexistingAuthors):
+def _authorSimilarPairs(queryVectors,targetVectors,threshold,onlyPrevious=False):
     '''
-        this opens a json with the book list and extracts all authors found there.
-        It raises warnings for no-lastname authors and for authors suspiciously similar (but not identical)
-        to already-inserted authors.
-
-        'preexistingAuthors' is a list of Author objects retrieved from DB: they are also to be checked
-        (both for duplicates and similarity checks)
-
+        Given two lists of author vector pairs (as in makeAuthorIntoVector),
+        returns for each query a map targetIndex -> similarity, i.e. the
+        max of the two scalar products, for the targets at/above threshold
     '''
-    def _copyAu(au):
-        return {    
-            'firstname': au['firstname'],
-            'lastname': au['lastname'],
-            'notes': au['notes'],
-        }
-    # parse the pre-existing authors into a standard structure
-    preexistingList=[
-        _copyAu(au)
-        for au in preexistingAuthors
-    ]
-    for au in preexistingList:
-        au.update(makeAuthorIntoVector(au['lastname'],au['firstname']))
-    #
-    authorList=[]
-    bookList=json.loads(inputContents)
-    for bStr in bookList['books']:
-        for au in bStr['authors']:
-            au['notes']=au.get('notes','')
-            # handle insertion of author 'au' to the full list
-            # found=False
-            found=insert_author_to_list(au,authorList,preexistingList,bStr.get('_linenumber'))
-            if not found:
-                au.update(makeAuthorIntoVector(au['lastname'],au['firstname']))
-                if '_linenumber' in bStr:
-                    au['_books']=[bStr['_linenumber']]
-                # check if the new author is too similar to any existing one
-                scalsA=[]
-                for origin,aulist in zip(['new','present'],[authorList,preexistingList]):
-                    for pAu in aulist:
-                        scalsA.append((
-                            max(
-                                scalProd(pAu['_normLast'],au['_normLast']),
-                                scalProd(pAu['_normFull'],au['_normFull']),
-                            ),
-                            _copyAu(pAu),
-                            origin,
-                        ))
-                simScalsA=list(filter(lambda t: t[0]>=SIMILAR_AUTHOR_THRESHOLD,sorted(scalsA,key=itemgetter(0),reverse=True)))
-                if len(simScalsA) > 0:
-                    finalWarnings=[]
-                    for normVal,wAu,wOrigin in simScalsA:
-                        if not insert_author_to_list(wAu,finalWarnings,[]):
-                            auToInsert=_copyAu(wAu)
-                            auToInsert['_similarity']=normVal
-                            auToInsert['_origin']=wOrigin
-                            finalWarnings.append(auToInsert)
-                    for wau in finalWarnings:
-                        addWarningToStruct(au,'similarity',wau)
-                # check if the first name is only punctuated abbreviations
-                if isOnlyAbbreviations(au['firstname']):
-                    addWarningToStruct(au,'abbreviations',au['firstname'])
-                    au['notes']='First name abbreviated'
-                #
-                authorList.append(au)
-    # remove the norm information
-    for au in authorList:
-        del au['_normLast']
-        del au['_normFull']
+    pairMaps=[{} for _ in queryVectors]
+    for vKey in ['_normLast','_normFull']:
+        vPairs=similarPairs(
+            [qVecs[vKey] for qVecs in queryVectors],
+            [tVecs[vKey] for tVecs in targetVectors],
+            threshold,
+            onlyPrevious,
+        )
+        for pairMap,qPairs in zip(pairMaps,vPairs):
+            for tIndex,_ in qPairs:
+                pairMap[tIndex]=None
+    for qVecs,pairMap in zip(queryVectors,pairMaps):
+        for tIndex in pairMap.keys():
+            tVecs=targetVectors[tIndex]
+            pairMap[tIndex]=max(
+                scalProd(tVecs['_normLast'],qVecs['_normLast']),
+                scalProd(tVecs['_normFull'],qVecs['_normFull']),
+            )
+    return pairMaps
 
-    return {
-        'authors': authorList,
-    }
 
-def insert_authors_from_structure(auList,db):
+def insert_authors_from_structure(auList,db,onItem=None):
     '''
         Reads an author list off a json file
         and inserts all authors to DB.
-        Returns a dictionary from the 2-uple (lastname,firstname) to the database ID
+        Returns a dictionary from the 2-uple (lastname,firstname) to the database ID.
+        onItem, if given, is called after each author.
     '''
     report={'success': {}, 'errors': {}, 'authoridmap': {}}
-    for nAu in auList:
-        # insert new author
-        newAuthor=Author(id=None,firstname=nAu['firstname'],lastname=nAu['lastname'],notes=nAu.get('notes',''))
-        status,nObj=dbAddReplaceAuthor(newAuthor,db=db)
+    # all authors are inserted at once
+    insertionResults=dbBulkAddAuthors(
+        [
+            Author(id=None,firstname=nAu['firstname'],lastname=nAu['lastname'],notes=nAu.get('notes',''))
+            for nAu in auList
+        ],
+        db=db,
+    )
+    for nAu,(status,nObj) in zip(auList,insertionResults):
         # register the map
         if status:
                 addNoteToReport(
@@ -577,15 +879,19 @@ def insert_authors_from_structure(auList,db):
                     '%s, %s' % (nAu['lastname'],nAu['firstname']),
                     'could not insert (%s).' % nObj,
                 )
+        if onItem is not None:
+            onItem()
     return report
 
-def insert_books_from_structure(boList,authorMap,importingUser,db,editdate):
+def insert_books_from_structure(boList,authorMap,importingUser,db,editdate,onItem=None):
     '''
         Given a map (lastname,firstname)->authorId, book insertions are done.
         Returned is a list of IDs in the insertion order.
+        onItem, if given, is called after each book.
     '''
     fieldsToKill=['_linenumber','_warnings']
     report={'success': {}, 'errors': {}}
+    newBookObjects=[]
     for nBo in boList:
         # resolve references, adjust fields
         nBo['lasteditor']=importingUser.id
@@ -616,14 +922,18 @@ def insert_books_from_structure(boList,authorMap,importingUser,db,editdate):
         nBo['booktype']=reverseBooktypesDict.get(nBo['booktype'])
         if nBo['booktype'] is None:
             nBo['booktype']=booktypesDict.keys()[0]
+        # the structure has a (json) boolean, the table an int
+        nBo['inhouse']=int(bool(nBo['inhouse']))
         for fld in fieldsToKill:
             if fld in nBo:
                 del nBo[fld]
         #
         newBookObject=Book(**nBo)
         newBookObject.id=None
-        #
-        status,nBookReturned=dbAddReplaceBook(newBookObject,db=db)
+        newBookObjects.append(newBookObject)
+    # all books are inserted at once
+    insertionResults=dbBulkAddBooks(newBookObjects,db=db)
+    for nBo,(status,nBookReturned) in zip(boList,insertionResults):
         if status:
             addNoteToReport(
                 report['success'],
@@ -636,4 +946,6 @@ def insert_books_from_structure(boList,authorMap,importingUser,db,editdate):
                 nBo['title'],
                 'error upon insertion (%s).' % nBookReturned,
             )
+        if onItem is not None:
+            onItem()
     return report
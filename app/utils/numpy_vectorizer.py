@@ -0,0 +1,54 @@
+'''
+    numpy_vectorizer.py : numpy backend for the batch similarity
+    computations of string_vectorizer.
+
+    Vectors are mapped to the rows of dense float32 matrices,
+    each letter/digram having a fixed column: all scalar products
+    between a batch of queries and the targets are obtained with a single
+    matrix multiplication. The float32 products are only used to select
+    the candidate pairs: the returned products are recomputed
+    with scalProd, so that results match the reference implementation.
+'''
+
+import numpy as np
+
+from app.utils.string_vectorizer import vectorBase, scalProd
+
+baseColumns={base: column for column,base in enumerate(vectorBase)}
+
+# float32 rounding on unit vectors is way below this
+CANDIDATE_TOLERANCE=1.0e-4
+# queries per matrix multiplication, to bound the memory used
+QUERY_BATCH_SIZE=1000
+
+def vectorsToMatrix(vectors):
+    '''
+        Makes a list of vectors (dicts) into a float32 matrix, one row per vector
+    '''
+    matrix=np.zeros((len(vectors),len(vectorBase)),dtype=np.float32)
+    for row,vector in enumerate(vectors):
+        for base,value in vector.items():
+            matrix[row,baseColumns[base]]=value
+    return matrix
+
+def numpySimilarPairs(queryVectors,targetVectors,threshold,onlyPrevious=False):
+    '''
+        Same as string_vectorizer.dictSimilarPairs
+    '''
+    pairs=[[] for _ in queryVectors]
+    if len(queryVectors)==0 or len(targetVectors)==0:
+        return pairs
+    targetMatrix=vectorsToMatrix(targetVectors).T
+    for batchStart in range(0,len(queryVectors),QUERY_BATCH_SIZE):
+        queryBatch=queryVectors[batchStart:batchStart+QUERY_BATCH_SIZE]
+        products=vectorsToMatrix(queryBatch).dot(targetMatrix)
+        # nonzero returns the indices in row-major order
+        for qIndex,tIndex in zip(*np.nonzero(products>=threshold-CANDIDATE_TOLERANCE)):
+            qIndex=int(qIndex)+batchStart
+            tIndex=int(tIndex)
+            if onlyPrevious and tIndex>=qIndex:
+                continue
+            tProd=scalProd(targetVectors[tIndex],queryVectors[qIndex])
+            if tProd>=threshold:
+                pairs[qIndex].append((tIndex,tProd))
+    return pairs
@@ -0,0 +1,82 @@
+'''
+    parallel_vectorizer.py : process-pool mode of the batch similarity
+    computations of string_vectorizer.
+
+    The queries are split in shards, each compared to the targets
+    by a worker process with the backend in use. The vectors are left
+    in a module-level dict before the worker processes are forked:
+    they read them (copy-on-write) and only the shard bounds and
+    the resulting pairs cross the process boundaries.
+    With onlyPrevious, a shard is compared to the targets before it
+    and, within itself, to the previous queries. Shards are merged
+    in query order, so that results are exactly the serial ones.
+
+    Where processes cannot be forked, everything is done in-process.
+'''
+
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from app.utils.string_vectorizer import serialSimilarPairs
+
+# shards per process: shards differ in duration (with onlyPrevious
+# the later ones have more targets), more of them even out the load
+SHARDS_PER_PROCESS=4
+
+# the vectors of the computation in progress, read by the workers
+_sharedVectors={}
+# one computation at a time can use _sharedVectors
+_sharedLock=threading.Lock()
+
+def _shardPairs(start,end):
+    queryVectors=_sharedVectors['queryVectors'][start:end]
+    targetVectors=_sharedVectors['targetVectors']
+    threshold=_sharedVectors['threshold']
+    if _sharedVectors['onlyPrevious']:
+        beforePairs=serialSimilarPairs(queryVectors,targetVectors[:start],threshold)
+        withinPairs=serialSimilarPairs(queryVectors,targetVectors[start:end],threshold,onlyPrevious=True)
+        return [
+            qBeforePairs+[(start+tIndex,tProd) for tIndex,tProd in qWithinPairs]
+            for qBeforePairs,qWithinPairs in zip(beforePairs,withinPairs)
+        ]
+    else:
+        return serialSimilarPairs(queryVectors,targetVectors,threshold)
+
+def parallelSimilarPairs(queryVectors,targetVectors,threshold,onlyPrevious,numProcesses):
+    '''
+        Same as string_vectorizer.dictSimilarPairs,
+        split among numProcesses worker processes
+    '''
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        return serialSimilarPairs(queryVectors,targetVectors,threshold,onlyPrevious)
+    numShards=min(numProcesses*SHARDS_PER_PROCESS,len(queryVectors))
+    shardBounds=[
+        (len(queryVectors)*shard//numShards,len(queryVectors)*(shard+1)//numShards)
+        for shard in range(numShards)
+    ]
+    with _sharedLock:
+        _sharedVectors.update(
+            queryVectors=queryVectors,
+            targetVectors=targetVectors,
+            threshold=threshold,
+            onlyPrevious=onlyPrevious,
+        )
+        try:
+            # workers are forked at the first submit, with _sharedVectors set
+            with ProcessPoolExecutor(
+                max_workers=numProcesses,
+                mp_context=multiprocessing.get_context('fork'),
+            ) as executor:
+                # the (longer) last shards are started first
+                futures={
+                    shard: executor.submit(_shardPairs,*shardBounds[shard])
+                    for shard in reversed(range(numShards))
+                }
+                return [
+                    qPairs
+                    for shard in range(numShards)
+                    for qPairs in futures[shard].result()
+                ]
+        finally:
+            _sharedVectors.clear()
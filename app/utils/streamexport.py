@@ -0,0 +1,130 @@
+'''
+    streamexport.py : incremental serialization of the exported data,
+    to be sent as a streamed response without building it all in memory.
+
+    Formats: the pretty-printed JSON document, NDJSON (one JSON object
+    per line, with its kind in the '_type' field) and a compact CSV
+    of the books.
+'''
+
+import csv
+import io
+import json
+from itertools import chain
+import zlib
+
+# approximate size of the chunks handed to the response
+CHUNK_SIZE=64*1024
+
+def _bufferChunks(pieces,chunkSize=CHUNK_SIZE):
+    '''
+        Regroups an iterable of (small) strings into
+        utf-8 encoded chunks of about chunkSize bytes
+    '''
+    buffer=[]
+    bufferSize=0
+    for piece in pieces:
+        buffer.append(piece)
+        bufferSize+=len(piece)
+        if bufferSize>=chunkSize:
+            yield ''.join(buffer).encode('utf-8')
+            buffer=[]
+            bufferSize=0
+    if buffer:
+        yield ''.join(buffer).encode('utf-8')
+
+def _jsonPieces(sections):
+    '''
+        The pieces of json.dumps(dict(sections),indent=4,sort_keys=True),
+        sections being (key, iterable of items) pairs:
+        each item is serialized only when it is reached.
+    '''
+    yield '{'
+    for sectionIndex,(key,items) in enumerate(sorted(sections,key=lambda section: section[0])):
+        yield '%s\n    %s: [' % (',' if sectionIndex>0 else '',json.dumps(key))
+        isEmpty=True
+        for item in items:
+            yield '%s\n        %s' % (
+                '' if isEmpty else ',',
+                json.dumps(item,indent=4,sort_keys=True).replace('\n','\n        '),
+            )
+            isEmpty=False
+        yield ']' if isEmpty else '\n    ]'
+    yield '\n}' if sections else '}'
+
+def iterJsonExport(sections):
+    '''
+        Generates, as utf-8 encoded chunks, the same bytes as
+        json.dumps(dict(sections),indent=4,sort_keys=True)
+        for a list of (key, iterable of items) pairs
+    '''
+    return _bufferChunks(_jsonPieces(sections))
+
+def iterNdjsonExport(sections):
+    '''
+        Generates, as utf-8 encoded chunks, the NDJSON lines
+        of a list of (kind, iterable of items) pairs, in the given order.
+        Each line is an item with the additional field '_type'=kind.
+    '''
+    return _bufferChunks(
+        '%s\n' % json.dumps(
+            dict(item,_type=kind),
+            sort_keys=True,
+            separators=(',',':'),
+            ensure_ascii=False,
+        )
+        for kind,items in sections
+        for item in items
+    )
+
+# columns of the books csv, for the short and the long export form
+bookCsvColumns={
+    'short': ['title','authors','booktype','languages','notes'],
+    'long': [
+        'title','authors','booktype','languages','notes',
+        'inhouse','inhousenotes','house','lasteditor','lasteditdate',
+    ],
+}
+
+def bookCsvRecord(bookDict,columns):
+    '''
+        Flattens an exported book (see Book.exportableDict)
+        into the list of csv values for the given columns:
+        authors become 'lastname, firstname' joined by '; ',
+        languages are joined by '; ' as well
+    '''
+    flatDict=dict(bookDict)
+    flatDict['authors']='; '.join(
+        '%s, %s' % (au['lastname'],au['firstname']) if au['firstname'] else au['lastname']
+        for au in bookDict['authors']
+    )
+    flatDict['languages']='; '.join(bookDict['languages'])
+    return [flatDict[column] for column in columns]
+
+def _csvPieces(columns,records):
+    lineBuffer=io.StringIO()
+    csvWriter=csv.writer(lineBuffer)
+    for record in chain([columns],records):
+        csvWriter.writerow(record)
+        yield lineBuffer.getvalue()
+        lineBuffer.seek(0)
+        lineBuffer.truncate()
+
+def iterCsvExport(columns,records):
+    '''
+        Generates, as utf-8 encoded chunks, a csv with a header
+        line (the column names) and a line per record (list of values)
+    '''
+    return _bufferChunks(_csvPieces(columns,records))
+
+def gzipChunks(chunks):
+    '''
+        Compresses on the fly an iterable of byte chunks
+        into the chunks of a gzip file
+    '''
+    compressor=zlib.compressobj(9,zlib.DEFLATED,zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        compressed=compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
@@ -2,7 +2,12 @@
 
 from collections import Counter
 
-from config import SIMILAR_USE_DIGRAMS
+from config import (
+                        SIMILAR_USE_DIGRAMS,
+                        SIMILARITY_BACKEND,
+                        SIMILARITY_PROCESSES,
+                        SIMILARITY_PARALLEL_MIN_PRODUCTS,
+                    )
 
 vectorCharacters=list(map(chr,range(ord('A'),ord('Z')+1)))
 
@@ -10,9 +15,11 @@ vectorCharacters=list(map(chr,range(ord('A'),ord('Z')+1)))
 if SIMILAR_USE_DIGRAMS:
     baseExtractor=lambda cleanString: map(lambda p: ''.join(p),(lambda l: zip(l[:-1],l[1:]))(cleanString))
     # a function string -> list of digrams
+    vectorBase=[c1+c2 for c1 in vectorCharacters for c2 in vectorCharacters]
 else:
     baseExtractor=lambda cleanString: cleanString
     # a function string -> list of letters
+    vectorBase=vectorCharacters
 
 def makeIntoVector(qString):
     '''
@@ -31,3 +38,57 @@ def scalProd(di1,di2):
         scalar product of two vectors
     '''
     return sum([v*di2[k] for k,v in di1.items() if k in di2])
+
+def dictSimilarPairs(queryVectors,targetVectors,threshold,onlyPrevious=False):
+    '''
+        For each query vector, returns the list of (targetIndex,product)
+        for the target vectors with scalProd(target,query)>=threshold,
+        in target order.
+        With onlyPrevious (comparing a list with itself) only
+        the targets preceding each query are considered.
+        Reference implementation, one scalar product at a time.
+    '''
+    return [
+        [
+            (tIndex,tProd)
+            for tIndex,tProd in (
+                (tIndex,scalProd(tVector,qVector))
+                for tIndex,tVector in enumerate(targetVectors[:qIndex] if onlyPrevious else targetVectors)
+            )
+            if tProd>=threshold
+        ]
+        for qIndex,qVector in enumerate(queryVectors)
+    ]
+
+def numProducts(queryVectors,targetVectors,onlyPrevious=False):
+    '''
+        number of scalar products computed by dictSimilarPairs
+    '''
+    if onlyPrevious:
+        return len(queryVectors)*(len(queryVectors)-1)//2
+    else:
+        return len(queryVectors)*len(targetVectors)
+
+def similarPairs(queryVectors,targetVectors,threshold,onlyPrevious=False):
+    '''
+        Same as dictSimilarPairs, computed with the
+        backend chosen with SIMILARITY_BACKEND in config.py,
+        split among SIMILARITY_PROCESSES processes if large enough
+    '''
+    if SIMILARITY_PROCESSES>1 and numProducts(queryVectors,targetVectors,onlyPrevious)>=SIMILARITY_PARALLEL_MIN_PRODUCTS:
+        from app.utils.parallel_vectorizer import parallelSimilarPairs
+        return parallelSimilarPairs(queryVectors,targetVectors,threshold,onlyPrevious,SIMILARITY_PROCESSES)
+    else:
+        return serialSimilarPairs(queryVectors,targetVectors,threshold,onlyPrevious)
+
+def serialSimilarPairs(queryVectors,targetVectors,threshold,onlyPrevious=False):
+    '''
+        Same as dictSimilarPairs, computed in-process with the
+        backend chosen with SIMILARITY_BACKEND in config.py
+    '''
+    if SIMILARITY_BACKEND=='numpy':
+        # numpy is needed only if this backend is chosen
+        from app.utils.numpy_vectorizer import numpySimilarPairs
+        return numpySimilarPairs(queryVectors,targetVectors,threshold,onlyPrevious)
+    else:
+        return dictSimilarPairs(queryVectors,targetVectors,threshold,onlyPrevious)
@@ -6,14 +6,16 @@ from flask import   (
                         url_for,
                         request,
                         g,
-                        send_file,
                         send_from_directory,
+                        Response,
+                        jsonify,
+                        make_response,
                     )
 from flask_login import  login_user, logout_user, current_user, login_required
 from datetime import datetime
 from werkzeug.datastructures import MultiDict
 from markupsafe import Markup
-from io import BytesIO
+import hashlib
 import json
 import uuid
 import os
@@ -40,13 +42,17 @@ from config import (
                         SIMILAR_BOOK_THRESHOLD,
                         FILENAME_DATETIME_STR_FORMAT,
                         TEMP_DIRECTORY,
+                        API_MAX_RESULTS_PER_PAGE,
                     )
 
 from app.utils.string_vectorizer import makeIntoVector, scalProd
+from app.database.vectorstore import bookVectors, authorVectors
 from app.utils.importlibrary import (
-                                        read_and_parse_csv,
-                                        process_book_list,
+                                        csv_to_ndjson,
+                                        iter_ndjson_books,
+                                        process_book_stream,
                                         import_from_bilist_json,
+                                        import_from_bilist_ndjson,
                                     )
 from app.database.dbtools import    (
                                         dbGetDatabase,
@@ -55,6 +61,7 @@ from app.database.dbtools import    (
                                         dbGetUser,
                                         dbDeleteAuthor,
                                         dbGetAuthor,
+                                        dbGetAuthorBookIds,
                                         dbAddReplaceAuthor,
                                         dbGetBook,
                                         dbDeleteBook,
@@ -63,7 +70,18 @@ from app.database.dbtools import    (
                                         dbReplaceUser,
                                         dbQueryBooks,
                                         dbQueryAuthors,
+                                        compileBookQuery,
+                                        compileAuthorQuery,
                                         dbGetUserById,
+                                        dbGetReferenceData,
+                                        dbGetDataStamp,
+                                        dbGetVectors,
+                                        dbGetSimilarityCandidates,
+                                        dbStatisticsBatch,
+                                        dbGetStatisticsPanel,
+                                        dbIterBooksSorted,
+                                        dbSubmitJob,
+                                        dbGetJob,
                                     )
 from app.database.models import (
                                     tableToModel, 
@@ -73,12 +91,18 @@ from app.database.models import (
                                 )
 from app import (
                     languages,
-                    languagesDict,
                     booktypes,
-                    booktypesDict,
                 )
-from app.statistics.statistics import sortStatistics
 from app.privacy_policy import privacy_policy
+from app.utils.streamexport import (
+                                        iterJsonExport,
+                                        iterNdjsonExport,
+                                        iterCsvExport,
+                                        bookCsvColumns,
+                                        bookCsvRecord,
+                                        gzipChunks,
+                                        CHUNK_SIZE,
+                                    )
 
 def flashMessage(msgType,msgHeading,msgBody):
     '''
@@ -88,6 +112,43 @@ def flashMessage(msgType,msgHeading,msgBody):
     '''
     flash(Markup('<strong>%s: </strong> %s' % (msgHeading,msgBody)), msgType)
 
+# the page ETags must change with the code and the templates as well
+_pageCodeStamp=max(
+    os.path.getmtime(os.path.join(dirName,fileName))
+    for dirName in [os.path.dirname(__file__),os.path.join(os.path.dirname(__file__),'templates')]
+    for fileName in os.listdir(dirName)
+)
+
+def pageEtag(*keyParts, showsFlashes=True):
+    '''
+        ETag of the page being requested, for the current user, given
+        what it depends on besides the DB contents (e.g. the query args).
+        None if the page is to be rendered anyway (pending flashed messages,
+        unless the page does not show them).
+    '''
+    if showsFlashes and '_flashes' in session:
+        return None
+    return hashlib.sha1(
+        repr((_pageCodeStamp,dbGetDataStamp(),g.user.id,request.endpoint,keyParts)).encode('utf-8')
+    ).hexdigest()
+
+def conditionalResponse(etag,renderer):
+    '''
+        A '304 Not Modified' if the client already has the page
+        with this ETag, otherwise the response returned by renderer(),
+        carrying the ETag (if not None)
+    '''
+    if etag is None:
+        return renderer()
+    if etag in request.if_none_match:
+        response=Response(status=304)
+    else:
+        response=make_response(renderer())
+    response.set_etag(etag)
+    # to be revalidated at each use, and not by shared caches
+    response.headers['Cache-Control']='private, no-cache'
+    return response
+
 @app.before_request
 def before_request():
     g.user = current_user
@@ -102,8 +163,7 @@ def load_user(id):
 def ep_index():
     user = g.user
     if user is not None:
-        rawStats=dbGetAll('statistic')
-        message=sortStatistics(rawStats,resolveParams())
+        message=dbGetStatisticsPanel()
     else:
         message=None
     return render_template(
@@ -117,65 +177,73 @@ def ep_index():
 @login_required
 def ep_languages():
     user = g.user
-    return render_template  (
-                                "languages.html",
-                                title='Languages',
-                                user=user,
-                                languages=languages,
-                            )
+    return conditionalResponse(
+        pageEtag(),
+        lambda: render_template (
+                                    "languages.html",
+                                    title='Languages',
+                                    user=user,
+                                    languages=languages,
+                                ),
+    )
 
 @app.route('/booktypes')
 @login_required
 def ep_booktypes():
     user = g.user
-    return render_template  (
-                                "booktypes.html",
-                                title='Book Types',
-                                user=user,
-                                booktypes=booktypes,
-                            )
+    return conditionalResponse(
+        pageEtag(),
+        lambda: render_template (
+                                    "booktypes.html",
+                                    title='Book Types',
+                                    user=user,
+                                    booktypes=booktypes,
+                                ),
+    )
 
 @app.route('/houses')
 @login_required
 def ep_houses():
     user = g.user
-    # equip house-objects with the 'users' list
-    # reload houses and users
-    houses=sorted(list(dbGetAll('house')))
-    allUsers=list(dbGetAll('user'))
-    for hObj in houses:
-        if user.canedit:
-            hObj.users=[]
-            for qU in sorted(u for u in allUsers if u.house==hObj.name):
-                hObj.users.append({
-                        'name': qU.name,
-                        'strong': qU.name==user.name,
-                    })
-        else:
-            nUsers=len([u for u in allUsers if u.house==hObj.name and u.name!=user.name])
-            hObj.users=[
-                {
-                    'name': user.name,
-                    'strong': True,
-                }
-            ] if hObj.name==user.house else []
-            hObj.users.append(
-                {
-                    'name': '%s%i user%s' % (
-                            '+ ' if hObj.name==user.house else '',
-                            nUsers,
-                            's' if nUsers>1 else '',
-                        ),
-                    'strong': False,
-                }
-            )
-    #
-    return render_template  (
-                                "houses.html",
-                                title='Houses',
-                                user=user,
-                                houses=houses,
-                            )
+    def _renderHouses():
+        # equip house-objects with the 'users' list
+        # reload houses and users
+        houses=sorted(list(dbGetAll('house')))
+        allUsers=list(dbGetAll('user'))
+        for hObj in houses:
+            if user.canedit:
+                hObj.users=[]
+                for qU in sorted(u for u in allUsers if u.house==hObj.name):
+                    hObj.users.append({
+                            'name': qU.name,
+                            'strong': qU.name==user.name,
+                        })
+            else:
+                nUsers=len([u for u in allUsers if u.house==hObj.name and u.name!=user.name])
+                hObj.users=[
+                    {
+                        'name': user.name,
+                        'strong': True,
+                    }
+                ] if hObj.name==user.house else []
+                hObj.users.append(
+                    {
+                        'name': '%s%i user%s' % (
+                                '+ ' if hObj.name==user.house else '',
+                                nUsers,
+                                's' if nUsers>1 else '',
+                            ),
+                        'strong': False,
+                    }
+                )
+        #
+        return render_template  (
+                                    "houses.html",
+                                    title='Houses',
+                                    user=user,
+                                    houses=houses,
+                                )
+    return conditionalResponse(pageEtag(),_renderHouses)
 
 @app.route('/deletebook/<id>/<confirm>')
 @app.route('/deletebook/<id>')
@@ -215,6 +283,27 @@ def ep_goback(default='ep_books'):
     else:
         return redirect(url_for(default))
 
+def paginationQueries(reqargs,result):
+    '''
+        prepares the arglists for the pagination commands
+        by keeping the rest of the multidict: the next/prev page
+        is given by a cursor if the query result has one, by an offset otherwise
+    '''
+    def pageQuery(direction):
+        if '%scursor' % direction in result:
+            query=reqargs.copy()
+            query.pop('startfrom',None)
+            query['cursor']=result['%scursor' % direction]
+            return query
+        elif '%sstartfrom' % direction in result:
+            query=reqargs.copy()
+            query.pop('cursor',None)
+            query['startfrom']=result['%sstartfrom' % direction]
+            return query
+        else:
+            return None
+    return pageQuery('prev'),pageQuery('next')
+
 @app.route('/authors/<restore>')
 @app.route('/authors')
 @login_required
@@ -227,28 +316,27 @@ def ep_authors(restore=None):
         session['lastquery']={'page':'ep_authors','args': request.args}
         reqargs=request.args
     #
-    result,authors=dbQueryAuthors   (
-                                        queryArgs=reqargs,
-                                        resultsperpage=user.resultsperpage,
-                                    )
-    # prepare arglist for pagination commands by keeping the rest of the multidict
-    prevquery=None
-    nextquery=None
-    if 'nextstartfrom' in result:
-        nextquery=reqargs.copy()
-        nextquery['startfrom'] = result['nextstartfrom']
-    if 'prevstartfrom' in result:
-        prevquery=reqargs.copy()
-        prevquery['startfrom'] = result['prevstartfrom']
-    return render_template  (
-                                "authors.html",
-                                title='Authors',
-                                user=user,
-                                authors=authors,
-                                queryresult=result,
-                                nextquery=nextquery,
-                                prevquery=prevquery,
-                            )
+    def _renderAuthors():
+        result,authors=dbQueryAuthors   (
+                                            queryArgs=reqargs,
+                                            resultsperpage=user.resultsperpage,
+                                        )
+        # prepare arglist for pagination commands by keeping the rest of the multidict
+        prevquery,nextquery=paginationQueries(reqargs,result)
+        return render_template  (
+                                    "authors.html",
+                                    title='Authors',
+                                    user=user,
+                                    authors=authors,
+                                    queryresult=result,
+                                    nextquery=nextquery,
+                                    prevquery=prevquery,
+                                )
+    # unchanged data and query: the client's copy is still good
+    return conditionalResponse(
+        pageEtag(sorted(MultiDict(reqargs).items(multi=True))),
+        _renderAuthors,
+    )
 
 @app.route('/deleteauthor/<id>')
 @app.route('/deleteauthor/<id>/<confirm>')
@@ -349,11 +437,14 @@ def ep_editauthor():
                 'last': makeIntoVector(editedAuthor.lastname),
                 'full': makeIntoVector(editedAuthor.firstname+editedAuthor.lastname)
             }
-            for otAu in dbGetAll('author',resolve=False):
+            authorVectorMap=dbGetVectors('author')
+            # only the candidates from the LSH index are checked
+            for otAu in dbGetSimilarityCandidates('author',{'lastname': aVecs['last'], 'firstlast': aVecs['full']}):
                 if otAu.id != editedAuthor.id:
+                    otVecs=authorVectorMap.get(otAu.id) or authorVectors(otAu.firstname,otAu.lastname)
                     oVecs={
-                        'last': makeIntoVector(otAu.lastname),
-                        'full': makeIntoVector(otAu.firstname+otAu.lastname)
+                        'last': otVecs['lastname'],
+                        'full': otVecs['firstlast'],
                     }
                     # if either vector is too similar to the insertee's corresponding one
                     if any([scalProd(aVecs[vkey],oVecs[vkey])>SIMILAR_AUTHOR_THRESHOLD for vkey in aVecs.keys()]):
@@ -413,20 +504,16 @@ def ep_editauthor():
                               )
 
 def retrieveUsers():
-    return dbMakeDict(dbGetAll('user'))
+    return dbGetReferenceData()['users']
 
 def resolveParams():
-    # refresh authors list
-    authors=list(dbGetAll('author'))
-    authorsDict=dbMakeDict(authors)
-    houses=list(dbGetAll('house'))
-    housesDict=dbMakeDict(houses,fieldname='name')
-    # pack the rest
+    # cached reference data, reloaded only when changed
+    refData=dbGetReferenceData()
     return {
-                'authors': authorsDict,
-                'languages': languagesDict,
-                'booktypes': booktypesDict,
-                'houses': housesDict,
+                'authors': refData['authors'],
+                'languages': refData['languages'],
+                'booktypes': refData['booktypes'],
+                'houses': refData['houses'],
             }
 
 @app.route('/authorsearch',methods=['GET','POST'])
@@ -491,6 +578,18 @@ def ep_booksearch():
                                     form=form,
                                 )
 
+def withDefaultHouse(user,reqargs):
+    '''
+        adds the user's house to the book query args
+        if these have none and the user asks so
+    '''
+    if 'house' not in reqargs and user.defaulthousesearch:
+        # ugly workaround to prepare default search criterion here and pass it fully prepared
+        # to the DB primitive
+        return MultiDict({k:v for k,v in list(reqargs.items())+[('house',user.house)]})
+    else:
+        return reqargs
+
 @app.route('/books/<restore>')
 @app.route('/books')
 @login_required
@@ -503,51 +602,169 @@ def ep_books(restore=None):
         session['lastquery']={'page':'ep_books','args': request.args}
         reqargs=request.args
     #
-    if 'house' not in reqargs:
-        if user.defaulthousesearch:
-            # ugly workaround to prepare default search criterion here and pass it fully prepared
-            # to the DB primitive
-            reqargs=MultiDict({k:v for k,v in list(reqargs.items())+[('house',user.house)]})
-    # perform live query
-    result,books=dbQueryBooks   (
-                                    queryArgs=reqargs,
-                                    resultsperpage=user.resultsperpage,
-                                    resolve=True,
-                                    resolveParams=resolveParams(),
+    reqargs=withDefaultHouse(user,reqargs)
+    def _renderBooks():
+        # perform live query
+        result,books=dbQueryBooks   (
+                                        queryArgs=reqargs,
+                                        resultsperpage=user.resultsperpage,
+                                        resolve=True,
+                                        resolveParams=resolveParams(),
+                                    )
+        umap = retrieveUsers()
+        for bo in books:
+            lasteditor=umap.get(int(bo.lasteditor))
+            if lasteditor:
+                bo.lastedit=[lasteditor.name]
+                if bo.lasteditdate:
+                    try:
+                        bo.lastedit+=[datetime.strptime(str(bo.lasteditdate),
+                            DATETIME_STR_FORMAT).strftime(SHORT_DATETIME_STR_FORMAT)]
+                    except:
+                        pass
+            else:
+                bo.lastedit=''
+        # done.
+        # prepare arglist for pagination commands by keeping the rest of the multidict
+        prevquery,nextquery=paginationQueries(reqargs,result)
+        # render results list page
+        return render_template  (
+                                    "books.html",
+                                    title='Books',
+                                    user=user,
+                                    books=books,
+                                    queryresult=result,
+                                    nextquery=nextquery,
+                                    prevquery=prevquery,
                                 )
-    umap = retrieveUsers()
-    for bo in books:
-        lasteditor=umap.get(int(bo.lasteditor))
-        if lasteditor:
-            bo.lastedit=[lasteditor.name]
-            if bo.lasteditdate:
-                try:
-                    bo.lastedit+=[datetime.strptime(str(bo.lasteditdate),
-                        DATETIME_STR_FORMAT).strftime(SHORT_DATETIME_STR_FORMAT)]
-                except:
-                    pass
-        else:
-            bo.lastedit=''
-    # done.
-    # prepare arglist for pagination commands by keeping the rest of the multidict
-    prevquery=None
-    nextquery=None
-    if 'nextstartfrom' in result:
-        nextquery=reqargs.copy()
-        nextquery['startfrom'] = result['nextstartfrom']
-    if 'prevstartfrom' in result:
-        prevquery=reqargs.copy()
-        prevquery['startfrom'] = result['prevstartfrom']
-    # render results list page
-    return render_template  (
-                                "books.html",
-                                title='Books',
-                                user=user,
-                                books=books,
-                                queryresult=result,
-                                nextquery=nextquery,
-                                prevquery=prevquery,
-                            )
+    # unchanged data and query: the client's copy is still good
+    return conditionalResponse(
+        pageEtag(sorted(MultiDict(reqargs).items(multi=True))),
+        _renderBooks,
+    )
+
+# fields served by the JSON API: column -> serializer of its value
+apiBookFields={
+    'id': int,
+    'title': str,
+    'authors': unrollStringList,
+    'booktype': str,
+    'inhouse': lambda v: bool(int(v)),
+    'inhousenotes': str,
+    'notes': str,
+    'languages': lambda v: [lang for lang in v.split(',') if lang!=''],
+    'lasteditor': int,
+    'lasteditdate': str,
+    'house': str,
+}
+apiAuthorFields={
+    'id': int,
+    'firstname': str,
+    'lastname': str,
+    'notes': str,
+    'bookcount': int,
+    'booklist': unrollStringList,
+}
+# arguments of the API calls which are not part of the query
+apiArgs=['fields','resultsperpage']
+
+def apiError(message,status=400):
+    return jsonify({'error': message}), status
+
+def apiQuery(reqargs,fieldSerializers,compiler,querier,itemsName):
+    '''
+        Runs a query for the JSON API and returns the response:
+            reqargs             = the request args: the same as the listing pages, plus
+                                    fields          = comma-separated fields to return (default: all)
+                                    resultsperpage  = page size (default: the user's setting)
+            fieldSerializers    = the map field -> serializer, e.g. apiBookFields
+            compiler            = function(queryArgs) -> compiled query (ValueError if invalid)
+            querier             = function(queryArgs,resultsperpage,columns) -> (result,items)
+            itemsName           = key of the items in the response
+
+        The response has the keys of the query result (ntotal, cursors/startfroms, ...)
+        and the list of items, each a dict with the requested fields only.
+        Only the columns corresponding to the requested fields are read.
+    '''
+    fields=[
+        field
+        for fieldList in reqargs.getlist('fields')
+        for field in fieldList.split(',')
+        if field!=''
+    ]
+    if len(fields)==0:
+        fields=list(fieldSerializers.keys())
+    unknownFields=[field for field in fields if field not in fieldSerializers]
+    if len(unknownFields)>0:
+        return apiError('Unknown fields: %s' % ', '.join(unknownFields))
+    try:
+        resultsperpage=int(reqargs.get('resultsperpage',g.user.resultsperpage))
+    except ValueError:
+        return apiError('Invalid resultsperpage')
+    if resultsperpage<1 or resultsperpage>API_MAX_RESULTS_PER_PAGE:
+        return apiError('resultsperpage must be between 1 and %i' % API_MAX_RESULTS_PER_PAGE)
+    queryArgs=MultiDict([
+        (k,v)
+        for k,v in reqargs.items(multi=True)
+        if k not in apiArgs
+    ])
+    # errors are found before the conditional response: they carry no ETag
+    try:
+        compiledQuery=compiler(queryArgs)
+    except ValueError as e:
+        return apiError('Invalid query arguments: %s' % e)
+    if compiledQuery['startfrom']<0:
+        return apiError('startfrom must not be negative')
+    #
+    def _renderApi():
+        result,items=querier(queryArgs,resultsperpage,fields)
+        serializers=[(field,fieldSerializers[field]) for field in fields]
+        result[itemsName]=[
+            {
+                field: serializer(getattr(item,field))
+                for field,serializer in serializers
+            }
+            for item in items
+        ]
+        # compact JSON regardless of the app settings
+        return Response(
+            json.dumps(result,separators=(',',':')),
+            mimetype='application/json',
+        )
+    return conditionalResponse(
+        pageEtag(sorted(reqargs.items(multi=True)),showsFlashes=False),
+        _renderApi,
+    )
+
+@app.route('/api/books')
+@login_required
+def ep_apibooks():
+    return apiQuery(
+        request.args,
+        apiBookFields,
+        compileBookQuery,
+        lambda queryArgs,resultsperpage,fields: dbQueryBooks(
+            queryArgs=withDefaultHouse(g.user,queryArgs),
+            resultsperpage=resultsperpage,
+            columns=fields,
+        ),
+        'books',
+    )
+
+@app.route('/api/authors')
+@login_required
+def ep_apiauthors():
+    return apiQuery(
+        request.args,
+        apiAuthorFields,
+        compileAuthorQuery,
+        lambda queryArgs,resultsperpage,fields: dbQueryAuthors(
+            queryArgs=queryArgs,
+            resultsperpage=resultsperpage,
+            columns=fields,
+        ),
+        'authors',
+    )
 
 @app.route('/login', methods=['GET', 'POST'])
 def ep_login():
@@ -695,10 +912,13 @@ def ep_editbook():
                 bVecs={
                     'full': makeIntoVector(editedBook.title)
                 }
-                for otBo in dbGetAll('book',resolve=False):
+                bookVectorMap=dbGetVectors('book')
+                # only the candidates from the LSH index are checked
+                for otBo in dbGetSimilarityCandidates('book',{'title': bVecs['full']}):
                     if otBo.id != editedBook.id:
+                        otVecs=bookVectorMap.get(otBo.id) or bookVectors(otBo.title)
                         oVecs={
-                            'full': makeIntoVector(otBo.title)
+                            'full': otVecs['title'],
                         }
                         # if either vector is too similar to the insertee's corresponding one
                         if any([scalProd(bVecs[vkey],oVecs[vkey])>SIMILAR_BOOK_THRESHOLD for vkey in bVecs.keys()]):
@@ -866,48 +1086,84 @@ def ep_advanced():
                                 user=user,
                             )
 
+def exportDataJob(progress,exportHouse,exportForm,exportFormat,includeAuthors,compress):
+    '''
+        Background job writing an export file to TEMP_DIRECTORY.
+        Returns the stored and the download file names and the mimetype.
+    '''
+    resParams=resolveParams()
+    userList=retrieveUsers()
+    exportedFileName='exportedBiblio_%s.%s' % (datetime.now().strftime(FILENAME_DATETIME_STR_FORMAT),exportFormat)
+    # the export is generated as the file is written
+    bookDicts=(
+        bk.exportableDict(resolveParams=resParams, userList=userList, form=exportForm)
+        for bk in dbIterBooksSorted(house=exportHouse,progress=progress)
+    )
+    if includeAuthors and exportFormat!='csv':
+        authorList=[au.exportableDict(resolveParams=resParams) for au in sorted(dbGetAll('author'))]
+    else:
+        authorList=None
+    if exportFormat=='ndjson':
+        # authors first, so that a reader can insert them before the books
+        exportChunks=iterNdjsonExport(
+            ([('author',authorList)] if authorList is not None else [])+[('book',bookDicts)]
+        )
+        exportMimetype='application/x-ndjson'
+    elif exportFormat=='csv':
+        exportChunks=iterCsvExport(
+            bookCsvColumns[exportForm],
+            (bookCsvRecord(bookDict,bookCsvColumns[exportForm]) for bookDict in bookDicts),
+        )
+        exportMimetype='text/csv'
+    else:
+        exportChunks=iterJsonExport(
+            [('books',bookDicts)]+([('authors',authorList)] if authorList is not None else [])
+        )
+        exportMimetype='application/json'
+    if compress:
+        exportChunks=gzipChunks(exportChunks)
+        exportedFileName+='.gz'
+        exportMimetype='application/gzip'
+    storedFileName='export_%s' % uuid.uuid4()
+    with open(os.path.join(TEMP_DIRECTORY,storedFileName),'wb') as exportFile:
+        for chunk in exportChunks:
+            exportFile.write(chunk)
+    return {
+        'filename': storedFileName,
+        'downloadname': exportedFileName,
+        'mimetype': exportMimetype,
+    }
+
 @app.route('/exportdata', methods=['GET','POST'])
 @login_required
 def ep_exportdata():
     user=g.user
-    resParams=resolveParams()
     form=ExportDataForm()
     houses=sorted(list(dbGetAll('house')))
     form.setHouses(houses)
     if form.validate_on_submit():
-        userList=dbMakeDict(dbGetAll('user'))
-        # prepare and export the whole structure
-        exportedFileName='exportedBiblio_%s.json' % datetime.now().strftime(FILENAME_DATETIME_STR_FORMAT)
         if form.house.data=='':
             print('setting TrueFilter')
-            bookFilter=lambda bo: True
+            exportHouse=None
         else:
             print('setting House==%s' % form.house.data)
-            bookFilter=lambda bo: bo.house==form.house.data
+            exportHouse=form.house.data
         if form.includemetadata.data:
             exportForm='long'
         else:
             exportForm='short'
-        bookList=[
-            bk.exportableDict(resolveParams=resParams, userList=userList, form=exportForm)
-            for bk in sorted(dbGetAll('book'))
-            if bookFilter(bk)
-        ]
-        #
-
-        #
-        exportableStructure={'books': bookList}
-        if form.includeauthors.data:
-            authorList=[au.exportableDict(resolveParams=resParams) for au in sorted(dbGetAll('author'))]
-            exportableStructure['authors']=authorList
-        bIO = BytesIO()
-        bIO.write(json.dumps(exportableStructure,indent=4,sort_keys=True).encode('utf-8'))
-        bIO.seek(0)
-        return send_file    (
-                                bIO,
-                                attachment_filename=exportedFileName,
-                                as_attachment=True,
-                            )
+        # the export file is written by a background job
+        jobId=dbSubmitJob(
+            'export',
+            user.id,
+            exportDataJob,
+            exportHouse,
+            exportForm,
+            form.exportformat.data,
+            form.includeauthors.data,
+            form.compress.data,
+        )
+        return redirect(url_for('ep_job',jobid=jobId))
     else:
         form.setDefaultHouse(user.house if user.defaulthousesearch else '')
         return render_template  (
@@ -938,6 +1194,71 @@ def ep_importdata():
                                 user=user,
                             )
 
+def importStepJob(progress,step,uploadFileName,isNdjson,skipHeader,userId):
+    '''
+        Background job running an import step on an uploaded file
+        (stored in TEMP_DIRECTORY, removed when done).
+        Steps 1,2,3 -> csv-to-bookjson, bookjson-to-fulljson, fulljson-to-DB.
+        Files are read and written as streams, the produced ones being
+        NDJSON (steps 2 and 3 accept the former JSON files as well).
+        Returns the 'returnfile' structure for ep_importsucceeded.
+    '''
+    uploadFullName=os.path.join(TEMP_DIRECTORY,uploadFileName)
+    try:
+        if step==1 or step==2:
+            storedFileName='step%i_%s.ndjson' % (step,uuid.uuid4())
+            storedFullName=os.path.join(TEMP_DIRECTORY,storedFileName)
+            try:
+                with open(uploadFullName,encoding='utf-8',newline='') as inFile, open(storedFullName,'wb') as outFile:
+                    if step==1:
+                        # csv to book NDJSON
+                        csv_to_ndjson(inFile,outFile,skipHeader=skipHeader,progress=progress)
+                    else:
+                        # book NDJSON (or JSON) to full NDJSON, with a report
+                        warningJson=process_book_stream(
+                            iter_ndjson_books(inFile) if isNdjson else json.load(inFile)['books'],
+                            outFile,
+                            progress=progress,
+                        )
+            except:
+                # a partial output is not to be served
+                os.remove(storedFullName)
+                raise
+            if step==1:
+                reportFileName=None
+            else:
+                reportFileName='report_step%i_%s.json' % (step,uuid.uuid4())
+                json.dump(warningJson,open(os.path.join(TEMP_DIRECTORY,reportFileName),'w'),indent=4,sort_keys=True)
+            #
+            return {
+                'step': step,
+                'filename': storedFileName,
+                'reportname': reportFileName,
+            }
+        elif step==3:
+            # fullJson (or its NDJSON export) to database
+            db=dbGetDatabase()
+            importingUser=dbGetUserById(userId)
+            with open(uploadFullName,encoding='utf-8') as inFile:
+                if isNdjson:
+                    resultReport=import_from_bilist_ndjson(inFile,importingUser,db,progress=progress)
+                else:
+                    resultReport=import_from_bilist_json(inFile,importingUser,db,progress=progress)
+            # store the report
+            reportFileName='report_step%i_%s.json' % (step,uuid.uuid4())
+            json.dump(resultReport,open(os.path.join(TEMP_DIRECTORY,reportFileName),'w'),indent=4,sort_keys=True)
+            # done
+            db.commit()
+            return {
+                'step': step,
+                'filename': None,
+                'reportname': reportFileName,
+            }
+        else:
+            raise ValueError('inconsistent value of "step"')
+    finally:
+        os.remove(uploadFullName)
+
 @app.route('/importstep/<_step>',methods=['GET','POST'])
 @login_required
 def ep_importstep(_step):
@@ -955,67 +1276,21 @@ def ep_importstep(_step):
     #
     form=UploadDataForm()
     if form.validate_on_submit():
-        # actual handling of uploaded data according to the processing step
+        # the uploaded file is stored and handed to a background job
         try:
-            # make the uploaded file into a string and pass it to the full import procedure
-            fileString=form.file.data.read().decode('utf-8').split('\n')
-            if step==1:
-                # csv to json
-                parsedCSV=read_and_parse_csv(fileString,skipHeader=form.checkbox.data)
-                # store the response in a local file, ready to serve it.
-                storedFileName='step%i_%s.json' % (step,uuid.uuid4())
-                json.dump(parsedCSV,open(os.path.join(TEMP_DIRECTORY,storedFileName),'w'),indent=4,sort_keys=True)
-                session['returnfile']={
-                    'step': step,
-                    'filename': storedFileName,
-                    'reportname': None,
-                }
-                return redirect(url_for('ep_importsucceeded',_step=step))
-            elif step==2:
-                # bookJson to fullJson
-                fullJson=process_book_list(fileString)
-                storedFileName='step%i_%s.json' % (step,uuid.uuid4())
-                json.dump(fullJson,open(os.path.join(TEMP_DIRECTORY,storedFileName),'w'),indent=4,sort_keys=True)
-                # prepare a report
-                warningJson={
-                    'books': [
-                        bs['title']
-                        for bs in fullJson['books']
-                        if '_warnings' in bs
-                    ],
-                    'authors': [
-                        '%s, %s' % (au['lastname'],au['firstname'])
-                        for au in fullJson['authors']
-                        if '_warnings' in au
-                    ],
-                }
-                reportFileName='report_step%i_%s.json' % (step,uuid.uuid4())
-                json.dump(warningJson,open(os.path.join(TEMP_DIRECTORY,reportFileName),'w'),indent=4,sort_keys=True)
-                #
-                session['returnfile']={
-                    'step': step,
-                    'filename': storedFileName,
-                    'reportname': reportFileName,
-                }
-                return redirect(url_for('ep_importsucceeded',_step=step))
-            elif step==3:
-                # fullJson to database
-                db=dbGetDatabase()
-                resultReport=import_from_bilist_json(fileString,user,db)
-                # store the report
-                reportFileName='report_step%i_%s.json' % (step,uuid.uuid4())
-                json.dump(resultReport,open(os.path.join(TEMP_DIRECTORY,reportFileName),'w'),indent=4,sort_keys=True)
-                # done
-                session['returnfile']={
-                    'step': step,
-                    'filename': None,
-                    'reportname': reportFileName,
-                }
-                db.commit()
-                return redirect(url_for('ep_importsucceeded',_step=step))
-            else:
-                flashMessage('critical','Malformed request','inconsistent value of "step".')
-                return redirect(url_for('ep_importdata'))
+            uploadFileName='upload_step%i_%s' % (step,uuid.uuid4())
+            form.file.data.save(os.path.join(TEMP_DIRECTORY,uploadFileName))
+            jobId=dbSubmitJob(
+                'import',
+                user.id,
+                importStepJob,
+                step,
+                uploadFileName,
+                form.file.data.filename.lower().endswith('.ndjson'),
+                form.checkbox.data,
+                user.id,
+            )
+            return redirect(url_for('ep_job',jobid=jobId))
         except Exception as e:
             flashMessage('critical','Error during operation','exception "%s" occurred.' % e)
             return redirect(url_for('ep_importdata'))
@@ -1107,21 +1382,19 @@ def ep_getimportresults(step):
     if 'returnfile' in session and session['returnfile']['filename'] is not None:
         servedFileName=os.path.join(TEMP_DIRECTORY,session['returnfile']['filename'])
         if os.path.isfile(servedFileName):
-            loadedFile=open(servedFileName).read()
-            fileTitle='import-Step%i-%s.json' % (
+            fileTitle='import-Step%i-%s%s' % (
                 session['returnfile']['step'],
-                datetime.now().strftime(FILENAME_DATETIME_STR_FORMAT)
+                datetime.now().strftime(FILENAME_DATETIME_STR_FORMAT),
+                os.path.splitext(servedFileName)[1],
             )
-            bIO = BytesIO()
-            bIO.write(loadedFile.encode())
-            bIO.seek(0)
-            os.remove(servedFileName)
             session['returnfile']['filename']=None
-            return send_file    (
-                                    bIO,
-                                    attachment_filename=fileTitle,
-                                    as_attachment=True,
-                                )
+            return Response (
+                                _serveOnce(servedFileName),
+                                mimetype='application/x-ndjson',
+                                headers={
+                                    'Content-Disposition': 'attachment; filename=%s' % fileTitle,
+                                },
+                            )
             del session['returnfile']
         else:
             flashMessage('critical','Malformed link','this link is invalid.')
@@ -1150,49 +1423,60 @@ def ep_emptyhouse():
         title='Delete data',
     )
 
-@app.route('/deletedata')
-@app.route('/deletedata/<authors>')
-@login_required
-def ep_deletedata(authors='n'):
-    user=g.user
-    if not user.canedit:
-        flashMessage('error','Cannot proceed','user "%s" has no write privileges.' % user.name)
-        return redirect(url_for('ep_advanced'))
+def deleteDataJob(progress,withAuthors,userId):
+    '''
+        Background job deleting the books of the user's house
+        (and, if required, the authors whose only books belong to it).
+        Returns the counters of the operation.
+    '''
+    user=dbGetUserById(userId)
     report={}
     db=dbGetDatabase()
-    if authors=='y':
-        report['au_kept']=0
-        report['au_deleted']=0
-        report['au_errors']=0
-        # delete those authors whose only books belong to user's house
-        for qAu in dbGetAll('author'):
-            if any([
-                dbGetBook(bookId).house!=user.house
-                for bookId in unrollStringList(qAu.booklist)
-            ]):
-                report['au_kept']+=1
-            else:
-                success,_=dbDeleteAuthor(qAu.id,db=db,userHouse=user.house)
+    authorList=list(dbGetAll('author')) if withAuthors else []
+    nItems=len(authorList)+db.execute('SELECT COUNT(*) FROM Book').fetchone()[0]
+    nDone=0
+    # statistics are updated once at the end
+    with dbStatisticsBatch(db):
+        if withAuthors:
+            report['au_kept']=0
+            report['au_deleted']=0
+            report['au_errors']=0
+            # delete those authors whose only books belong to user's house
+            for qAu in authorList:
+                if any([
+                    dbGetBook(bookId).house!=user.house
+                    for bookId in dbGetAuthorBookIds(qAu.id,db=db)
+                ]):
+                    report['au_kept']+=1
+                else:
+                    success,_=dbDeleteAuthor(qAu.id,db=db,userHouse=user.house)
+                    if success:
+                        report['au_deleted']+=1
+                    else:
+                        report['au_errors']+=1
+                nDone+=1
+                progress(nDone,nItems)
+        # now deal with books
+        report['bo_deleted']=0
+        report['bo_errors']=0
+        report['bo_kept']=0
+        for qBo in dbGetAll('book'):
+            if qBo.house==user.house:
+                success,_=dbDeleteBook(qBo.id,db=db,userHouse=user.house)
                 if success:
-                    report['au_deleted']+=1
+                    report['bo_deleted']+=1
                 else:
-                    report['au_errors']+=1
-    # now deal with books
-    report['bo_deleted']=0
-    report['bo_errors']=0
-    report['bo_kept']=0
-    for qBo in dbGetAll('book'):
-        if qBo.house==user.house:
-            success,_=dbDeleteBook(qBo.id,db=db,userHouse=user.house)
-            if success:
-                report['bo_deleted']+=1
+                    report['bo_errors']+=1
             else:
-                report['bo_errors']+=1
-        else:
-            report['bo_kept']+=1
+                report['bo_kept']+=1
+            nDone+=1
+            progress(nDone,nItems)
     # done.
     db.commit()
-    # return final counters - (mandatory_msg, key, description)
+    return report
+
+def makeDeleteDataMessage(report):
+    # final counters - (mandatory_msg, key, description)
     reportDesc=[
         (True,'bo_deleted','Books deleted'),
         (False,'bo_kept','Book kept'),
@@ -1201,19 +1485,118 @@ def ep_deletedata(authors='n'):
         (False,'au_kept','Authors kept'),
         (False,'au_errors','Authors with errors'),
     ]
-    #
-    flashMessage(
-        'info',
-        'Delete succeeded',
-        '%s.' % (
-            '. '.join([
-                '%s: %i' % (desc, report[key])
-                for mandatory,key,desc in reportDesc
-                if key in report and (mandatory or report[key]>0)
-            ])
-        )
+    return '%s.' % (
+        '. '.join([
+            '%s: %i' % (desc, report[key])
+            for mandatory,key,desc in reportDesc
+            if key in report and (mandatory or report[key]>0)
+        ])
     )
-    return redirect(url_for('ep_advanced'))
+
+@app.route('/deletedata')
+@app.route('/deletedata/<authors>')
+@login_required
+def ep_deletedata(authors='n'):
+    user=g.user
+    if not user.canedit:
+        flashMessage('error','Cannot proceed','user "%s" has no write privileges.' % user.name)
+        return redirect(url_for('ep_advanced'))
+    jobId=dbSubmitJob('delete',user.id,deleteDataJob,authors=='y',user.id)
+    return redirect(url_for('ep_job',jobid=jobId))
+
+# background jobs: titles, and where to go back in case of errors
+jobTitles={
+    'import': 'Import data',
+    'export': 'Export data',
+    'delete': 'Delete data',
+}
+jobMenus={
+    'import': 'ep_importdata',
+    'export': 'ep_exportdata',
+    'delete': 'ep_advanced',
+}
+
+def getUserJob(jobid):
+    '''
+        Returns the status of a job if it belongs to the current user
+    '''
+    job=dbGetJob(jobid)
+    if job is not None and job['userid']==g.user.id:
+        return job
+    else:
+        return None
+
+@app.route('/job/<jobid>')
+@login_required
+def ep_job(jobid):
+    user=g.user
+    job=getUserJob(jobid)
+    if job is None:
+        flashMessage('critical','Malformed link','this link is invalid.')
+        return redirect(url_for('ep_advanced'))
+    if job['status']=='failed':
+        flashMessage('critical','Error during operation','exception "%s" occurred.' % job['error'])
+        return redirect(url_for(jobMenus[job['kind']]))
+    elif job['status']=='interrupted':
+        flashMessage('critical','Error during operation','the operation was interrupted.')
+        return redirect(url_for(jobMenus[job['kind']]))
+    elif job['status']=='done' and job['kind']=='import':
+        # files already served/displayed are not offered again
+        returnFile=dict(job['result'])
+        for fileKey in ['filename','reportname']:
+            if returnFile[fileKey] is not None and not os.path.isfile(os.path.join(TEMP_DIRECTORY,returnFile[fileKey])):
+                returnFile[fileKey]=None
+        session['returnfile']=returnFile
+        return redirect(url_for('ep_importsucceeded',_step=returnFile['step']))
+    elif job['status']=='done' and job['kind']=='delete':
+        flashMessage('info','Delete succeeded',makeDeleteDataMessage(job['result']))
+        return redirect(url_for('ep_advanced'))
+    else:
+        # in progress (the page reloads itself), or an export ready for download
+        return render_template  (
+                                    'job.html',
+                                    user=user,
+                                    title=jobTitles[job['kind']],
+                                    job=job,
+                                    refresh=job['status'] in ['queued','running'],
+                                )
+
+@app.route('/job/<jobid>/status')
+@login_required
+def ep_jobstatus(jobid):
+    job=getUserJob(jobid)
+    if job is None:
+        return jsonify({'error': 'job not found'}), 404
+    return jsonify({
+        fld: job[fld]
+        for fld in ['id','kind','status','done','total','percent','rate','elapsed','error']
+    })
+
+def _serveOnce(fileName):
+    '''
+        generates the contents of a file, removing it once fully read
+    '''
+    with open(fileName,'rb') as servedFile:
+        for chunk in iter(lambda: servedFile.read(CHUNK_SIZE),b''):
+            yield chunk
+    os.remove(fileName)
+
+@app.route('/job/<jobid>/download')
+@login_required
+def ep_jobdownload(jobid):
+    job=getUserJob(jobid)
+    if job is not None and job['status']=='done' and job['kind']=='export':
+        servedFileName=os.path.join(TEMP_DIRECTORY,job['result']['filename'])
+        if os.path.isfile(servedFileName):
+            return Response (
+                                _serveOnce(servedFileName),
+                                mimetype=job['result']['mimetype'],
+                                headers={
+                                    'Content-Disposition': 'attachment; filename=%s' % job['result']['downloadname'],
+                                },
+                            )
+    flashMessage('critical','Malformed link','this link is invalid.')
+    return redirect(url_for('ep_exportdata'))
 
 @app.route('/confirm/<operation>/<value>',methods=['GET','POST'])
 @login_required
@@ -5,6 +5,19 @@ basedir = os.path.abspath(os.path.dirname(__file__))
 DB_DIRECTORY=os.path.join(basedir,'app/database')
 
 DB_NAME='biblio.db'
+# max number of idle DB connections kept open by each worker process
+DB_POOL_SIZE=4
+# page cache (in KiB) of a DB connection doing a bulk import:
+# the indexes get many scattered writes, which would spill the default (2MB) cache
+DB_BULK_CACHE_SIZE=65536
+# books processed at a time by the (streamed) import steps
+IMPORT_CHUNK_SIZE=1000
+# results of the searches done in memory (e.g. by similarity), kept for paging
+# and going back to them: max number of queries and of (estimated) bytes per process
+QUERY_CACHE_ENTRIES=64
+QUERY_CACHE_BYTES=8*1024*1024
+# largest page the JSON API (/api/books, /api/authors) serves
+API_MAX_RESULTS_PER_PAGE=1000
 
 # stuff for Flask
 WTF_CSRF_ENABLED = True
@@ -25,6 +38,21 @@ if SIMILAR_USE_DIGRAMS:
 else:
     SIMILAR_AUTHOR_THRESHOLD=0.90
     SIMILAR_BOOK_THRESHOLD=0.93
+# batch similarity computations (e.g. on import): 'dict' or 'numpy' (requires numpy)
+SIMILARITY_BACKEND='dict'
+# worker processes sharing those computations (1: all done in-process);
+# smaller batches than SIMILARITY_PARALLEL_MIN_PRODUCTS scalar products are not split
+SIMILARITY_PROCESSES=1
+SIMILARITY_PARALLEL_MIN_PRODUCTS=2000000
+# near-duplicate checks go through a MinHash/LSH candidate index,
+# tuned for this expected recall of the similar pairs (see lshindex.py).
+# Recall costs candidates to check: on the reference catalogue
+# (tests_utils/evaluate_lsh.py), 0.95 takes 2 rows x 64 bands for books,
+# recall 0.98 with about 43% of the books checked (1.6x faster than all),
+# while 0.80 would take 3x42, recall 0.79 with 11% checked (5x faster).
+# Authors: 3x42, recall 0.97 with 15% checked.
+SIMILARITY_LSH_HASHES=128
+SIMILARITY_LSH_RECALL=0.95
 # what are the smallest tokens to employ in similar-search in book titles?
 MINIMUM_SIMILAR_BOOK_TOKEN_SIZE=4
 
@@ -33,3 +61,8 @@ ALLOW_DUPLICATE_BOOKS=True
 
 # temporary directory for storing import-related files
 TEMP_DIRECTORY=os.path.join(basedir,'app/temp')
+
+# background jobs (imports, exports, mass deletions): worker threads
+# of each process, and the DB file (in DB_DIRECTORY) with their status
+JOB_WORKERS=2
+JOBS_DB_NAME='jobs.db'
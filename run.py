@@ -3,6 +3,12 @@
 import sys
 
 from app import app
+from app.database.dbtools import dbGetDatabase, dbReleaseDatabase
+from app.database.migrations import dbCheckSchema
+
+# the DB must have been brought up to date with scripts/db_migrate.py
+dbCheckSchema(dbGetDatabase())
+dbReleaseDatabase()
 
 if __name__=='__main__':
     # if -e flag is specified, enable running as
@@ -25,6 +25,7 @@ from app.database.models import (
                                     Booktype,
                                     Book,
                                 )
+from app.database.migrations import dbMigrate
 from app.database.dbtools import    (
                                         dbAddReplaceAuthor,
                                         dbAddReplaceBook,
@@ -133,6 +134,7 @@ if __name__=='__main__':
 
     if clearToProceed(dbFile):
         db=logDo(lambda: generate_db(dbFile),'Generating DB')
+        logDo(lambda: dbMigrate(db),'Applying schema migrations')
         logDo(lambda: populate_db(db,insertFakeData),'Populating DB')
         logDo(lambda: setRWAttributeForAll(dbFile),'Setting file attributes')
         print('Finished.')
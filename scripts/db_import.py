@@ -15,8 +15,12 @@ from app.database.dbtools import    (
 # import tools are all in this subpackage:
 from app.utils.importlibrary import (
                                                 read_and_parse_csv,
-                                                process_book_list,
+                                                csv_to_ndjson,
+                                                iter_ndjson_books,
+                                                process_books,
+                                                process_book_stream,
                                                 import_from_bilist_json,
+                                                import_from_bilist_ndjson,
                                             )
 
 def clearToExtract(inFile,outFile):
@@ -37,6 +41,12 @@ def clearToExtract(inFile,outFile):
         print('Source file "%s" must exist.' % (inFile))
         return False
 
+def isNdjsonFile(fileName):
+    '''
+        Whether a file is an NDJSON export (as opposed to a CSV)
+    '''
+    return fileName.lower().endswith('.ndjson')
+
 def clearToImport(inFile,actingUser):
     '''
         Asks for confirmation of the insertion into DB
@@ -61,6 +71,8 @@ if __name__=='__main__':
             PROCESS: from the books-only to a books/author bilist, checked for consistency
         (3) -i inputlibrary.json userName
             INSERT: read books/authors's json and insert data into the DB as 'userName'
+    A '.ndjson' file (input or output) is read/written as NDJSON,
+    one book/author per line, a chunk of books at a time.
 '''
 
     # a valid csv file must be provided
@@ -74,16 +86,23 @@ if __name__=='__main__':
                 skipHeader = '-h' in sys.argv[4:]
                 print('SkipHeader="%s"' % ('Y' if skipHeader else 'N'))
                 if clearToExtract(inFile,outFile):
-                    inFileHandle=open(inFile)
-                    parsedCSV=logDo(
-                            lambda: read_and_parse_csv(inFileHandle,skipHeader=skipHeader),
-                            'Reading from "%s"' % inFile
-                    )
-                    logDo(
-                            lambda: open(outFile,'w').write('%s\n' % json.dumps(parsedCSV,indent=4,sort_keys=True)),
-                            'Saving to json "%s"' % outFile
-                    )
-                    warningBooks=len(list(filter(lambda bs: '_warnings' in bs,parsedCSV['books'])))
+                    inFileHandle=open(inFile,newline='')
+                    if isNdjsonFile(outFile):
+                        with open(outFile,'wb') as outFileHandle:
+                            warningBooks=logDo(
+                                    lambda: csv_to_ndjson(inFileHandle,outFileHandle,skipHeader=skipHeader),
+                                    'Converting "%s" to NDJSON "%s"' % (inFile,outFile)
+                            )
+                    else:
+                        parsedCSV=logDo(
+                                lambda: read_and_parse_csv(inFileHandle,skipHeader=skipHeader),
+                                'Reading from "%s"' % inFile
+                        )
+                        logDo(
+                                lambda: open(outFile,'w').write('%s\n' % json.dumps(parsedCSV,indent=4,sort_keys=True)),
+                                'Saving to json "%s"' % outFile
+                        )
+                        warningBooks=len(list(filter(lambda bs: '_warnings' in bs,parsedCSV['books'])))
                     if warningBooks:
                         print('Books with warning: %s. Go and fix them.' % warningBooks)
                     print('Finished.')
@@ -99,16 +118,29 @@ if __name__=='__main__':
                 outFile=sys.argv[3]
                 if clearToExtract(inFile,outFile):
                     inFileHandle=open(inFile)
-                    bilistStructure=logDo(
-                            lambda: process_book_list(inFileHandle),
-                            'Processing book list from "%s"' % inFile
-                    )
-                    logDo(
-                            lambda: open(outFile,'w').write('%s\n' % json.dumps(bilistStructure,indent=4,sort_keys=True)),
-                            'Saving to json "%s"' % outFile
-                    )
-                    warningBooks=len(list(filter(lambda bs: '_warnings' in bs,bilistStructure['books'])))
-                    warningAuthors=len(list(filter(lambda bs: '_warnings' in bs,bilistStructure['authors'])))
+                    if isNdjsonFile(inFile):
+                        books=iter_ndjson_books(inFileHandle)
+                    else:
+                        books=json.load(inFileHandle)['books']
+                    if isNdjsonFile(outFile):
+                        with open(outFile,'wb') as outFileHandle:
+                            warningReport=logDo(
+                                    lambda: process_book_stream(books,outFileHandle),
+                                    'Processing book list from "%s" to NDJSON "%s"' % (inFile,outFile)
+                            )
+                        warningBooks=len(warningReport['books'])
+                        warningAuthors=len(warningReport['authors'])
+                    else:
+                        bilistStructure=logDo(
+                                lambda: process_books(books),
+                                'Processing book list from "%s"' % inFile
+                        )
+                        logDo(
+                                lambda: open(outFile,'w').write('%s\n' % json.dumps(bilistStructure,indent=4,sort_keys=True)),
+                                'Saving to json "%s"' % outFile
+                        )
+                        warningBooks=len(list(filter(lambda bs: '_warnings' in bs,bilistStructure['books'])))
+                        warningAuthors=len(list(filter(lambda bs: '_warnings' in bs,bilistStructure['authors'])))
                     if warningBooks or warningAuthors:
                         print('Authors with warning: %s. Go and fix them.' % warningAuthors)
                         print('Books with warning: %s. Go and fix them.' % warningBooks)
@@ -130,7 +162,11 @@ if __name__=='__main__':
                         if actingUser.canedit:
                             db=logDo(lambda: dbGetDatabase(),'Opening DB')
                             inFileHandle=open(inFile)
-                            result=logDo(lambda: import_from_bilist_json(inFileHandle,actingUser,db), 'Importing from "%s"' % inFile)
+                            if isNdjsonFile(inFile):
+                                importer=import_from_bilist_ndjson
+                            else:
+                                importer=import_from_bilist_json
+                            result=logDo(lambda: importer(inFileHandle,actingUser,db), 'Importing from "%s"' % inFile)
                             print('Insertion log:')
                             for k,v in sorted(result.items()):
                                 print('  # %s' % k)
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# Application of the pending schema migrations (indexes, ...) to the DB
+
+from __future__ import print_function
+
+import os
+import sys
+import sqlite3
+
+import env
+
+from config import DB_DIRECTORY, DB_NAME
+from app.utils.interactive import ask_for_confirmation, logDo
+
+from app.database.dbtools import dbGetDatabase
+from app.database.migrations import (
+                                        getSchemaVersion,
+                                        pendingMigrations,
+                                        ensureTables,
+                                        applyMigration,
+                                        explainQuery,
+                                    )
+from app.database.lshindex import dbEnsureLshIndex
+
+def printPlans(title,plans):
+    '''
+        Prints a list of (sql, plan, elapsed) triples
+        (plan None for a query on a table not existing yet)
+    '''
+    print('    %s:' % title)
+    for sql,plan,elapsed in plans:
+        print('      %s' % sql)
+        if plan is None:
+            print('        n/a (table not yet created)')
+        else:
+            print('        (%.3f ms) %s' % (elapsed*1000.0,' / '.join(plan)))
+
+def probeQuery(db,sql,params):
+    '''
+        Returns the (plan, elapsed) of a probe query,
+        (None, None) if it refers to a table not created yet
+        (as probes of a migration creating tables do before it)
+    '''
+    try:
+        return explainQuery(db,sql,params)
+    except sqlite3.OperationalError as e:
+        if 'no such table' in str(e):
+            return None,None
+        raise
+
+def probeMigration(db,migration):
+    '''
+        Runs the probe queries of a migration,
+        returns a list of (sql, plan, elapsed)
+    '''
+    return [
+        (sql,)+probeQuery(db,sql,params)
+        for sql,params in migration['probes']
+    ]
+
+if __name__=='__main__':
+    '''
+        Applies all pending migrations to the DB, reporting for each
+        the query plans (and timings) of its probe queries before and after.
+        With -y no confirmation is asked.
+    '''
+    dbFile=os.path.join(DB_DIRECTORY,DB_NAME)
+    print('Database file: %s' % dbFile)
+    db=dbGetDatabase()
+    logDo(lambda: ensureTables(db),'Checking tables')
+    print('Schema version: %i' % getSchemaVersion(db))
+    migrations=pendingMigrations(db)
+    if len(migrations)==0:
+        print('No pending migrations.')
+    else:
+        print('Pending migrations:')
+        for migration in migrations:
+            print('  %i: %s' % (migration['version'],migration['description']))
+        if '-y' in sys.argv[1:] or ask_for_confirmation('Apply the migrations?',['y','yes','yeah']):
+            for migration in migrations:
+                print('Migration %i' % migration['version'])
+                plansBefore=probeMigration(db,migration)
+                logDo(lambda: applyMigration(db,migration),'    Applying')
+                plansAfter=probeMigration(db,migration)
+                printPlans('Before',plansBefore)
+                printPlans('After',plansAfter)
+            print('Schema version: %i' % getSchemaVersion(db))
+        else:
+            print('Operation aborted.')
+            sys.exit(1)
+    rebuiltEntities=logDo(lambda: dbEnsureLshIndex(db),'Checking the LSH index layout')
+    if rebuiltEntities:
+        print('Rebuilt the LSH index of: %s' % ', '.join(rebuiltEntities))
+    print('Finished.')
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# Consistency check (and rebuild) of the statistics and of the house book counters
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+
+import env
+
+from config import DB_DIRECTORY, DB_NAME
+from app.utils.interactive import ask_for_confirmation, logDo
+
+from app.database.models import (
+                                    Book,
+                                    Author,
+                                )
+from app.database.dbtools import dbGetDatabase
+from app.statistics.statistics import statFromBook, statFromAuthor
+
+# rows between two progress lines
+PROGRESS_EVERY=100000
+
+def streamStatistics(db,tableName,statExtractor,statTotals,houseCounts=None):
+    '''
+        Adds to statTotals the statistics of all rows of a table,
+        reading them one at a time (memory does not grow with the table).
+        If houseCounts is given, the rows are counted by house as well.
+        Returns the number of rows and the elapsed time.
+    '''
+    qModel={'book': Book, 'author': Author}[tableName]
+    mgr=qModel.manager(db)
+    startTime=time.time()
+    nRows=0
+    for row in db.execute('SELECT * FROM %s' % qModel.__name__):
+        obj=mgr.create(**row)
+        for statKey,value in statExtractor(obj).items():
+            statTotals[statKey]=statTotals.get(statKey,0)+value
+        if houseCounts is not None:
+            houseCounts[obj.house]=houseCounts.get(obj.house,0)+1
+        nRows+=1
+        if nRows % PROGRESS_EVERY==0:
+            print('      %i rows (%.0f rows/s)' % (nRows,nRows/(time.time()-startTime)))
+    return nRows,time.time()-startTime
+
+def storedStatistics(db):
+    '''
+        Map (name,subtype) -> value of the stored statistics
+    '''
+    storedTotals={}
+    for row in db.execute('SELECT name, subtype, value FROM Statistic'):
+        statKey=(row['name'],row['subtype'])
+        storedTotals[statKey]=storedTotals.get(statKey,0)+row['value']
+    return storedTotals
+
+def diffCounters(computed,stored):
+    '''
+        Returns the sorted list of (key, stored, computed)
+        for the keys whose values differ (missing means zero)
+    '''
+    return sorted(
+        (key,stored.get(key,0),computed.get(key,0))
+        for key in set(computed.keys()) | set(stored.keys())
+        if stored.get(key,0)!=computed.get(key,0)
+    )
+
+def rewriteCounters(db,statTotals,houseCounts):
+    '''
+        Overwrites the stored statistics (stored keys not found
+        anymore are set to zero) and the house book counters.
+        Does not commit.
+    '''
+    db.execute('UPDATE Statistic SET value=0')
+    db.connection.executemany(
+        'INSERT INTO Statistic (name, subtype, value) VALUES (?,?,?) '
+        'ON CONFLICT (name, subtype) DO UPDATE SET value=excluded.value',
+        [
+            (statName,statSubtype,value)
+            for (statName,statSubtype),value in statTotals.items()
+        ],
+    )
+    db.execute('UPDATE House SET nbooks=0')
+    db.connection.executemany(
+        'UPDATE House SET nbooks=? WHERE name=?',
+        [(nbooks,houseName) for houseName,nbooks in houseCounts.items()],
+    )
+
+if __name__=='__main__':
+    '''
+        Recomputes all statistics (statFromBook/statFromAuthor) and the
+        house book counters in a single pass over the books and authors,
+        and reports the differences with the stored values.
+        With -w the stored values are then rewritten (with -y
+        no confirmation is asked). The whole operation runs in one
+        transaction, which with -w also keeps writers out meanwhile.
+    '''
+    qargs=sys.argv[1:]
+    rewrite='-w' in qargs
+    dbFile=os.path.join(DB_DIRECTORY,DB_NAME)
+    print('Database file: %s' % dbFile)
+    if rewrite and not ('-y' in qargs or ask_for_confirmation('Rewrite the stored statistics?',['y','yes','yeah'])):
+        print('Operation aborted.')
+        sys.exit(1)
+    db=dbGetDatabase()
+    db.execute('BEGIN IMMEDIATE' if rewrite else 'BEGIN')
+    try:
+        statTotals={}
+        houseCounts={}
+        for tableName,statExtractor,tableHouseCounts in [
+            ('book',statFromBook,houseCounts),
+            ('author',statFromAuthor,None),
+        ]:
+            print('  Scanning %ss' % tableName)
+            nRows,elapsed=streamStatistics(db,tableName,statExtractor,statTotals,tableHouseCounts)
+            print('    %i rows in %.2f s (%.0f rows/s)' % (
+                nRows,
+                elapsed,
+                nRows/elapsed if elapsed>0 else 0.0,
+            ))
+        storedHouseCounts={
+            row['name']: row['nbooks']
+            for row in db.execute('SELECT name, nbooks FROM House')
+        }
+        statDiffs=diffCounters(statTotals,storedStatistics(db))
+        # books in unknown houses have no counter to fix
+        houseDiffs=diffCounters(
+            {houseName: houseCounts.get(houseName,0) for houseName in storedHouseCounts},
+            storedHouseCounts,
+        )
+        print('  Statistics differing: %i' % len(statDiffs))
+        for (statName,statSubtype),stored,computed in statDiffs:
+            print('    %s[%s]: stored %i, computed %i' % (statName,statSubtype,stored,computed))
+        print('  House counters differing: %i' % len(houseDiffs))
+        for houseName,stored,computed in houseDiffs:
+            print('    %s: stored %i, computed %i' % (houseName,stored,computed))
+        if rewrite and (statDiffs or houseDiffs):
+            logDo(lambda: rewriteCounters(db,statTotals,houseCounts),'  Rewriting')
+            logDo(lambda: db.commit(),'  Committing to DB')
+        else:
+            db.connection.rollback()
+    except:
+        db.connection.rollback()
+        raise
+    print('Finished.')
@@ -0,0 +1,66 @@
+# ascii_checks benchmark: translation-table functions vs the reference ones
+
+import random
+import sys
+import time
+
+import env
+
+from app.utils.ascii_checks import (
+                                        validCharacters,
+                                        translatedCharacters,
+                                        isAscii,
+                                        ascifiiString,
+                                        referenceIsAscii,
+                                        referenceAscifiiString,
+                                    )
+
+def randomField(rnd,accentedFraction):
+    '''
+        a title/name-like string, with a few accented letters in some of them
+    '''
+    letters=validCharacters[33:]
+    accented=''.join(translatedCharacters.keys())
+    isAccented=rnd.random()<accentedFraction
+    return ' '.join(
+        ''.join(
+            rnd.choice(accented) if isAccented and rnd.random()<0.1 else rnd.choice(letters)
+            for _ in range(rnd.randint(2,9))
+        )
+        for _ in range(rnd.randint(1,5))
+    )
+
+def timeFunction(function,fields):
+    startTime=time.time()
+    results=[function(field) for field in fields]
+    return results,time.time()-startTime
+
+def main():
+    '''
+        Usage: benchmark_ascii.py [numFields [accentedFraction]]
+    '''
+    numFields=int(sys.argv[1]) if len(sys.argv)>1 else 200000
+    accentedFraction=float(sys.argv[2]) if len(sys.argv)>2 else 0.1
+    rnd=random.Random(123)
+    fields=[randomField(rnd,accentedFraction) for _ in range(numFields)]
+    print('%i fields (%.0f%% with accented letters)' % (numFields,100*accentedFraction))
+    for functionName,function,referenceFunction in [
+        ('isAscii',isAscii,referenceIsAscii),
+        ('ascifiiString',ascifiiString,referenceAscifiiString),
+        (
+            'ascifiiString(forced)',
+            lambda s: ascifiiString(s,forceAsciification=True),
+            lambda s: referenceAscifiiString(s,forceAsciification=True),
+        ),
+    ]:
+        referenceResults,referenceTime=timeFunction(referenceFunction,fields)
+        results,newTime=timeFunction(function,fields)
+        print('  %s:' % functionName)
+        print('    reference : %8.3f s' % referenceTime)
+        print('    table     : %8.3f s' % newTime)
+        print('    results match: %s' % (results==referenceResults))
+        print('    speedup: %.1fx' % (referenceTime/newTime if newTime>0 else float('inf')))
+    print('Done.')
+
+if __name__=='__main__':
+    main()
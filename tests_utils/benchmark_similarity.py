@@ -0,0 +1,84 @@
+# similarity backends benchmark: dict (reference) vs numpy, and the process-pool mode
+
+from __future__ import print_function
+
+import random
+import sys
+import time
+
+import env
+
+from app.utils.string_vectorizer import (
+                                            makeIntoVector,
+                                            dictSimilarPairs,
+                                            serialSimilarPairs,
+                                        )
+from app.utils.parallel_vectorizer import parallelSimilarPairs
+from config import SIMILAR_BOOK_THRESHOLD
+
+def randomTitle(rnd):
+    '''
+        a title-like string of a few random words
+    '''
+    return ' '.join(
+        ''.join(rnd.choice('abcdefghilmnoprstuvz') for _ in range(rnd.randint(2,9)))
+        for _ in range(rnd.randint(1,5))
+    )
+
+def timeBackend(pairsFunction,queryVectors,targetVectors,onlyPrevious=False):
+    startTime=time.time()
+    pairs=pairsFunction(queryVectors,targetVectors,SIMILAR_BOOK_THRESHOLD,onlyPrevious)
+    return pairs,time.time()-startTime
+
+def compareParallel(numProcesses,queryVectors,targetVectors):
+    '''
+        serial vs process-pool mode (with the configured backend),
+        for query-target comparisons and within the queries
+    '''
+    for onlyPrevious,qTargets in [(False,targetVectors),(True,queryVectors)]:
+        serialPairs,serialTime=timeBackend(serialSimilarPairs,queryVectors,qTargets,onlyPrevious)
+        parallelPairs,parallelTime=timeBackend(
+            lambda *args: parallelSimilarPairs(*(args+(numProcesses,))),
+            queryVectors,
+            qTargets,
+            onlyPrevious,
+        )
+        print('  %s:' % ('within queries' if onlyPrevious else 'queries x targets'))
+        print('    serial     : %8.3f s (%i pairs)' % (serialTime,sum(map(len,serialPairs))))
+        print('    %2i process : %8.3f s (%i pairs)' % (numProcesses,parallelTime,sum(map(len,parallelPairs))))
+        print('    results match: %s' % (serialPairs==parallelPairs))
+        print('    speedup: %.1fx' % (serialTime/parallelTime if parallelTime>0 else float('inf')))
+
+def main():
+    '''
+        Usage: benchmark_similarity.py [numQueries [numTargets [numProcesses]]]
+        (with numProcesses the process-pool mode is compared as well)
+    '''
+    numQueries=int(sys.argv[1]) if len(sys.argv)>1 else 500
+    numTargets=int(sys.argv[2]) if len(sys.argv)>2 else 5000
+    numProcesses=int(sys.argv[3]) if len(sys.argv)>3 else None
+    rnd=random.Random(123)
+    targetVectors=[makeIntoVector(randomTitle(rnd)) for _ in range(numTargets)]
+    # queries: half perturbed copies of targets, half random
+    queryVectors=[
+        makeIntoVector(randomTitle(rnd)) if i%2 else targetVectors[rnd.randrange(numTargets)]
+        for i in range(numQueries)
+    ]
+    print('%i queries x %i targets' % (numQueries,numTargets))
+    if numProcesses is not None:
+        compareParallel(numProcesses,queryVectors,targetVectors)
+    dictPairs,dictTime=timeBackend(dictSimilarPairs,queryVectors,targetVectors)
+    print('  dict  : %8.3f s (%i pairs)' % (dictTime,sum(map(len,dictPairs))))
+    try:
+        from app.utils.numpy_vectorizer import numpySimilarPairs
+    except ImportError:
+        print('  numpy : not available')
+        return
+    numpyPairs,numpyTime=timeBackend(numpySimilarPairs,queryVectors,targetVectors)
+    print('  numpy : %8.3f s (%i pairs)' % (numpyTime,sum(map(len,numpyPairs))))
+    print('  results match: %s' % (dictPairs==numpyPairs))
+    print('  speedup: %.1fx' % (dictTime/numpyTime if numpyTime>0 else float('inf')))
+    print('Done.')
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,130 @@
+# offline evaluation of the LSH candidate index vs the brute-force near-duplicate checks
+
+from __future__ import print_function
+
+import sys
+import time
+
+import env
+
+from config import SIMILARITY_LSH_HASHES, SIMILARITY_LSH_RECALL
+from app.utils.string_vectorizer import scalProd
+from app.database.dbtools import dbGetDatabase
+from app.database.vectorstore import dbLoadVectors
+from app.database.lshindex import (
+                                        lshFields,
+                                        lshThresholds,
+                                        lshPairJaccards,
+                                        lshLayout,
+                                        expectedRecall,
+                                        makeHashTables,
+                                        bandBuckets,
+                                    )
+
+def isSimilar(qVectors,oVectors,fields,threshold):
+    '''
+        the exact check, as done in the views
+    '''
+    return any(scalProd(qVectors[field],oVectors[field])>threshold for field in fields)
+
+def jaccard(qVector,oVector):
+    qFeatures=set(qVector.keys())
+    oFeatures=set(oVector.keys())
+    unionSize=len(qFeatures|oFeatures)
+    return len(qFeatures&oFeatures)/float(unionSize) if unionSize else 0.0
+
+def pairJaccard(qVectors,oVectors,fields,threshold):
+    '''
+        the Jaccard similarity of a similar pair: the largest
+        among the fields passing the threshold
+    '''
+    return max(
+        jaccard(qVectors[field],oVectors[field])
+        for field in fields
+        if scalProd(qVectors[field],oVectors[field])>threshold
+    )
+
+def quantiles(values,numQuantiles=20):
+    sortedValues=sorted(values)
+    return [
+        round(sortedValues[int(len(sortedValues)*(index+0.5)/numQuantiles)],2)
+        for index in range(numQuantiles)
+    ]
+
+def evaluateEntity(entity,vectorMap,numHashes,recall):
+    fields=lshFields[entity]
+    threshold=lshThresholds[entity]
+    layout=lshLayout(numHashes,lshPairJaccards[entity],recall)
+    hashTables=makeHashTables(numHashes)
+    itemIds=sorted(vectorMap.keys())
+    print('  %s: %i items, layout %i rows x %i bands' % (entity,len(itemIds),layout[0],layout[1]))
+    # in-memory index: (field,band,bucket) -> ids
+    buckets={}
+    for itemId in itemIds:
+        for field in fields:
+            for band,bucket in bandBuckets(vectorMap[itemId][field],layout,hashTables):
+                buckets.setdefault((field,band,bucket),set()).add(itemId)
+    # brute force: each item against all others
+    startTime=time.time()
+    truePairs=set()
+    for qId in itemIds:
+        for oId in itemIds:
+            if oId!=qId and isSimilar(vectorMap[qId],vectorMap[oId],fields,threshold):
+                truePairs.add((qId,oId))
+    bruteTime=time.time()-startTime
+    # lsh: candidates only
+    startTime=time.time()
+    foundPairs=set()
+    numCandidates=0
+    for qId in itemIds:
+        candidates=set()
+        for field in fields:
+            for band,bucket in bandBuckets(vectorMap[qId][field],layout,hashTables):
+                candidates|=buckets.get((field,band,bucket),set())
+        candidates.discard(qId)
+        numCandidates+=len(candidates)
+        for oId in candidates:
+            if isSimilar(vectorMap[qId],vectorMap[oId],fields,threshold):
+                foundPairs.add((qId,oId))
+    lshTime=time.time()-startTime
+    #
+    print('    similar pairs        : %i' % len(truePairs))
+    print('    expected recall      : %.4f' % expectedRecall(layout,lshPairJaccards[entity]))
+    print('    recall               : %.4f' % (
+        len(foundPairs & truePairs)/float(len(truePairs)) if truePairs else 1.0
+    ))
+    print('    candidates per check : %.1f (%.2f%% of the items)' % (
+        numCandidates/float(len(itemIds)) if itemIds else 0.0,
+        100.0*numCandidates/float(len(itemIds)**2) if itemIds else 0.0,
+    ))
+    print('    brute force          : %.3f s' % bruteTime)
+    print('    lsh                  : %.3f s (speedup %.1fx)' % (
+        lshTime,
+        bruteTime/lshTime if lshTime>0 else float('inf'),
+    ))
+    if truePairs:
+        # each pair once, to be compared with (or to replace) lshPairJaccards
+        print('    pair Jaccard quantiles (%s):' % entity)
+        print('      %s' % quantiles([
+            pairJaccard(vectorMap[qId],vectorMap[oId],fields,threshold)
+            for qId,oId in truePairs
+            if qId<oId
+        ]))
+
+def main():
+    '''
+        Usage: evaluate_lsh.py [recallTarget [numHashes]]
+        (defaults from config.py). Runs on the vectors stored in the DB,
+        with the layout derived from lshindex.lshPairJaccards: the
+        quantiles measured here replace these to tune for this DB.
+    '''
+    recall=float(sys.argv[1]) if len(sys.argv)>1 else SIMILARITY_LSH_RECALL
+    numHashes=int(sys.argv[2]) if len(sys.argv)>2 else SIMILARITY_LSH_HASHES
+    db=dbGetDatabase()
+    print('Recall target %.3f, %i hashes' % (recall,numHashes))
+    for entity in sorted(lshFields.keys()):
+        evaluateEntity(entity,dbLoadVectors(db,entity),numHashes,recall)
+    print('Done.')
+
+if __name__=='__main__':
+    main()
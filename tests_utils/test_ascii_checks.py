@@ -0,0 +1,80 @@
+# ascii_checks tester: the translation-table functions vs the reference ones, on random strings
+
+import random
+import sys
+
+import env
+
+from app.utils.ascii_checks import (
+                                        validCharacters,
+                                        translatedCharacters,
+                                        nonAsciiCharacters,
+                                        isAscii,
+                                        ascifiiString,
+                                        referenceNonAsciiCharacters,
+                                        referenceIsAscii,
+                                        referenceAscifiiString,
+                                    )
+
+# pools the characters are drawn from: mostly plain, some translated, any unicode
+characterPools=[
+    (validCharacters,0.6),
+    (''.join(translatedCharacters.keys()),0.2),
+    (''.join(map(chr,range(0,32)))+chr(127),0.05),
+    (None,0.15),
+]
+
+def randomCharacter(rnd):
+    poolValue=rnd.random()
+    for pool,probability in characterPools:
+        if poolValue<probability:
+            if pool is None:
+                return chr(rnd.randrange(sys.maxunicode+1))
+            else:
+                return rnd.choice(pool)
+        poolValue-=probability
+    return rnd.choice(validCharacters)
+
+def randomString(rnd):
+    '''
+        a random string, often ascii only
+    '''
+    if rnd.random()<0.3:
+        return ''.join(rnd.choice(validCharacters) for _ in range(rnd.randint(0,40)))
+    else:
+        return ''.join(randomCharacter(rnd) for _ in range(rnd.randint(0,40)))
+
+def main():
+    '''
+        Usage: test_ascii_checks.py [numStrings [seed]]
+    '''
+    numStrings=int(sys.argv[1]) if len(sys.argv)>1 else 100000
+    seed=int(sys.argv[2]) if len(sys.argv)>2 else 123
+    rnd=random.Random(seed)
+    checks=[
+        ('nonAsciiCharacters',nonAsciiCharacters,referenceNonAsciiCharacters),
+        ('isAscii',isAscii,referenceIsAscii),
+        ('ascifiiString',ascifiiString,referenceAscifiiString),
+        (
+            'ascifiiString(forced)',
+            lambda s: ascifiiString(s,forceAsciification=True),
+            lambda s: referenceAscifiiString(s,forceAsciification=True),
+        ),
+    ]
+    mismatches={checkName: 0 for checkName,_,_ in checks}
+    for _ in range(numStrings):
+        qString=randomString(rnd)
+        for checkName,function,referenceFunction in checks:
+            if function(qString)!=referenceFunction(qString):
+                if mismatches[checkName]==0:
+                    print('  %s differs on %s' % (checkName,repr(qString)))
+                mismatches[checkName]+=1
+    print('%i random strings (seed %i)' % (numStrings,seed))
+    for checkName,_,_ in checks:
+        print('  %-22s: %i mismatches' % (checkName,mismatches[checkName]))
+    print('Done.')
+    if any(mismatches.values()):
+        sys.exit(1)
+
+if __name__=='__main__':
+    main()
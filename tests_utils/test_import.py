@@ -0,0 +1,63 @@
+# import tester: runs the three import steps on a small CSV, then rolls back
+
+import io
+import sys
+
+import env
+
+from app.database.dbtools import    (
+                                        dbGetDatabase,
+                                        dbGetAll,
+                                        dbSelectWhere,
+                                    )
+from app.utils.importlibrary import (
+                                        read_and_parse_csv,
+                                        process_books,
+                                        import_from_bilist,
+                                    )
+
+# new authors (a trailing tag makes them unique) and books, one in house and one not
+csvTemplate='''"Importtest%(tag)s, Anna",Primo libro di prova %(tag)s,[IT],M,
+"Importtest%(tag)s, Bruno",Secondo libro di prova %(tag)s (con Anna Importtest%(tag)s),[EN],V,cantina
+'''
+
+def main():
+    db=dbGetDatabase()
+    importingUser=next(
+        (us for us in dbGetAll('user') if us.canedit),
+        None,
+    )
+    if importingUser is None:
+        print('No user can edit the DB.')
+        sys.exit(1)
+    tag=str(1+max([0]+[au.id for au in dbGetAll('author')]))
+    csvText=csvTemplate % {'tag': tag}
+    step1=read_and_parse_csv(io.StringIO(csvText))
+    print('Step 1: %i books' % len(step1['books']))
+    step2=process_books(step1['books'])
+    print('Step 2: %i authors, %i books' % (len(step2['authors']),len(step2['books'])))
+    try:
+        report=import_from_bilist(step2,importingUser,db)
+        insertedAuthors=report['authors_insertion']['success']
+        insertedBooks=report['books_insertion']['success']
+        print('Step 3: %i authors, %i books inserted' % (len(insertedAuthors),len(insertedBooks)))
+        for errorKey,errors in list(report['authors_insertion']['errors'].items())+list(report['books_insertion']['errors'].items()):
+            print('  error on %s: %s' % (errorKey,'; '.join(errors)))
+        newBooks=dbSelectWhere(db,'book','title LIKE ?',['%% di prova %s' % tag])
+        for bo in newBooks:
+            print('  [%i] %s: authors=%s, inhouse=%s' % (bo.id,bo.title,bo.authors,repr(bo.inhouse)))
+        success=(
+            len(insertedAuthors)==2 and
+            len(insertedBooks)==2 and
+            len(newBooks)==2 and
+            all(len(bo.authors)>0 and isinstance(bo.inhouse,int) for bo in newBooks)
+        )
+    finally:
+        # the import does not commit by itself
+        db.connection.rollback()
+    print('Done (rolled back).')
+    if not success:
+        sys.exit(1)
+
+if __name__=='__main__':
+    main()
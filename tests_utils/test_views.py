@@ -1,15 +1,64 @@
 # tools in 'views.py' tester
 
+import sys
+
 import env
 
+from app import app
 from app.views import load_user
+from app.database.dbtools import dbGetAll
+
+# JSON API requests and the expected status
+apiChecks=[
+    ('/api/books?house=-2&fields=id,title',200),
+    ('/api/authors?fields=id,lastname',200),
+    ('/api/books?foo=bar',400),
+    ('/api/authors?foo=bar',400),
+    ('/api/books?startfrom=-5',400),
+    ('/api/books?startfrom=x',400),
+    ('/api/books?fields=title,nofield',400),
+    ('/api/books?resultsperpage=0',400),
+]
+
+def checkApi(user):
+    '''
+        runs the API requests as the given user,
+        returns the number of unexpected results
+    '''
+    app.config['WTF_CSRF_ENABLED']=False
+    client=app.test_client()
+    with client.session_transaction() as sess:
+        # logged in as flask_login does (the key depends on its version)
+        sess['user_id']=sess['_user_id']=str(user.id)
+        sess['_fresh']=True
+    failures=0
+    for url,expectedStatus in apiChecks:
+        response=client.get(url)
+        print('    %-40s -> %i (expected %i)' % (url,response.status_code,expectedStatus))
+        if response.status_code!=expectedStatus:
+            failures+=1
+        if response.status_code!=200 and 'ETag' in response.headers:
+            print('      error response with an ETag')
+            failures+=1
+    # revalidation of an unchanged result
+    url=apiChecks[0][0]
+    etag=client.get(url).headers.get('ETag')
+    status=client.get(url,headers={'If-None-Match': etag}).status_code if etag else None
+    print('    revalidation of %s -> %s (expected 304)' % (url,status))
+    if status!=304:
+        failures+=1
+    return failures
 
 def main():
     print('Loading user 1')
     u=load_user(1)
     print('Loaded %s' % u)
     print ('    name=%s, passwordhash=%s, id=%i' % (u.name,u.passwordhash,u.id))
-    print('Done.')
+    print('JSON API checks:')
+    failures=checkApi(sorted(dbGetAll('user'))[0])
+    print('Done (%i failures).' % failures)
+    if failures:
+        sys.exit(1)
 
 if __name__=='__main__':
     main()
@@ -1,6 +1,12 @@
 #!/usr/bin/env python
 
 from app import app as application
+from app.database.dbtools import dbGetDatabase, dbReleaseDatabase
+from app.database.migrations import dbCheckSchema
+
+# the DB must have been brought up to date with scripts/db_migrate.py
+dbCheckSchema(dbGetDatabase())
+dbReleaseDatabase()
 
 if __name__ == '__main__':
     application.run()